@@ -5,6 +5,9 @@ import sqlite3
 from typing import Optional
 import secrets
 
+from conversation_events import publish
+from conversation_manager import bump_versions
+
 security = HTTPBearer()
 
 # Simple in-memory token storage
@@ -166,7 +169,12 @@ def link_conversation_to_user(conversation_id: str, user_id: int):
             "INSERT OR IGNORE INTO user_conversations (conversation_id, user_id) VALUES (?, ?)",
             (conversation_id, user_id)
         )
+        created = cur.rowcount > 0
+        if created:
+            bump_versions(cur, f"user:{user_id}")
         conn.commit()
+        if created:
+            publish(user_id, "conversation_created", {"conversation_id": conversation_id, "title": "New Chat"})
     except Exception as e:
         print(f"Error linking conversation: {e}")
     finally:
@@ -1,46 +1,215 @@
-def should_generate_chart(query: str, result: dict) -> bool:
-    """Determine if query should generate a chart based on keywords and data structure"""
-    if "error" in result or not result.get("rows"):
-        return False
+import numpy as np
+
+from result_encoding import infer_column_types, result_row_count
+
+# Upper bound on points sent to Chart.js per series
+MAX_POINTS_PER_SERIES = 1000
+# Assumed chart width in pixels when the client does not send one
+DEFAULT_CHART_WIDTH = 800
+# Pivot into per-key series only up to this many distinct keys
+MAX_PIVOT_SERIES = 12
+
+NUMERIC_TYPES = ("integer", "real")
+
+
+def get_columns(result: dict) -> list:
+    """Per-column value lists of a run_sql result in either layout"""
+    if "data" in result:
+        return result["data"]
+    return [list(col) for col in zip(*result.get("rows", []))]
+
+
+def _safe_float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def to_numeric(values: list) -> np.ndarray:
+    """Convert a column to float64; non-numeric cells become 0 like before"""
+    try:
+        arr = np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        arr = np.fromiter((_safe_float(v) for v in values), dtype=np.float64, count=len(values))
+    return np.nan_to_num(arr, nan=0.0, posinf=0.0, neginf=0.0)
+
+
+def to_numeric_keep_nan(values: list) -> np.ndarray:
+    """Convert a column to float64, leaving NULLs as NaN gaps"""
+    try:
+        return np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        return to_numeric(values)
+
 
-    chart_keywords = [
-        'chart', 'graph', 'plot', 'visualize', 'visual',
-        'trend', 'compare', 'comparison', 'distribution',
-        'over time', 'by month', 'by year', 'by category'
+def lttb_indices(y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling over evenly spaced x.
+    Returns the indices of the points to keep, first and last included.
+    """
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.arange(n, dtype=np.float64)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = n - 1
+
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        # Average of the next bucket (the last point for the final bucket)
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(area))
+        keep[i + 1] = a
+    return keep
+
+
+def minmax_indices(y: np.ndarray, buckets: int) -> np.ndarray:
+    """Keep the minimum and maximum of each bucket so peaks survive"""
+    n = len(y)
+    if buckets * 2 >= n or buckets < 1:
+        return np.arange(n)
+
+    usable = n - n % buckets
+    blocks = y[:usable].reshape(buckets, -1)
+    offsets = np.arange(buckets) * blocks.shape[1]
+    picks = np.concatenate([offsets + blocks.argmin(axis=1), offsets + blocks.argmax(axis=1)])
+    if usable < n:
+        picks = np.append(picks, [usable + int(np.argmin(y[usable:])), usable + int(np.argmax(y[usable:]))])
+    return np.unique(picks)
+
+
+def downsample(series: list, chart_type: str, width: int) -> np.ndarray:
+    """
+    Indices shared by all series so that each keeps at most about `width`
+    points: LTTB for line charts, min/max per bucket for everything else.
+    """
+    n = len(series[0]) if series else 0
+    per_series = max(min(width, MAX_POINTS_PER_SERIES) // max(len(series), 1), 3)
+    if n <= per_series:
+        return np.arange(n)
+
+    picks = [
+        lttb_indices(y, per_series) if chart_type == "line" else minmax_indices(y, per_series // 2)
+        for y in series
     ]
+    return np.unique(np.concatenate(picks))
+
 
+CHART_KEYWORDS = [
+    'chart', 'graph', 'plot', 'visualize', 'visual',
+    'trend', 'compare', 'comparison', 'distribution',
+    'over time', 'by month', 'by year', 'by category'
+]
+
+
+def has_chart_intent(query: str) -> bool:
+    """True when the question explicitly asks for a visual answer"""
     q = query.lower()
-    for k in chart_keywords:
-        if k in q:
-            return True
+    return any(k in q for k in CHART_KEYWORDS)
+
 
-    # Auto-detect numeric 2-column output
-    if len(result["columns"]) == 2 and len(result["rows"]) > 1:
-        try:
-            float(result["rows"][0][1])
-            return True
-        except:
-            pass
+def get_column_types(result: dict) -> list:
+    """Column types reported by run_sql, inferred here for older results"""
+    return result.get("types") or infer_column_types(result)
 
-    return False
 
+def plan_axes(result: dict):
+    """
+    Choose the chart axes from the column types:
+        label    - first datetime column, else first text column, else column 0
+        key      - another text column to pivot into one series per value
+        measures - numeric columns plotted on the y axis
+    Returns None when there is nothing numeric to plot.
+    """
+    types = get_column_types(result)
+    measures = [i for i, t in enumerate(types) if t in NUMERIC_TYPES]
+    datetimes = [i for i, t in enumerate(types) if t == "datetime"]
+    texts = [i for i, t in enumerate(types) if t == "text"]
 
-def generate_chart_config(result: dict, query: str):
-    """Generate Chart.js configuration from SQL result"""
+    if datetimes:
+        label = datetimes[0]
+    elif texts:
+        label = texts[0]
+    else:
+        label = 0
+    measures = [i for i in measures if i != label]
+    if not measures:
+        return None
+
+    key = next((i for i in texts if i != label), None)
+    return {"label": label, "key": key, "measures": measures, "types": types}
+
+
+def should_generate_chart(query: str, result: dict) -> bool:
+    """Determine if query should generate a chart based on keywords and column types"""
+    if "error" in result or result_row_count(result) == 0:
+        return False
+
+    if has_chart_intent(query):
+        return True
+
+    axes = plan_axes(result)
+    if axes is None or result_row_count(result) < 2:
+        return False
+
+    # Auto-detect a label plus one measure, or a time series split by a key column
+    if len(result["columns"]) == 2:
+        return True
+    return (
+        len(result["columns"]) == 3
+        and axes["key"] is not None
+        and axes["types"][axes["label"]] == "datetime"
+    )
+
+
+def _first_seen_codes(values: list):
+    """Distinct values in order of first appearance plus each row's position in them"""
+    arr = np.asarray(values, dtype=object).astype(str)
+    uniq, first, inverse = np.unique(arr, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return uniq[order], rank[inverse.reshape(-1)]
+
+
+def _to_json_values(values: np.ndarray) -> list:
+    """Float list with NaN (pivot gaps) turned into null"""
+    return [None if v != v else v for v in values.tolist()]
+
+
+def generate_chart_config(result: dict, query: str, width: int = DEFAULT_CHART_WIDTH):
+    """Generate Chart.js configuration from SQL result, downsampled to the chart width"""
     columns = result["columns"]
-    rows = result["rows"]
+    data = get_columns(result)
 
-    if len(columns) < 2 or not rows:
+    if len(columns) < 2 or not data or not data[0]:
         return None
 
-    labels = [str(row[0]) for row in rows]
+    axes = plan_axes(result)
+    if axes is None:
+        return None
+    label, key, measures = axes["label"], axes["key"], axes["measures"]
+    label_is_time = axes["types"][label] == "datetime"
 
     q = query.lower()
-    chart_type = "bar"
-    if "line" in q or "trend" in q or "over time" in q:
-        chart_type = "line"
-    elif "pie" in q:
+    if "pie" in q:
         chart_type = "pie"
+    elif "line" in q or "trend" in q or "over time" in q or label_is_time:
+        chart_type = "line"
+    else:
+        chart_type = "bar"
 
     colors = [
         'rgba(102, 126, 234, 0.8)',
@@ -50,29 +219,63 @@ def generate_chart_config(result: dict, query: str):
         'rgba(67, 206, 162, 0.8)',
     ]
 
-    datasets = []
-    for i in range(1, len(columns)):
-        data = []
-        for row in rows:
-            try:
-                data.append(float(row[i]))
-            except:
-                data.append(0)
+    total_points = len(data[0])
+    names = []
+    series = []
 
+    key_values = None
+    if key is not None:
+        key_values, key_pos = _first_seen_codes(data[key])
+        if len(key_values) > MAX_PIVOT_SERIES:
+            key_values = None
+
+    if key_values is not None:
+        # Pivot: one series per key value (and measure), aligned on shared labels
+        label_values, label_pos = _first_seen_codes(data[label])
+        for m in measures:
+            grid = np.full((len(key_values), len(label_values)), np.nan)
+            grid[key_pos, label_pos] = to_numeric_keep_nan(data[m])
+            for k, key_value in enumerate(key_values.tolist()):
+                names.append(key_value if len(measures) == 1 else f"{key_value} · {columns[m]}")
+                series.append(grid[k])
+        label_column = label_values.tolist()
+    else:
+        label_column = data[label]
+        for m in measures:
+            names.append(columns[m])
+            series.append(to_numeric(data[m]))
+
+    keep = downsample([np.nan_to_num(s) for s in series], chart_type, width or DEFAULT_CHART_WIDTH)
+    labels = [str(label_column[i]) for i in keep.tolist()]
+
+    datasets = []
+    for i, (name, values) in enumerate(zip(names, series), 1):
         datasets.append({
-            'label': columns[i],
-            'data': data,
+            'label': name,
+            'data': _to_json_values(values[keep]),
             'backgroundColor': colors[i % len(colors)],
             'borderColor': colors[i % len(colors)].replace("0.8", "1"),
-            'borderWidth': 2
+            'borderWidth': 2,
+            'spanGaps': True
         })
 
+    scales = {}
+    if chart_type != "pie":
+        scales = {
+            "x": {"title": {"display": True, "text": columns[label]}},
+            "y": {"beginAtZero": True}
+        }
+        if len(measures) == 1:
+            scales["y"]["title"] = {"display": True, "text": columns[measures[0]]}
+
     return {
         "type": chart_type,
         "data": {
             "labels": labels,
             "datasets": datasets
         },
+        "downsampled": len(keep) < total_points,
+        "total_points": total_points,
         "options": {
             "responsive": True,
             "maintainAspectRatio": False,
@@ -83,8 +286,6 @@ def generate_chart_config(result: dict, query: str):
                 },
                 "title": {"display": False}
             },
-            "scales": {
-                "y": {"beginAtZero": True}
-            } if chart_type != "pie" else {}
+            "scales": scales
         }
-    }
\ No newline at end of file
+    }
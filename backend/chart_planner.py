@@ -0,0 +1,113 @@
+import re
+from datetime import datetime
+
+from chart_generator import has_chart_intent, DEFAULT_CHART_WIDTH, MAX_POINTS_PER_SERIES, NUMERIC_TYPES
+from db import run_sql
+
+# (name, approximate seconds, SQLite expression template), smallest first
+TIME_BUCKETS = [
+    ("hour", 3600, "strftime('%Y-%m-%d %H:00', {col})"),
+    ("day", 86400, "date({col})"),
+    ("week", 7 * 86400, "date({col}, '-6 days', 'weekday 1')"),
+    ("month", 30 * 86400, "strftime('%Y-%m', {col})"),
+]
+
+
+def _quote(name: str) -> str:
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def pick_aggregate(query: str) -> str:
+    """Aggregate for the measure columns, following the wording of the question"""
+    q = query.lower()
+    if re.search(r"\b(total|sum)\b", q):
+        return "SUM"
+    if re.search(r"\b(peak|max|maximum|highest)\b", q):
+        return "MAX"
+    if re.search(r"\b(min|minimum|lowest)\b", q):
+        return "MIN"
+    return "AVG"
+
+
+def pick_bucket(range_seconds: float, target_points: int):
+    """Smallest bucket that brings the time range under the target resolution"""
+    needed = range_seconds / max(target_points, 1)
+    for bucket in TIME_BUCKETS:
+        if bucket[1] >= needed:
+            return bucket
+    return TIME_BUCKETS[-1]
+
+
+def _time_range_seconds(values: list):
+    """Seconds between the earliest and latest ISO datetime, or None"""
+    values = [v for v in values if v is not None]
+    if not values:
+        return None
+    try:
+        # ISO strings sort chronologically
+        return (datetime.fromisoformat(max(values)) - datetime.fromisoformat(min(values))).total_seconds()
+    except (TypeError, ValueError):
+        return None
+
+
+def plan_chart_query(sql: str, query: str, width: int = None, parameterized: bool = False):
+    """
+    Before a validated statement runs, detect a time series (datetime first
+    column plus numeric measures) with too many rows to chart point by point
+    and return a bucketed aggregate of it for SQLite to compute instead:
+
+        {"sql": ..., "bucket": "day", "aggregate": "AVG"}
+
+    Decided from bounded probes rather than the full result: one row for the
+    column types (refined by the declared column types), a row count capped
+    just past the chart width, and only then MIN/MAX of the time column.
+    Returns None when the statement should run as is.
+    """
+    target_points = min(width or DEFAULT_CHART_WIDTH, MAX_POINTS_PER_SERIES)
+
+    sample = run_sql(f"SELECT * FROM ({sql}) LIMIT 1", parameterized=parameterized)
+    if "error" in sample or not sample["rows"]:
+        return None
+    columns = sample["columns"]
+    types = sample["types"]
+    if len(columns) < 2 or types[0] != "datetime":
+        return None
+
+    measures = [c for c, t in zip(columns[1:], types[1:]) if t in NUMERIC_TYPES]
+    keys = [c for c, t in zip(columns[1:], types[1:]) if t == "text"]
+    if not measures:
+        return None
+
+    # Only reshape results that will be charted anyway
+    if not has_chart_intent(query) and len(columns) != 2 and not (len(keys) == 1 and len(measures) == 1):
+        return None
+
+    label = _quote(columns[0])
+    counted = run_sql(
+        f"SELECT COUNT(*) FROM (SELECT 1 FROM ({sql}) LIMIT {target_points + 1})",
+        parameterized=parameterized,
+    )
+    if "error" in counted or counted["rows"][0][0] <= target_points:
+        return None
+
+    bounds = run_sql(f"SELECT MIN({label}), MAX({label}) FROM ({sql})", parameterized=parameterized)
+    if "error" in bounds:
+        return None
+    range_seconds = _time_range_seconds(list(bounds["rows"][0]))
+    if not range_seconds:
+        return None
+
+    name, _, template = pick_bucket(range_seconds, target_points)
+    aggregate = pick_aggregate(query)
+    bucket_expr = template.format(col=label)
+
+    select = [f"{bucket_expr} AS {label}"]
+    select += [_quote(k) for k in keys]
+    select += [f"{aggregate}({_quote(m)}) AS {_quote(m)}" for m in measures]
+    group_by = ", ".join(str(i) for i in range(1, len(keys) + 2))
+
+    bucketed_sql = (
+        f"SELECT {', '.join(select)} FROM ({sql}) "
+        f"GROUP BY {group_by} ORDER BY 1"
+    )
+    return {"sql": bucketed_sql, "bucket": name, "aggregate": aggregate}
@@ -0,0 +1,130 @@
+"""
+Per-user push channel for conversation changes.
+
+conversation_manager publishes an event after each committed write:
+
+    conversation_created  {conversation_id, title, created_at}
+    message_created       {conversation_id, id, query, sql, created_at}
+    title_updated         {conversation_id, title}
+    conversation_deleted  {conversation_id}
+    resync                {}   (state changed in bulk; reload the list)
+
+/conversations/events streams them to the user's open tabs as Server-Sent
+Events. Each user keeps the last EVENT_BACKLOG events so a client that
+reconnects with Last-Event-ID only receives what it missed; if that is no
+longer available it gets a resync event instead.
+
+Subscribers live in this process, so with several API workers each client
+only sees events from writes handled by the worker it is connected to.
+"""
+import asyncio
+import json
+import threading
+from collections import deque
+
+# Events kept per user for reconnecting clients
+EVENT_BACKLOG = 100
+# Undelivered events per connection before it is told to resync
+MAX_QUEUED_EVENTS = 100
+# Comment lines sent on idle connections so proxies keep them open
+HEARTBEAT_SECONDS = 15
+
+RESYNC = "resync"
+
+_lock = threading.Lock()
+_subscribers = {}  # {user_id: set of Subscription}
+_backlog = {}  # {user_id: deque of (seq, event)}
+_sequence = {}  # {user_id: last seq}
+
+
+class Subscription:
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=MAX_QUEUED_EVENTS)
+
+    def deliver(self, item):
+        """Hand an event to the connection's loop (callable from any thread)"""
+        def put():
+            try:
+                self.queue.put_nowait(item)
+            except asyncio.QueueFull:
+                # Slow client: drop what is queued and ask it to reload
+                while not self.queue.empty():
+                    self.queue.get_nowait()
+                self.queue.put_nowait((None, {"type": RESYNC, "data": {}}))
+        self.loop.call_soon_threadsafe(put)
+
+
+def publish(user_id: int, event_type: str, data: dict = None):
+    """Send an event to every open channel of a user"""
+    event = {"type": event_type, "data": data or {}}
+    with _lock:
+        seq = _sequence.get(user_id, 0) + 1
+        _sequence[user_id] = seq
+        _backlog.setdefault(user_id, deque(maxlen=EVENT_BACKLOG)).append((seq, event))
+        subscribers = list(_subscribers.get(user_id, ()))
+    for subscription in subscribers:
+        try:
+            subscription.deliver((seq, event))
+        except RuntimeError:
+            # Its event loop has closed
+            unsubscribe(subscription)
+
+
+def subscribe(user_id: int, last_event_id: str = None):
+    """
+    Open a channel for a user. Returns (subscription, missed events); the
+    missed events are the backlog after last_event_id, or a single resync
+    event when the client is too far behind.
+    """
+    subscription = Subscription(user_id)
+    with _lock:
+        _subscribers.setdefault(user_id, set()).add(subscription)
+        backlog = list(_backlog.get(user_id, ()))
+        current = _sequence.get(user_id, 0)
+
+    missed = []
+    if last_event_id and last_event_id.isdigit():
+        last_seq = int(last_event_id)
+        if last_seq < current:
+            missed = [(seq, event) for seq, event in backlog if seq > last_seq]
+            if not backlog or backlog[0][0] > last_seq + 1:
+                missed = [(current, {"type": RESYNC, "data": {}})]
+    return subscription, missed
+
+
+def unsubscribe(subscription: Subscription):
+    with _lock:
+        subscribers = _subscribers.get(subscription.user_id)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del _subscribers[subscription.user_id]
+
+
+def format_sse(seq, event: dict) -> str:
+    lines = []
+    if seq is not None:
+        lines.append(f"id: {seq}")
+    lines.append(f"event: {event['type']}")
+    lines.append(f"data: {json.dumps(event['data'], default=str)}")
+    return "\n".join(lines) + "\n\n"
+
+
+async def event_stream(subscription: Subscription, missed: list, is_disconnected):
+    """SSE text for one connection until the client goes away"""
+    try:
+        for seq, event in missed:
+            yield format_sse(seq, event)
+        while True:
+            try:
+                seq, event = await asyncio.wait_for(subscription.queue.get(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                if await is_disconnected():
+                    break
+                yield ": keep-alive\n\n"
+                continue
+            yield format_sse(seq, event)
+    finally:
+        unsubscribe(subscription)
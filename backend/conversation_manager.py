@@ -1,9 +1,45 @@
+import html
+import json
+import re
 import sqlite3
 from typing import Optional, List, Dict
 from datetime import datetime
 
+from conversation_events import publish
+from sql_validator import normalize_sql
+
 DB_PATH = "./../mydata.db"
 
+# Raw {query, sql} pairs sent to the model per follow-up
+MAX_CONTEXT_EXCHANGES = 7
+# Above this estimated size the raw pairs are replaced by the rolling summary
+CONTEXT_TOKEN_BUDGET = 400
+
+# Bounds on the rolling summary so its size stays flat as a conversation grows
+SUMMARY_MAX_TABLES = 8
+SUMMARY_MAX_FILTERS = 5
+SUMMARY_MAX_QUESTIONS = 3
+SUMMARY_TEXT_LIMIT = 200
+
+# Sidebar titles are the conversation's first question, cut to this length
+TITLE_LENGTH = 50
+
+# Change counter bumped by the maintenance job whenever retention deletes rows
+RETENTION_SCOPE = "retention"
+
+# Full-text search over conversation_history(query, sql)
+SEARCH_TABLE = "conversation_search"
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE_SIZE = 100
+# bm25 column weights: matches in the question count more than in the SQL;
+# user_id is only indexed to scope matches to one user
+SEARCH_WEIGHTS = (2.0, 1.0, 0.0)
+SNIPPET_TOKENS = 12
+SEARCH_TERM_RE = re.compile(r"\w+", re.UNICODE)
+
+TABLE_RE = re.compile(r"\b(?:FROM|JOIN) ([\w.]+)")
+FILTER_RE = re.compile(r"\bWHERE (.+?)(?= GROUP BY| ORDER BY| LIMIT| HAVING|\)|$)")
+
 def init_user_context(user_id: int):
     """Initialize context storage for a user - creates tables if needed"""
     conn = sqlite3.connect(DB_PATH)
@@ -38,6 +74,21 @@ def init_user_context(user_id: int):
             CREATE INDEX IF NOT EXISTS idx_conversation_history_user_conv 
             ON conversation_history(user_id, conversation_id)
         """)
+
+        # Rolling compressed context, one row per conversation
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS conversation_summary (
+                conversation_id TEXT PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                summary TEXT NOT NULL,
+                turns INTEGER NOT NULL,
+                updated_at TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users(id)
+            )
+        """)
+
+        ensure_versions_table(cur)
+        ensure_search_index(cur)
         
         conn.commit()
     except Exception as e:
@@ -45,6 +96,151 @@ def init_user_context(user_id: int):
     finally:
         conn.close()
 
+def ensure_versions_table(cur):
+    """
+    Change counters for HTTP caching: "user:<id>" moves whenever the user's
+    conversation list changes, "conversation:<id>" when its messages do.
+    """
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS conversation_versions (
+            scope TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+
+def bump_versions(cur, *scopes: str):
+    """Advance change counters inside the caller's write transaction"""
+    ensure_versions_table(cur)
+    for scope in scopes:
+        cur.execute("""
+            INSERT INTO conversation_versions (scope, version) VALUES (?, 1)
+            ON CONFLICT(scope) DO UPDATE SET version = version + 1
+        """, (scope,))
+
+def get_versions(*scopes: str) -> tuple:
+    """Current counters of the given scopes plus the retention counter"""
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        scopes = scopes + (RETENTION_SCOPE,)
+        rows = dict(conn.execute(
+            f"SELECT scope, version FROM conversation_versions "
+            f"WHERE scope IN ({', '.join('?' * len(scopes))})",
+            scopes
+        ).fetchall())
+        return tuple(rows.get(scope, 0) for scope in scopes)
+    except sqlite3.OperationalError:
+        # Table not created yet: nothing has changed
+        return (0,) * len(scopes)
+    finally:
+        conn.close()
+
+def ensure_search_index(cur):
+    """
+    FTS5 index over conversation_history, kept in sync by triggers so
+    saves, clears and retention deletes all update it. user_id is indexed
+    too, so a search only walks the user's own entries instead of ranking
+    every user's matches. Existing history is indexed once when the index
+    is first created.
+    """
+    cur.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (SEARCH_TABLE,))
+    if cur.fetchone():
+        return
+    cur.execute(f"""
+        CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5(
+            query, sql, user_id, content='conversation_history', content_rowid='id'
+        )
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{SEARCH_TABLE}_insert
+        AFTER INSERT ON conversation_history BEGIN
+            INSERT INTO {SEARCH_TABLE} (rowid, query, sql, user_id)
+            VALUES (new.id, new.query, new.sql, new.user_id);
+        END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{SEARCH_TABLE}_delete
+        AFTER DELETE ON conversation_history BEGIN
+            INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, query, sql, user_id)
+            VALUES ('delete', old.id, old.query, old.sql, old.user_id);
+        END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{SEARCH_TABLE}_update
+        AFTER UPDATE OF query, sql, user_id ON conversation_history BEGIN
+            INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, query, sql, user_id)
+            VALUES ('delete', old.id, old.query, old.sql, old.user_id);
+            INSERT INTO {SEARCH_TABLE} (rowid, query, sql, user_id)
+            VALUES (new.id, new.query, new.sql, new.user_id);
+        END
+    """)
+    cur.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('rebuild')")
+    print("🔎 Built conversation search index")
+
+def build_match_query(user_id: int, text: str) -> Optional[str]:
+    """
+    FTS5 query for free text within one user's history: every word must
+    match the question or SQL, the last one as a prefix so results follow
+    typing. Words are quoted, so FTS5 syntax in the input is never
+    interpreted.
+    """
+    terms = SEARCH_TERM_RE.findall(text or "")
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += "*"
+    return f'user_id:"{int(user_id)}" AND {{query sql}}:({" ".join(quoted)})'
+
+def _render_snippet(snippet: str) -> str:
+    """HTML-escape a snippet, then turn the \x02/\x03 match markers into <mark> tags"""
+    return html.escape(snippet or "").replace("\x02", "<mark>").replace("\x03", "</mark>")
+
+def search_conversations(user_id: int, text: str, limit: int = SEARCH_PAGE_SIZE,
+                         offset: int = 0) -> Dict:
+    """
+    Ranked full-text search over a user's past questions and SQL.
+    Returns {"results": [...], "has_more"}; each result has the message
+    and conversation ids, the question, SQL, time and a highlighted snippet.
+    """
+    match = build_match_query(user_id, text)
+    limit = max(1, min(limit, MAX_SEARCH_PAGE_SIZE))
+    if match is None:
+        return {"results": [], "has_more": False}
+
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        rows = conn.execute(f"""
+            SELECT h.id, h.conversation_id, h.query, h.sql, h.created_at,
+                   snippet({SEARCH_TABLE}, 0, char(2), char(3), '…', ?),
+                   snippet({SEARCH_TABLE}, 1, char(2), char(3), '…', ?)
+            FROM {SEARCH_TABLE}
+            JOIN conversation_history h ON h.id = {SEARCH_TABLE}.rowid
+            WHERE {SEARCH_TABLE} MATCH ? AND h.user_id = ?
+            ORDER BY bm25({SEARCH_TABLE}, ?, ?, ?), h.id DESC
+            LIMIT ? OFFSET ?
+        """, (SNIPPET_TOKENS, SNIPPET_TOKENS, match, user_id, *SEARCH_WEIGHTS,
+              limit + 1, max(offset, 0))).fetchall()
+    except sqlite3.OperationalError as e:
+        print(f"Error searching conversations: {e}")
+        return {"results": [], "has_more": False}
+    finally:
+        conn.close()
+
+    return {
+        "results": [
+            {
+                "id": row[0],
+                "conversation_id": row[1],
+                "query": row[2],
+                "sql": row[3],
+                "created_at": row[4],
+                # The question's snippet unless only the SQL matched
+                "snippet": _render_snippet(row[5] if "\x02" in (row[5] or "") else row[6]),
+            }
+            for row in rows[:limit]
+        ],
+        "has_more": len(rows) > limit,
+    }
+
 def get_conversation_history(user_id: int, conversation_id: str) -> list:
     """Get conversation history for a specific conversation from database"""
     conn = sqlite3.connect(DB_PATH)
@@ -52,40 +248,206 @@ def get_conversation_history(user_id: int, conversation_id: str) -> list:
     
     try:
         cur.execute("""
-            SELECT query, sql, created_at 
+            SELECT query, sql, created_at, id 
             FROM conversation_history 
             WHERE user_id = ? AND conversation_id = ?
             ORDER BY created_at ASC
         """, (user_id, conversation_id))
         
         rows = cur.fetchall()
-        return [{"query": row[0], "sql": row[1], "created_at": row[2]} for row in rows]
+        return [{"query": row[0], "sql": row[1], "created_at": row[2], "id": row[3]} for row in rows]
     except Exception as e:
         print(f"Error fetching conversation history: {e}")
         return []
     finally:
         conn.close()
 
-def save_conversation_exchange(user_id: int, conversation_id: str, query: str, sql: str):
-    """Save a query-sql exchange to database"""
+def get_last_exchange(user_id: int, conversation_id: str) -> Optional[Dict]:
+    """The most recent {id, query, sql} of a conversation, or None"""
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        row = conn.execute("""
+            SELECT id, query, sql FROM conversation_history
+            WHERE user_id = ? AND conversation_id = ?
+            ORDER BY id DESC LIMIT 1
+        """, (user_id, conversation_id)).fetchone()
+        return {"id": row[0], "query": row[1], "sql": row[2]} if row else None
+    except Exception as e:
+        print(f"Error fetching last exchange: {e}")
+        return None
+    finally:
+        conn.close()
+
+def get_conversation_exchange(user_id: int, conversation_id: str, message_id: int) -> Optional[Dict]:
+    """Get a single query-sql exchange of a conversation"""
+    conn = sqlite3.connect(DB_PATH)
+    cur = conn.cursor()
+    
+    try:
+        cur.execute("""
+            SELECT query, sql, created_at, id 
+            FROM conversation_history 
+            WHERE user_id = ? AND conversation_id = ? AND id = ?
+        """, (user_id, conversation_id, message_id))
+        
+        row = cur.fetchone()
+        if row is None:
+            return None
+        return {"query": row[0], "sql": row[1], "created_at": row[2], "id": row[3]}
+    except Exception as e:
+        print(f"Error fetching conversation exchange: {e}")
+        return None
+    finally:
+        conn.close()
+
+def estimate_tokens(text: str) -> int:
+    """Rough prompt token count (about 4 characters per token)"""
+    return len(text) // 4 + 1
+
+def _clip(text: str) -> str:
+    return text if len(text) <= SUMMARY_TEXT_LIMIT else text[:SUMMARY_TEXT_LIMIT] + "..."
+
+def _recent_unique(items: list, new: list, limit: int) -> list:
+    """Most recent first, without duplicates, at most `limit` entries"""
+    merged = list(new) + [item for item in items if item not in new]
+    return merged[:limit]
+
+def update_summary(summary: Optional[Dict], query: str, sql: str,
+                   result_shape: Optional[Dict] = None) -> Dict:
+    """
+    Fold one exchange into a conversation's rolling summary: tables and
+    filters in play, the last few questions, the last SQL and the shape of
+    its result. Every field is bounded, so the summary does not grow with
+    the number of turns.
+    """
+    summary = summary or {"tables": [], "filters": [], "questions": []}
+    normalized = normalize_sql(sql) if sql else ""
+    tables = list(dict.fromkeys(TABLE_RE.findall(normalized)))
+    filters = [_clip(f.strip()) for f in FILTER_RE.findall(normalized)]
+
+    return {
+        "tables": _recent_unique(summary["tables"], tables, SUMMARY_MAX_TABLES),
+        "filters": _recent_unique(summary["filters"], filters, SUMMARY_MAX_FILTERS),
+        "questions": _recent_unique(summary["questions"], [_clip(query)], SUMMARY_MAX_QUESTIONS),
+        "last_sql": normalized,
+        "last_result": result_shape or summary.get("last_result"),
+    }
+
+def _load_summary(cur, user_id: int, conversation_id: str):
+    cur.execute("""
+        SELECT summary, turns FROM conversation_summary
+        WHERE user_id = ? AND conversation_id = ?
+    """, (user_id, conversation_id))
+    row = cur.fetchone()
+    return (json.loads(row[0]), row[1]) if row else (None, 0)
+
+def _store_summary(cur, user_id: int, conversation_id: str, summary: Dict, turns: int):
+    cur.execute("""
+        INSERT INTO conversation_summary (conversation_id, user_id, summary, turns, updated_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(conversation_id) DO UPDATE SET
+            summary = excluded.summary, turns = excluded.turns, updated_at = excluded.updated_at
+    """, (conversation_id, user_id, json.dumps(summary), turns, datetime.now().isoformat()))
+
+def get_prompt_context(user_id: int, conversation_id: str):
+    """
+    Context for the next question of a conversation, as (history, summary).
+    The last MAX_CONTEXT_EXCHANGES raw pairs are returned while they fit in
+    CONTEXT_TOKEN_BUDGET; past that, history is empty and the rolling
+    summary is used instead, so prompt size stays flat.
+    """
+    conn = sqlite3.connect(DB_PATH)
+    cur = conn.cursor()
+
+    try:
+        cur.execute("""
+            SELECT query, sql, created_at, id
+            FROM conversation_history
+            WHERE user_id = ? AND conversation_id = ?
+            ORDER BY created_at DESC
+            LIMIT ?
+        """, (user_id, conversation_id, MAX_CONTEXT_EXCHANGES))
+        history = [
+            {"query": row[0], "sql": row[1], "created_at": row[2], "id": row[3]}
+            for row in reversed(cur.fetchall())
+        ]
+
+        size = sum(estimate_tokens(item["query"]) + estimate_tokens(item["sql"]) for item in history)
+        if size <= CONTEXT_TOKEN_BUDGET:
+            return history, None
+
+        summary, _ = _load_summary(cur, user_id, conversation_id)
+        if summary is None:
+            # Conversation started before summaries existed: build it once
+            turns = 0
+            for item in get_conversation_history(user_id, conversation_id):
+                summary = update_summary(summary, item["query"], item["sql"])
+                turns += 1
+            _store_summary(cur, user_id, conversation_id, summary, turns)
+            conn.commit()
+        return [], summary
+    except Exception as e:
+        print(f"Error building prompt context: {e}")
+        return [], None
+    finally:
+        conn.close()
+
+def save_conversation_exchange(user_id: int, conversation_id: str, query: str, sql: str,
+                               result_shape: Optional[Dict] = None):
+    """
+    Save a query-sql exchange to database and fold it into the
+    conversation's rolling summary. result_shape is {"columns", "rows"}.
+    """
     conn = sqlite3.connect(DB_PATH)
     cur = conn.cursor()
     
     try:
         # First, ensure the conversation exists in user_conversations
+        created_at = datetime.now().isoformat()
         cur.execute("""
             INSERT OR IGNORE INTO user_conversations (conversation_id, user_id, created_at)
             VALUES (?, ?, ?)
-        """, (conversation_id, user_id, datetime.now().isoformat()))
+        """, (conversation_id, user_id, created_at))
+        is_created = cur.rowcount > 0
         
+        cur.execute("""
+            SELECT NOT EXISTS (
+                SELECT 1 FROM conversation_history WHERE user_id = ? AND conversation_id = ?
+            )
+        """, (user_id, conversation_id))
+        is_new = bool(cur.fetchone()[0])
+
         # Then save the exchange
         cur.execute("""
             INSERT INTO conversation_history (user_id, conversation_id, query, sql, created_at)
             VALUES (?, ?, ?, ?, ?)
-        """, (user_id, conversation_id, query, sql, datetime.now().isoformat()))
+        """, (user_id, conversation_id, query, sql, created_at))
+        message_id = cur.lastrowid
+
+        # Older conversations without a summary get one built from their
+        # full history the first time it is needed (see get_prompt_context)
+        summary, turns = _load_summary(cur, user_id, conversation_id)
+        if summary is not None or is_new:
+            summary = update_summary(summary, query, sql, result_shape)
+            _store_summary(cur, user_id, conversation_id, summary, turns + 1)
+
+        bump_versions(cur, f"user:{user_id}", f"conversation:{conversation_id}")
         
         conn.commit()
         print(f"✅ Saved conversation exchange: {conversation_id}")
+
+        if is_created:
+            publish(user_id, "conversation_created", {
+                "conversation_id": conversation_id, "title": "New Chat", "created_at": created_at
+            })
+        publish(user_id, "message_created", {
+            "conversation_id": conversation_id, "id": message_id,
+            "query": query, "sql": sql, "created_at": created_at
+        })
+        if is_new:
+            publish(user_id, "title_updated", {
+                "conversation_id": conversation_id, "title": query[:TITLE_LENGTH]
+            })
     except Exception as e:
         print(f"Error saving conversation exchange: {e}")
         conn.rollback()
@@ -107,8 +469,16 @@ def clear_conversation(user_id: int, conversation_id: str):
             DELETE FROM user_conversations 
             WHERE user_id = ? AND conversation_id = ?
         """, (user_id, conversation_id))
+
+        cur.execute("""
+            DELETE FROM conversation_summary
+            WHERE user_id = ? AND conversation_id = ?
+        """, (user_id, conversation_id))
+
+        bump_versions(cur, f"user:{user_id}", f"conversation:{conversation_id}")
         
         conn.commit()
+        publish(user_id, "conversation_deleted", {"conversation_id": conversation_id})
     except Exception as e:
         print(f"Error clearing conversation: {e}")
     finally:
@@ -145,7 +515,7 @@ def get_user_all_conversations(user_id: int) -> List[Dict]:
             first_query = row[2]
             last_updated = row[3]
             
-            title = first_query[:50] if first_query else "New Chat"
+            title = first_query[:TITLE_LENGTH] if first_query else "New Chat"
             
             result.append({
                 "conversation_id": conv_id,
@@ -176,6 +546,7 @@ def get_conversation_messages_with_results(user_id: int, conversation_id: str):
         # Add user message
         messages.append({
             "type": "user",
+            "id": item["id"],
             "content": item["query"],
             "sql": item["sql"],
             "created_at": item["created_at"]
@@ -186,6 +557,7 @@ def get_conversation_messages_with_results(user_id: int, conversation_id: str):
             result = run_sql(item["sql"])
             messages.append({
                 "type": "bot",
+                "id": item["id"],
                 "result": result,
                 "sql": item["sql"],
                 "created_at": item["created_at"]
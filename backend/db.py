@@ -1,31 +1,115 @@
-import sqlite3
+from query_engine import (
+    get_read_connection, open_read_connection, close_read_connection, get_schemas,
+    get_table_versions, APP_STATE_TABLES
+)
+from partitions import prune_partitions, is_partition_table
+from result_cache import result_cache
+from result_encoding import fetch_columns, infer_column_types, FETCH_SIZE
+from sql_validator import normalize_sql, parameterize
 
-DB_PATH = "./../mydata.db"
+# Schema snapshot shared by prompt building and SQL validation
+_schema_cache = {"version": None, "tables": None, "declared": {}}
 
-def run_sql(sql: str):
-    """Execute SQL query and return results"""
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
+def get_cache_key(sql: str):
+    """Result cache key: statement shape, its literals and the current data version"""
+    versions = tuple(sorted(get_table_versions().items()))
+    return parameterize(normalize_sql(sql)) + (get_schema_version(), versions)
+
+def _execute(sql: str, layout: str = "rows", params: tuple = ()):
+    """Run a statement on the query connection without caching or typing"""
+    cur = get_read_connection().cursor()
     try:
-        cur.execute(sql)
-        rows = cur.fetchall()
+        cur.execute(sql, params)
         columns = [desc[0] for desc in cur.description] if cur.description else []
-        conn.close()
-        return {"columns": columns, "rows": rows}
+        if layout == "columns":
+            return {"columns": columns, "data": fetch_columns(cur)}
+        return {"columns": columns, "rows": cur.fetchall()}
     except Exception as e:
-        conn.close()
         return {"error": str(e)}
+    finally:
+        cur.close()
 
-def get_user_tables():
-    """Get list of all user tables (excluding system tables)"""
-    sql = """
-    SELECT name 
-    FROM sqlite_master 
-    WHERE type='table' 
-      AND name NOT LIKE 'sqlite_%'
-    ORDER BY name;
+def _statement(sql: str, parameterized: bool):
+    """The (sql, params) to execute: the bound shape or the literal SQL"""
+    pruned = prune_partitions(sql)
+    return parameterize(pruned) if parameterized else (pruned, ())
+
+def run_sql(sql: str, use_cache: bool = True, layout: str = "rows", parameterized: bool = False):
+    """
+    Execute SQL query on the read-only query connection and return results.
+    layout="columns" returns {"columns", "data"} with one list per column,
+    read directly from the cursor. Results carry a "types" list with one
+    entry per column (integer, real, text, datetime, blob, null or mixed).
+
+    parameterized=True binds the literals as parameters so near-identical
+    statements reuse the connection's prepared statement; pass validate_sql's
+    "parameterized" flag, which says whether the bound shape compiles.
+    """
+    key = get_cache_key(sql) + (layout,) if use_cache else None
+    if key is not None:
+        cached = result_cache.get(key)
+        if cached is not None:
+            return dict(cached)
+
+    statement, params = _statement(sql, parameterized)
+    result = _execute(statement, layout, params)
+    if "error" in result:
+        return result
+    result["types"] = infer_column_types(result, get_declared_types())
+
+    if key is not None:
+        result_cache.put(key, result)
+    return dict(result)
+
+def get_cached_result(sql: str, layout: str = "rows"):
+    """A statement's result if it is still cached for the current data, else None"""
+    cached = result_cache.get(get_cache_key(sql) + (layout,))
+    return dict(cached) if cached is not None else None
+
+def cache_result(sql: str, result: dict, layout: str = "rows"):
+    """Cache a result computed elsewhere as if run_sql had produced it"""
+    result_cache.put(get_cache_key(sql) + (layout,), result)
+
+def explain_sql(sql: str):
     """
-    result = run_sql(sql)
+    Compile a statement against the real database with EXPLAIN QUERY PLAN,
+    without running it. Returns None when it compiles, else the error.
+    """
+    cur = get_read_connection().cursor()
+    try:
+        cur.execute("EXPLAIN QUERY PLAN " + prune_partitions(sql)).fetchall()
+        return None
+    except Exception as e:
+        return str(e)
+    finally:
+        cur.close()
+
+def iter_sql(sql: str, chunk_size: int = FETCH_SIZE, parameterized: bool = False):
+    """
+    Stream a query's results: yields the column names first, then lists of
+    up to chunk_size rows read with fetchmany. A dedicated connection is
+    used so a long export never shares a cursor with other requests.
+    """
+    conn = open_read_connection()
+    try:
+        cur = conn.execute(*_statement(sql, parameterized))
+        yield [desc[0] for desc in cur.description] if cur.description else []
+        while True:
+            chunk = cur.fetchmany(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        close_read_connection(conn)
+
+def get_user_tables():
+    """Get list of all user tables and views (excluding system, app-state and partition tables)"""
+    sql = " UNION ".join(
+        f"SELECT name FROM {schema}.sqlite_master "
+        f"WHERE type IN ('table', 'view') AND name NOT LIKE 'sqlite_%'"
+        for schema in get_schemas()
+    ) + " ORDER BY name;"
+    result = _execute(sql)
     
     if "error" in result:
         return result
@@ -35,6 +119,8 @@ def get_user_tables():
     user_tables = [
         row[0] for row in result["rows"] 
         if row[0] not in system_tables
+        and row[0] not in APP_STATE_TABLES
+        and not is_partition_table(row[0])
     ]
     
     return user_tables
@@ -42,10 +128,22 @@ def get_user_tables():
 def get_table_schema(table_name: str):
     """Get schema of a specific table"""
     sql = f"PRAGMA table_info({table_name})"
-    return run_sql(sql)
+    return _execute(sql)
+
+def get_schema_version() -> int:
+    """Return the summed PRAGMA schema_version; it changes whenever any table is altered"""
+    conn = get_read_connection()
+    return sum(
+        conn.execute(f"PRAGMA {schema}.schema_version").fetchone()[0]
+        for schema in get_schemas()
+    )
 
 def get_tables_with_columns():
-    """Get all tables with their columns"""
+    """Get all tables with their columns (cached until the schema changes)"""
+    version = get_schema_version()
+    if _schema_cache["version"] == version:
+        return _schema_cache["tables"]
+
     tables = get_user_tables()
     print(f"User tables: {tables}")
     
@@ -53,6 +151,7 @@ def get_tables_with_columns():
         return tables
 
     table_columns = {}
+    declared = {}
 
     for table in tables:
         schema = get_table_schema(table)
@@ -62,5 +161,17 @@ def get_tables_with_columns():
             # Extract only column names from schema rows
             cols = [row[1] for row in schema["rows"]]  # row[1] = column name
             table_columns[table] = cols
+            for row in schema["rows"]:
+                # row[2] = declared type; ambiguous names across tables are dropped
+                decl = (row[2] or "").upper()
+                declared[row[1]] = decl if declared.get(row[1], decl) == decl else None
+
+    _schema_cache["version"] = version
+    _schema_cache["tables"] = table_columns
+    _schema_cache["declared"] = {k: v for k, v in declared.items() if v}
+    return table_columns
 
-    return table_columns
\ No newline at end of file
+def get_declared_types() -> dict:
+    """Declared type of each analytics column name, e.g. {"datetime": "TEXT"}"""
+    get_tables_with_columns()
+    return _schema_cache["declared"]
\ No newline at end of file
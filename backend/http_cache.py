@@ -0,0 +1,94 @@
+"""
+Conditional GET and compressed JSON responses.
+
+Endpoints pass an ETag computed from cheap change counters and a function
+that builds the payload. When the client's If-None-Match already holds
+that ETag the answer is a bare 304 and the payload is never built or
+serialized. Otherwise the payload is serialized with orjson (when
+installed) and compressed with brotli or gzip if it is large enough and
+the client accepts it.
+"""
+import gzip
+import hashlib
+import json
+
+from fastapi import Request, Response
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; json is the fallback
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional; gzip is used without it
+    brotli = None
+
+# Bodies smaller than this are sent uncompressed
+MIN_COMPRESS_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def make_etag(*parts) -> str:
+    """Weak ETag over the given counters/versions"""
+    digest = hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison: W/ prefixes are ignored
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag.removeprefix("W/") in tags
+
+
+def dumps(payload) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload, default=str, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, default=str, separators=(",", ":")).encode("utf-8")
+
+
+def _accepted_encodings(accept_encoding: str) -> set:
+    encodings = set()
+    for item in (accept_encoding or "").split(","):
+        name, _, params = item.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        encodings.add(name.strip().lower())
+    return encodings
+
+
+def compress(body: bytes, accept_encoding: str):
+    """(body, content-encoding or None) using the best encoding the client accepts"""
+    if len(body) < MIN_COMPRESS_BYTES:
+        return body, None
+    encodings = _accepted_encodings(accept_encoding)
+    if brotli is not None and "br" in encodings:
+        return brotli.compress(body, quality=BROTLI_QUALITY), "br"
+    if "gzip" in encodings:
+        return gzip.compress(body, compresslevel=GZIP_LEVEL), "gzip"
+    return body, None
+
+
+def cached_json_response(request: Request, etag: str, build) -> Response:
+    """
+    304 when the request's If-None-Match holds `etag`, else build() as a
+    (possibly compressed) JSON response carrying the ETag.
+    """
+    headers = {
+        "ETag": etag,
+        # Responses are per user: browsers may keep them but must revalidate
+        "Cache-Control": "private, no-cache",
+        "Vary": "Accept-Encoding, Authorization",
+    }
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    body, encoding = compress(dumps(build()), request.headers.get("accept-encoding"))
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
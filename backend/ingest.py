@@ -0,0 +1,291 @@
+"""
+Bulk loader for meter readings into forecasted_table.
+
+    python ingest.py readings.csv [more.ndjson ...] [--replace] [--defer-indexes]
+
+CSV, NDJSON and (with pyarrow installed) Parquet files are streamed in
+batches; each batch is written with one prepared INSERT via executemany
+inside its own transaction, so readers on the WAL database are never
+blocked for long. Rows are de-duplicated on (meter_id, datetime).
+"""
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+import time
+from collections import defaultdict
+
+from meter_stats import update_meter_stats
+from partitions import is_partitioned, ensure_partitions, partition_name, allocate_ids
+from query_engine import (
+    get_analytics_db_path, ensure_versions_table, create_version_triggers, drop_version_triggers,
+    bump_table_version
+)
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet input is optional
+    pq = None
+
+TABLE = "forecasted_table"
+COLUMNS = ("meter_id", "datetime", "forecasted_load_kwh")
+DEDUP_INDEX = "idx_forecasted_meter_datetime"
+
+BATCH_SIZE = 50000
+
+INSERT_SQL = {
+    # Keep the first reading seen for a (meter_id, datetime)
+    "ignore": """
+        INSERT INTO {table} ({columns})
+        VALUES ({placeholders})
+        ON CONFLICT(meter_id, datetime) DO NOTHING
+    """,
+    # Newer forecasts overwrite older ones
+    "replace": """
+        INSERT INTO {table} ({columns})
+        VALUES ({placeholders})
+        ON CONFLICT(meter_id, datetime) DO UPDATE SET
+            forecasted_load_kwh = excluded.forecasted_load_kwh
+    """,
+}
+
+# Hooks run inside each batch transaction after its rows are written, called
+# with (conn, rows, all_new, tables): all_new is True when every row was
+# inserted (no duplicates or replaced values), tables are the tables written
+batch_listeners = [update_meter_stats]
+
+
+def to_reading(record: dict):
+    """Normalize one input record to a (meter_id, datetime, load) tuple"""
+    load = record.get("forecasted_load_kwh")
+    return (
+        str(record["meter_id"]),
+        # Store timestamps like the existing data: "YYYY-MM-DD HH:MM:SS"
+        str(record["datetime"]).replace("T", " ").rstrip("Z")[:19],
+        None if load in (None, "") else float(load),
+    )
+
+
+def read_csv(path: str):
+    with open(path, newline="", encoding="utf-8") as f:
+        for record in csv.DictReader(f):
+            yield to_reading(record)
+
+
+def read_ndjson_lines(lines):
+    for line in lines:
+        line = line.strip()
+        if line:
+            yield to_reading(json.loads(line))
+
+
+def read_ndjson(path: str):
+    with open(path, encoding="utf-8") as f:
+        yield from read_ndjson_lines(f)
+
+
+def read_parquet(path: str):
+    if pq is None:
+        raise RuntimeError("Parquet input requires pyarrow to be installed")
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=BATCH_SIZE, columns=list(COLUMNS)):
+        for record in batch.to_pylist():
+            yield to_reading(record)
+
+
+READERS = {
+    ".csv": read_csv,
+    ".ndjson": read_ndjson,
+    ".jsonl": read_ndjson,
+    ".parquet": read_parquet,
+}
+
+
+def read_file(path: str):
+    """Stream readings from a file, picking the reader by extension"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in READERS:
+        raise ValueError(f"Unsupported input file: {path}")
+    return READERS[ext](path)
+
+
+def batched(readings, size: int = BATCH_SIZE):
+    batch = []
+    for reading in readings:
+        batch.append(reading)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def insert_sql(mode: str, table: str, with_ids: bool = False) -> str:
+    columns = (("id",) if with_ids else ()) + COLUMNS
+    return INSERT_SQL[mode].format(
+        table=table, columns=", ".join(columns), placeholders=", ".join("?" * len(columns))
+    )
+
+
+def connect():
+    """Write connection to the analytics database, tuned for bulk loads"""
+    conn = sqlite3.connect(get_analytics_db_path(), isolation_level=None, timeout=30)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA cache_size = -65536")  # 64 MB
+    return conn
+
+
+def ensure_table(conn):
+    """Create forecasted_table and its (meter_id, datetime) unique index"""
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {TABLE} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            meter_id TEXT NOT NULL,
+            datetime TEXT NOT NULL,
+            forecasted_load_kwh REAL
+        )
+    """)
+    conn.execute(
+        f"CREATE UNIQUE INDEX IF NOT EXISTS {DEDUP_INDEX} ON {TABLE}(meter_id, datetime)"
+    )
+
+
+def drop_secondary_indexes(conn) -> list:
+    """Drop indexes other than the dedup index; returns their CREATE statements"""
+    rows = conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type='index' AND tbl_name=? AND sql IS NOT NULL",
+        (TABLE,)
+    ).fetchall()
+    deferred = [(name, sql) for name, sql in rows if name != DEDUP_INDEX]
+    for name, _ in deferred:
+        conn.execute(f'DROP INDEX "{name}"')
+    return [sql for _, sql in deferred]
+
+
+def ingest(readings, mode: str = "ignore", defer_indexes: bool = False,
+           batch_size: int = BATCH_SIZE) -> dict:
+    """
+    Load an iterable of (meter_id, datetime, load) tuples.
+    Returns counts and throughput for the run.
+    """
+    if mode not in INSERT_SQL:
+        raise ValueError(f"Unknown conflict mode: {mode}")
+
+    conn = connect()
+    started = time.perf_counter()
+    read = 0
+    written = 0
+    deferred = []
+    # Tables whose version triggers are dropped for the rest of the run
+    untracked = set()
+
+    try:
+        partitioned = is_partitioned(conn)
+        if not partitioned:
+            ensure_table(conn)
+        ensure_versions_table(conn)
+        if defer_indexes and not partitioned:
+            conn.execute("BEGIN IMMEDIATE")
+            deferred = drop_secondary_indexes(conn)
+            conn.execute("COMMIT")
+
+        for batch in batched(readings, batch_size):
+            if partitioned:
+                # Route each reading to its month's partition
+                targets = defaultdict(list)
+                for reading in batch:
+                    targets[reading[1][:7]].append(reading)
+            else:
+                targets = {None: batch}
+
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                changed = 0
+                if partitioned:
+                    ensure_partitions(conn, targets.keys())
+                for month, rows in targets.items():
+                    table = partition_name(month) if partitioned else TABLE
+                    # Bump the version once per batch instead of once per row. The
+                    # triggers are dropped once per run: each DDL changes the schema
+                    # version, which resets statement, schema and result caches
+                    if table not in untracked:
+                        drop_version_triggers(conn, table)
+                        untracked.add(table)
+                    if partitioned:
+                        # Partitions share one id sequence so ids stay unique across months
+                        first = allocate_ids(conn, len(rows))
+                        rows = [(first + k,) + row for k, row in enumerate(rows)]
+                    changed += conn.executemany(insert_sql(mode, table, partitioned), rows).rowcount
+                    bump_table_version(conn, table)
+                all_new = mode == "ignore" and changed == len(batch)
+                tables = [partition_name(m) for m in targets] if partitioned else [TABLE]
+                for listener in batch_listeners:
+                    listener(conn, batch, all_new, tables)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+            read += len(batch)
+            written += changed
+
+        if deferred:
+            conn.execute("BEGIN IMMEDIATE")
+            for create_sql in deferred:
+                conn.execute(create_sql)
+            conn.execute("COMMIT")
+        conn.execute("PRAGMA optimize")
+    finally:
+        try:
+            if untracked:
+                # Also after a failed batch; init_engine restores them after a crash
+                conn.execute("BEGIN IMMEDIATE")
+                for table in untracked:
+                    create_version_triggers(conn, table)
+                conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    seconds = time.perf_counter() - started
+    return {
+        "rows_read": read,
+        "rows_written": written,
+        "duplicates": read - written if mode == "ignore" else 0,
+        "seconds": round(seconds, 3),
+        "rows_per_second": int(read / seconds) if seconds > 0 else read,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk load meter readings into forecasted_table")
+    parser.add_argument("files", nargs="+", help="CSV, NDJSON or Parquet files")
+    parser.add_argument("--replace", action="store_true",
+                        help="overwrite existing readings instead of keeping them")
+    parser.add_argument("--defer-indexes", action="store_true",
+                        help="drop secondary indexes during the load and rebuild them after")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    for path in args.files:
+        print(f"📥 Loading {path}...")
+        try:
+            report = ingest(
+                read_file(path),
+                mode="replace" if args.replace else "ignore",
+                defer_indexes=args.defer_indexes,
+                batch_size=args.batch_size,
+            )
+        except (ValueError, RuntimeError, sqlite3.Error) as e:
+            print(f"❌ {path}: {e}")
+            sys.exit(1)
+        print(
+            f"   ✓ {report['rows_read']} rows read, {report['rows_written']} written, "
+            f"{report['duplicates']} duplicates in {report['seconds']}s "
+            f"({report['rows_per_second']} rows/s)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""
+Background jobs for long-running /ask requests.
+
+Jobs run on a bounded worker pool and keep their result in memory until
+JOB_TTL_SECONDS after they finish. Clients long-poll for completion; a job
+nobody has polled for ABANDON_SECONDS is cancelled, which stops its model
+calls and interrupts its running query.
+"""
+import asyncio
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_WORKERS = 4
+# Jobs queued or running at once; submit_job refuses more
+MAX_PENDING_JOBS = 64
+JOB_TTL_SECONDS = 15 * 60
+ABANDON_SECONDS = 120
+REAPER_INTERVAL_SECONDS = 10
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """Raised inside a job's work once it has been cancelled"""
+
+
+class CancelToken:
+    """
+    Cancellation flag handed to a job's work. Besides is_set(), work can
+    register hooks (closing a model stream, interrupting a query) that run
+    as soon as the job is cancelled.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._hooks = []
+
+    def is_set(self) -> bool:
+        return self._event.is_set()
+
+    def check(self):
+        if self._event.is_set():
+            raise JobCancelled()
+
+    def add_hook(self, hook):
+        with self._lock:
+            if not self._event.is_set():
+                self._hooks.append(hook)
+                return
+        hook()
+
+    def remove_hook(self, hook):
+        with self._lock:
+            if hook in self._hooks:
+                self._hooks.remove(hook)
+
+    def cancel(self):
+        with self._lock:
+            self._event.set()
+            hooks, self._hooks = self._hooks, []
+        for hook in hooks:
+            try:
+                hook()
+            except Exception as e:
+                print(f"Error running cancel hook: {e}")
+
+
+class Job:
+    def __init__(self, user_id: int):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.last_seen = self.created_at
+        self.token = CancelToken()
+        self.done = threading.Event()
+        self.future = None
+        self._callbacks_lock = threading.Lock()
+        self._callbacks = []
+
+    def finish(self, status: str, result=None, error: str = None):
+        self.status = status
+        self.result = result
+        self.error = error
+        self.finished_at = time.time()
+        with self._callbacks_lock:
+            self.done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def add_done_callback(self, callback):
+        """Call callback() once the job finishes, at once if it already has"""
+        with self._callbacks_lock:
+            if not self.done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_done_callback(self, callback):
+        with self._callbacks_lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def to_dict(self) -> dict:
+        info = {
+            "job_id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+        if self.status == DONE:
+            info["result"] = self.result
+        if self.error:
+            info["error"] = self.error
+        return info
+
+
+_lock = threading.Lock()
+_jobs = {}  # {job_id: Job}
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="ask-job")
+_stop_event = threading.Event()
+_reaper = None
+
+
+def _run(job: Job, work):
+    if job.token.is_set():
+        job.finish(CANCELLED)
+        return
+    job.status = RUNNING
+    try:
+        result = work(job.token)
+        if job.token.is_set():
+            job.finish(CANCELLED)
+        else:
+            job.finish(DONE, result)
+    except JobCancelled:
+        job.finish(CANCELLED)
+    except Exception as e:
+        # HTTPException carries its message in .detail
+        job.finish(FAILED, error=str(getattr(e, "detail", e)))
+
+
+def submit_job(user_id: int, work):
+    """
+    Queue work(token) on the worker pool. Returns the Job, or None when
+    MAX_PENDING_JOBS are already queued or running.
+    """
+    reap()
+    with _lock:
+        pending = sum(1 for job in _jobs.values() if job.status not in FINISHED)
+        if pending >= MAX_PENDING_JOBS:
+            return None
+        job = Job(user_id)
+        _jobs[job.id] = job
+    job.future = _executor.submit(_run, job, work)
+    return job
+
+
+def get_job(job_id: str, user_id: int):
+    """A user's job by id, or None; counts as the client still waiting for it"""
+    with _lock:
+        job = _jobs.get(job_id)
+    if job is None or job.user_id != user_id:
+        return None
+    job.last_seen = time.time()
+    return job
+
+
+async def wait_for_job(job: Job, timeout: float):
+    """
+    Wait up to timeout seconds for a job to finish without holding a thread:
+    the worker wakes the event loop when the job finishes
+    """
+    loop = asyncio.get_running_loop()
+    finished = asyncio.Event()
+
+    def wake():
+        loop.call_soon_threadsafe(finished.set)
+
+    job.add_done_callback(wake)
+    try:
+        await asyncio.wait_for(finished.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        job.remove_done_callback(wake)
+
+
+def cancel_job(job: Job):
+    job.token.cancel()
+    if job.future is not None and job.future.cancel():
+        # Never started: finish it here
+        job.finish(CANCELLED)
+
+
+def reap():
+    """Cancel abandoned jobs and forget finished ones past their TTL"""
+    now = time.time()
+    with _lock:
+        expired = [
+            job_id for job_id, job in _jobs.items()
+            if job.status in FINISHED and now - job.finished_at > JOB_TTL_SECONDS
+        ]
+        for job_id in expired:
+            del _jobs[job_id]
+        abandoned = [
+            job for job in _jobs.values()
+            if job.status not in FINISHED and now - job.last_seen > ABANDON_SECONDS
+        ]
+    for job in abandoned:
+        print(f"🛑 Cancelling abandoned job {job.id}")
+        cancel_job(job)
+
+
+def _reaper_loop():
+    while not _stop_event.wait(REAPER_INTERVAL_SECONDS):
+        reap()
+
+
+def start_reaper():
+    """Cancel abandoned jobs in a daemon thread every REAPER_INTERVAL_SECONDS"""
+    global _reaper
+    if _reaper is not None and _reaper.is_alive():
+        return
+    _stop_event.clear()
+    _reaper = threading.Thread(target=_reaper_loop, name="job-reaper", daemon=True)
+    _reaper.start()
+
+
+def stop_reaper():
+    """Stop the reaper and cancel every unfinished job"""
+    _stop_event.set()
+    with _lock:
+        unfinished = [job for job in _jobs.values() if job.status not in FINISHED]
+    for job in unfinished:
+        cancel_job(job)
@@ -1,21 +1,54 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Header, Request
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, JSONResponse, Response
 from typing import List, Optional
+from anyio import from_thread
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import json
 import logging
 
 from conversation_manager import (
     init_user_context,
     get_conversation_history,
+    get_prompt_context,
     save_conversation_exchange,
     clear_conversation,
     get_user_all_conversations,
-    get_conversation_messages_with_results
+    get_conversation_messages_with_results,
+    get_conversation_exchange,
+    get_versions,
+    search_conversations,
+    get_last_exchange
 )
 
-from db import run_sql, get_tables_with_columns
-from nl_to_sql import nl_to_sql
+from db import (
+    run_sql, get_tables_with_columns, iter_sql, explain_sql, get_schema_version,
+    get_cached_result, cache_result, get_declared_types
+)
+from query_engine import init_engine, get_read_connection, get_table_versions, stop_snapshot_refresher
+from http_cache import make_etag, cached_json_response
+from conversation_events import subscribe, event_stream
+from jobs import submit_job, get_job, cancel_job, wait_for_job, start_reaper, stop_reaper
+from ingest import ingest, read_ndjson_lines
+from maintenance import start_scheduler, stop_scheduler
+from meter_stats import answer_from_stats, get_meter_summary
+from token_quota import check_quota, start_flusher, stop_flusher
+from saved_queries import (
+    save_query, list_saved_queries, get_saved_result, delete_saved_query,
+    refresh_query, start_refresher, stop_refresher
+)
+from result_encoding import (
+    negotiate_format, encode_result, result_row_count, encode_stream,
+    arrow_ipc, RESULT_FORMATS, FORMAT_ROWS, FORMAT_COLUMNAR, FORMAT_ARROW,
+    ARROW_STREAM_MEDIA_TYPE, EXPORT_MEDIA_TYPES
+)
+from nl_to_sql import nl_to_sql, nl_to_sql_speculative, repair_sql, get_cascade_stats
+from sql_validator import validate_sql
 from chart_generator import should_generate_chart, generate_chart_config
+from chart_planner import plan_chart_query
+from refinement import refine
 
 from auth import (
     get_current_user, create_user, get_user_by_email,
@@ -40,9 +73,28 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
 
+@app.on_event("startup")
+def startup():
+    init_engine()
+    start_scheduler()
+    start_flusher()
+    start_reaper()
+    start_refresher()
+
+
+@app.on_event("shutdown")
+def shutdown():
+    stop_scheduler()
+    stop_flusher()
+    stop_reaper()
+    stop_refresher()
+    stop_snapshot_refresher()
+
+
 # Request Models
 class ConversationExchange(BaseModel):
     query: str
@@ -52,6 +104,17 @@ class Query(BaseModel):
     query: str
     conversation_id: Optional[str] = None
     conversation_history: Optional[List[ConversationExchange]] = None
+    chart_width: Optional[int] = None  # pixels available for a chart
+    mode: Optional[str] = None  # "approximate" answers simple aggregates from meter_stats
+    candidates: Optional[int] = None  # >1 generates that many SQL candidates in parallel
+    background: Optional[bool] = False  # return a job id at once instead of the answer
+
+class BatchQuery(BaseModel):
+    questions: List[Query]
+
+class SavedQueryCreate(BaseModel):
+    query: str
+    refresh_minutes: Optional[int] = None
 
 
 # ----------- AUTH ENDPOINTS -----------
@@ -120,6 +183,12 @@ def login(user_data: UserLogin):
     return response
 
 
+@app.get("/auth/quota")
+def get_quota(current_user: User = Depends(get_current_user)):
+    """Tokens left in the current user's window and when it renews"""
+    return check_quota(current_user.id, current_user.role)
+
+
 @app.get("/auth/me", response_model=User)
 def get_me(current_user: User = Depends(get_current_user)):
     logger.info("=" * 60)
@@ -130,14 +199,79 @@ def get_me(current_user: User = Depends(get_current_user)):
 
 
 # ----------- ASK ENDPOINT -----------
+def is_runnable_sql(sql: str, db_content) -> bool:
+    """Cheap pre-execution check: schema validation plus EXPLAIN on the real database"""
+    validation = validate_sql(sql, db_content)
+    return "error" not in validation and explain_sql(validation["sql"]) is None
+
+
+def arrow_response(answer: dict):
+    """
+    Send an answer whose result is columnar as a raw Arrow IPC stream; its
+    other fields (sql, chart, ...) go in the schema metadata as JSON.
+    Errors stay JSON.
+    """
+    result = answer["result"]
+    if "error" in result:
+        return answer
+    metadata = {key: json.dumps(value, default=str) for key, value in answer.items() if key != "result"}
+    return Response(
+        arrow_ipc(result["columns"], result["data"], metadata),
+        media_type=ARROW_STREAM_MEDIA_TYPE
+    )
+
+
 @app.post("/ask")
-def ask(payload: Query, current_user: User = Depends(get_current_user)):
+def ask(
+    payload: Query,
+    format: Optional[str] = None,
+    accept: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user)
+):
     logger.info("=" * 80)
     logger.info("🚀 /ASK ENDPOINT HIT")
     logger.info(f"User: {current_user.email} (ID: {current_user.id})")
     logger.info(f"Query: {payload.query}")
     logger.info(f"Conversation ID: {payload.conversation_id}")
 
+    result_format = negotiate_format(format, accept)
+    if result_format not in RESULT_FORMATS:
+        raise HTTPException(406, f"Unsupported result format: {result_format}")
+
+    # Refuse before calling the model once the user's tokens are used up
+    quota = check_quota(current_user.id, current_user.role)
+    if not quota["allowed"]:
+        logger.warning(f"⛔ Token quota exhausted for user {current_user.id} until {quota['renewtime']}")
+        raise HTTPException(
+            status_code=429,
+            detail=f"Token quota exhausted, renews at {quota['renewtime']}"
+        )
+
+    if payload.background:
+        job = submit_job(
+            current_user.id,
+            lambda token: answer_question(payload, current_user, result_format, cancel=token)
+        )
+        if job is None:
+            raise HTTPException(503, "Too many queued questions, try again shortly")
+        logger.info(f"⏳ Queued job {job.id}")
+        logger.info("=" * 80)
+        return JSONResponse(status_code=202, content=job.to_dict())
+
+    if result_format == FORMAT_ARROW and not format:
+        # Asked for in Accept: the IPC stream itself rather than base64 in JSON
+        return arrow_response(answer_question(payload, current_user, FORMAT_COLUMNAR))
+    return answer_question(payload, current_user, result_format)
+
+
+def answer_question(payload: Query, current_user: User, result_format: str,
+                    db_content=None, cancel=None) -> dict:
+    """
+    The /ask pipeline: SQL generation, validation, execution, conversation
+    update and chart. `db_content` reuses a schema snapshot; `cancel` (a
+    jobs.CancelToken) aborts between stages and interrupts model calls and
+    the running query.
+    """
     user_id = current_user.id
     nl_query = payload.query
     conversation_id = payload.conversation_id
@@ -154,10 +288,14 @@ def ask(payload: Query, current_user: User = Depends(get_current_user)):
             logger.info("Creating new conversation context")
             link_conversation_to_user(conversation_id, user_id)
 
-        conversation_history = get_conversation_history(user_id, conversation_id)
-        logger.info(f"Conversation history length: {len(conversation_history)}")
+        conversation_history, context_summary = get_prompt_context(user_id, conversation_id)
+        if context_summary:
+            logger.info("Using summarized conversation context")
+        else:
+            logger.info(f"Conversation history length: {len(conversation_history)}")
     else:
         # Use provided history if no conversation_id
+        context_summary = None
         conversation_history = []
         if payload.conversation_history:
             conversation_history = [
@@ -166,37 +304,120 @@ def ask(payload: Query, current_user: User = Depends(get_current_user)):
             ]
             logger.info(f"Using provided history: {len(conversation_history)}")
 
+    # SQL of the previous turn, whose cached result may answer a follow-up
+    previous_sql = None
+    if conversation_id:
+        last_exchange = get_last_exchange(user_id, conversation_id)
+        previous_sql = last_exchange["sql"] if last_exchange else None
+    elif conversation_history:
+        previous_sql = conversation_history[-1]["sql"]
+
     # Get database schema
-    logger.info("📊 Getting database schema...")
-    db_content = get_tables_with_columns()
-    logger.info(f"Schema retrieved: {db_content}")
+    if db_content is None:
+        logger.info("📊 Getting database schema...")
+        db_content = get_tables_with_columns()
+        logger.info(f"Schema retrieved: {db_content}")
 
     # Generate SQL
-    logger.info("🤖 Generating SQL...")
-    sql_query = nl_to_sql(nl_query, db_content, conversation_history[-7:])
+    if payload.candidates and payload.candidates > 1:
+        logger.info(f"🤖 Generating {payload.candidates} SQL candidates...")
+        sql_query = nl_to_sql_speculative(
+            nl_query, db_content, conversation_history[-7:], context_summary, user_id,
+            candidates=payload.candidates,
+            accept=lambda sql: is_runnable_sql(sql, db_content),
+            cancel=cancel
+        )
+    else:
+        logger.info("🤖 Generating SQL...")
+        sql_query = nl_to_sql(
+            nl_query, db_content, conversation_history[-7:], context_summary, user_id,
+            accept=lambda sql: is_runnable_sql(sql, db_content),
+            cancel=cancel
+        )
+    if cancel is not None:
+        cancel.check()
     logger.info(f"Generated SQL: {sql_query}")
 
-    # Execute SQL
-    logger.info("💾 Executing SQL query...")
-    result = run_sql(sql_query)
-    logger.info(f"Query result: {len(result.get('rows', []))} rows")
+    # Validate SQL, giving the model one chance to repair it
+    validation = validate_sql(sql_query, db_content)
+    if "error" in validation:
+        logger.warning(f"⚠️ Invalid SQL: {validation['error']}")
+        logger.info("🔧 Requesting SQL repair...")
+        sql_query = repair_sql(nl_query, sql_query, validation["error"], db_content, user_id, cancel)
+        if cancel is not None:
+            cancel.check()
+        validation = validate_sql(sql_query, db_content)
+
+    # Execute SQL, bucketing large time series in SQLite before charting
+    chart_plan = None
+    if "error" in validation:
+        logger.error(f"❌ SQL rejected: {validation['error']}")
+        result = {"error": validation["error"]}
+    else:
+        sql_query = validation["sql"]
+        layout = "rows" if result_format == FORMAT_ROWS else "columns"
+        if cancel is not None:
+            # Cancelling interrupts the statement running on this thread's connection
+            interrupt = get_read_connection().interrupt
+            cancel.add_hook(interrupt)
+        try:
+            result = None
+            if payload.mode == "approximate":
+                # Simple aggregates are served from the precomputed meter statistics
+                result = answer_from_stats(sql_query, layout)
+                if result is not None:
+                    logger.info("⚡ Answered from meter statistics")
+            if result is None and previous_sql:
+                # Narrowing follow-ups are evaluated over the previous turn's cached result
+                previous_result = get_cached_result(previous_sql, layout)
+                if previous_result is not None:
+                    result = refine(sql_query, previous_sql, previous_result, layout, get_declared_types())
+                    if result is not None:
+                        logger.info("♻️ Answered from the previous result")
+                        cache_result(sql_query, result, layout)
+            if result is None:
+                # Large time series are bucketed in SQLite instead of being fetched row by row
+                chart_plan = plan_chart_query(
+                    sql_query, nl_query, payload.chart_width, validation["parameterized"]
+                )
+                if chart_plan:
+                    logger.info(f"📉 Bucketing by {chart_plan['bucket']} ({chart_plan['aggregate']})")
+                    result = run_sql(chart_plan["sql"], layout=layout, parameterized=validation["parameterized"])
+                    if "error" in result:
+                        chart_plan = None
+                        result = None
+            if result is None:
+                logger.info("💾 Executing SQL query...")
+                result = run_sql(sql_query, layout=layout, parameterized=validation["parameterized"])
+        finally:
+            # A hook left behind would interrupt whatever this thread's connection runs next
+            if cancel is not None:
+                cancel.remove_hook(interrupt)
+        if cancel is not None:
+            cancel.check()
+    logger.info(f"Query result: {result_row_count(result)} rows")
 
     # Save to conversation context
     if conversation_id:
         logger.info("Saving to conversation context...")
-        save_conversation_exchange(user_id, conversation_id, nl_query, sql_query)
+        result_shape = None
+        if "error" not in result:
+            result_shape = {"columns": result["columns"], "rows": result_row_count(result)}
+        save_conversation_exchange(user_id, conversation_id, nl_query, sql_query, result_shape)
         logger.info("Context updated")
 
     # Check if should generate chart
     if should_generate_chart(nl_query, result):
         logger.info("📈 Generating chart...")
-        chart_config = generate_chart_config(result, nl_query)
+        chart_config = generate_chart_config(result, nl_query, payload.chart_width)
         logger.info("Returning chart response")
         logger.info("=" * 80)
         return {
             "sql": sql_query,
-            "result": result,
+            "result": encode_result(result, result_format),
             "chart": chart_config,
+            "chart_plan": chart_plan,
+            "approximate": result.get("approximate"),
             "response_type": "chart"
         }
 
@@ -204,29 +425,188 @@ def ask(payload: Query, current_user: User = Depends(get_current_user)):
     logger.info("=" * 80)
     return {
         "sql": sql_query,
-        "result": result,
+        "result": encode_result(result, result_format),
+        "approximate": result.get("approximate"),
         "response_type": "table"
     }
 
 
+# ----------- BATCH ENDPOINT -----------
+# Questions accepted per /ask/batch call
+MAX_BATCH_QUESTIONS = 20
+# Batch questions answered at once across all requests; bounds parallel LLM
+# calls, and its threads keep their read connections between batches
+BATCH_WORKERS = 4
+_batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="ask-batch")
+
+@app.post("/ask/batch")
+def ask_batch(
+    payload: BatchQuery,
+    format: Optional[str] = None,
+    accept: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Answer several questions in one round trip. Authentication, the quota
+    check and the schema snapshot are shared; answers stream back as NDJSON
+    lines {"index", "answer"} or {"index", "error"} in completion order.
+    """
+    logger.info("=" * 80)
+    logger.info(f"🚀 /ASK/BATCH ENDPOINT HIT: {len(payload.questions)} questions")
+    logger.info(f"User: {current_user.email} (ID: {current_user.id})")
+
+    if not payload.questions:
+        raise HTTPException(400, "No questions given")
+    if len(payload.questions) > MAX_BATCH_QUESTIONS:
+        raise HTTPException(400, f"At most {MAX_BATCH_QUESTIONS} questions per batch")
+
+    result_format = negotiate_format(format, accept)
+    if result_format not in RESULT_FORMATS:
+        raise HTTPException(406, f"Unsupported result format: {result_format}")
+
+    quota = check_quota(current_user.id, current_user.role)
+    if not quota["allowed"]:
+        logger.warning(f"⛔ Token quota exhausted for user {current_user.id} until {quota['renewtime']}")
+        raise HTTPException(
+            status_code=429,
+            detail=f"Token quota exhausted, renews at {quota['renewtime']}"
+        )
+
+    db_content = get_tables_with_columns()
+    futures = {
+        _batch_executor.submit(answer_question, question, current_user, result_format, db_content): index
+        for index, question in enumerate(payload.questions)
+    }
+
+    def answers():
+        for future in as_completed(futures):
+            line = {"index": futures[future]}
+            try:
+                line["answer"] = future.result()
+            except Exception as e:
+                logger.error(f"❌ Batch question {line['index']} failed: {e}")
+                line["error"] = str(getattr(e, "detail", e))
+            yield json.dumps(line, default=str) + "\n"
+        logger.info(f"✅ Batch of {len(futures)} questions answered")
+
+    return StreamingResponse(answers(), media_type=EXPORT_MEDIA_TYPES["ndjson"])
+
+
+# ----------- SAVED QUERY APIs -----------
+@app.post("/saved-queries")
+def create_saved_query(payload: SavedQueryCreate, current_user: User = Depends(get_current_user)):
+    """Answer a question once and keep its SQL; its result is refreshed in the background"""
+    logger.info("=" * 60)
+    logger.info(f"📌 SAVE QUERY for user {current_user.id}: {payload.query}")
+
+    quota = check_quota(current_user.id, current_user.role)
+    if not quota["allowed"]:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Token quota exhausted, renews at {quota['renewtime']}"
+        )
+
+    answer = answer_question(Query(query=payload.query), current_user, FORMAT_ROWS)
+    if "error" in answer["result"]:
+        logger.error(f"❌ Not saving failed query: {answer['result']['error']}")
+        raise HTTPException(400, answer["result"]["error"])
+
+    # Bucketed chart data is not the statement's own result, so that is recomputed
+    result = answer["result"] if answer.get("chart_plan") is None else None
+    query_id = save_query(
+        current_user.id, payload.query, answer["sql"], result, payload.refresh_minutes
+    )
+    if query_id is None:
+        raise HTTPException(400, "Too many saved queries")
+    if result is None:
+        refresh_query(query_id, answer["sql"])
+
+    logger.info(f"✅ Saved query {query_id}")
+    logger.info("=" * 60)
+    return get_saved_result(current_user.id, query_id)
+
+@app.get("/saved-queries")
+def get_saved_queries(current_user: User = Depends(get_current_user)):
+    return {"saved_queries": list_saved_queries(current_user.id)}
+
+@app.get("/saved-queries/{query_id}")
+def get_saved_query(
+    query_id: int,
+    format: Optional[str] = None,
+    accept: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user)
+):
+    """Serve a saved query's materialized result without the LLM or a scan"""
+    result_format = negotiate_format(format, accept)
+    if result_format not in RESULT_FORMATS:
+        raise HTTPException(406, f"Unsupported result format: {result_format}")
+
+    saved = get_saved_result(current_user.id, query_id)
+    if saved is None:
+        raise HTTPException(404, "Saved query not found")
+    if saved["result"] is not None and result_format == FORMAT_ARROW and not format:
+        saved["result"] = encode_result(saved["result"], FORMAT_COLUMNAR)
+        return arrow_response(saved)
+    if saved["result"] is not None:
+        saved["result"] = encode_result(saved["result"], result_format)
+    return saved
+
+@app.delete("/saved-queries/{query_id}")
+def remove_saved_query(query_id: int, current_user: User = Depends(get_current_user)):
+    if not delete_saved_query(current_user.id, query_id):
+        raise HTTPException(404, "Saved query not found")
+    return {"message": "Saved query deleted"}
+
+
+# ----------- JOB APIs -----------
+# Longest a poll may wait for a job to finish
+MAX_JOB_WAIT_SECONDS = 30
+
+@app.get("/jobs/{job_id}")
+async def get_job_status(job_id: str, wait: float = 0, current_user: User = Depends(get_current_user)):
+    """
+    Status of a background question; `wait` long-polls up to 30s for it to
+    finish. The poll waits on the event loop, so it holds no worker thread.
+    """
+    job = get_job(job_id, current_user.id)
+    if job is None:
+        raise HTTPException(404, "Job not found")
+    if wait > 0:
+        await wait_for_job(job, min(wait, MAX_JOB_WAIT_SECONDS))
+    return job.to_dict()
+
+@app.delete("/jobs/{job_id}")
+def cancel_job_endpoint(job_id: str, current_user: User = Depends(get_current_user)):
+    """Cancel a background question, stopping its model calls and query"""
+    logger.info(f"🛑 Cancelling job {job_id} for user {current_user.id}")
+    job = get_job(job_id, current_user.id)
+    if job is None:
+        raise HTTPException(404, "Job not found")
+    cancel_job(job)
+    return job.to_dict()
+
+
 # ----------- CONVERSATION APIs -----------
 @app.get("/conversations")
-def list_conversations(current_user: User = Depends(get_current_user)):
-    """Get all conversations for the current user"""
+def list_conversations(request: Request, current_user: User = Depends(get_current_user)):
+    """Get all conversations for the current user (304 when unchanged)"""
     logger.info("=" * 60)
     logger.info(f"📋 /conversations HIT for user {current_user.id}")
     
     # Initialize tables if needed
     init_user_context(current_user.id)
-    
-    conversations = get_user_all_conversations(current_user.id)
-    logger.info(f"Found {len(conversations)} conversations")
-    
-    for conv in conversations:
-        logger.info(f"  - {conv['conversation_id']}: {conv['title']}")
-    
+
+    def build():
+        conversations = get_user_all_conversations(current_user.id)
+        logger.info(f"Found {len(conversations)} conversations")
+        
+        for conv in conversations:
+            logger.info(f"  - {conv['conversation_id']}: {conv['title']}")
+        return {"conversations": conversations}
+
+    etag = make_etag("conversations", current_user.id, get_versions(f"user:{current_user.id}"))
     logger.info("=" * 60)
-    return {"conversations": conversations}
+    return cached_json_response(request, etag, build)
 
 
 @app.get("/context/{conversation_id}")
@@ -263,12 +643,42 @@ def list_conversations(current_user: User = Depends(get_current_user)):
     
     return {"conversations": conversations}
 
+@app.get("/conversations/search")
+def search_conversation_history(
+    q: str,
+    limit: int = 20,
+    offset: int = 0,
+    current_user: User = Depends(get_current_user)
+):
+    """Ranked full-text search over the user's past questions, with snippets"""
+    logger.info(f"🔎 /conversations/search HIT for user {current_user.id}: {q!r}")
+    init_user_context(current_user.id)
+    results = search_conversations(current_user.id, q, limit, offset)
+    logger.info(f"Found {len(results['results'])} matches")
+    return {"query": q, "limit": limit, "offset": offset, **results}
+
+@app.get("/conversations/events")
+async def conversation_events(
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    last_event_id: Optional[str] = Header(None)
+):
+    """Server-Sent Events for the user's conversation changes"""
+    logger.info(f"📡 /conversations/events opened by user {current_user.id}")
+    subscription, missed = subscribe(current_user.id, last_event_id)
+    return StreamingResponse(
+        event_stream(subscription, missed, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/conversations/{conversation_id}/messages")
 def get_conversation_messages(
     conversation_id: str, 
+    request: Request,
     current_user: User = Depends(get_current_user)
     ):
-        """Get all messages in a conversation with their results"""
+        """Get all messages in a conversation with their results (304 when unchanged)"""
         logger.info("=" * 60)
         logger.info(f"📖 /conversations/{conversation_id}/messages HIT")
         logger.info(f"User: {current_user.id}")
@@ -276,15 +686,132 @@ def get_conversation_messages(
         if not verify_conversation_owner(conversation_id, current_user.id):
             logger.error("❌ Access denied")
             raise HTTPException(403, "Access denied")
-        
-        messages = get_conversation_messages_with_results(current_user.id, conversation_id)
-        logger.info(f"Retrieved {len(messages)} messages")
+
+        def build():
+            messages = get_conversation_messages_with_results(current_user.id, conversation_id)
+            logger.info(f"Retrieved {len(messages)} messages")
+            return {
+                "conversation_id": conversation_id,
+                "messages": messages
+            }
+
+        # Messages carry re-run query results, so data changes count too
+        etag = make_etag(
+            "messages", current_user.id, conversation_id,
+            get_versions(f"conversation:{conversation_id}"),
+            get_schema_version(), sorted(get_table_versions().items())
+        )
         logger.info("=" * 60)
-        
-        return {
-            "conversation_id": conversation_id,
-            "messages": messages
-        }
+        return cached_json_response(request, etag, build)
+
+@app.get("/conversations/{conversation_id}/messages/{message_id}/export")
+def export_message_result(
+    conversation_id: str,
+    message_id: int,
+    format: str = "csv",
+    current_user: User = Depends(get_current_user)
+):
+    """Stream the full result of a conversation turn's SQL as CSV or NDJSON"""
+    logger.info("=" * 60)
+    logger.info(f"📤 EXPORT /conversations/{conversation_id}/messages/{message_id} as {format}")
+    logger.info(f"User: {current_user.id}")
+
+    if format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(400, f"Unsupported export format: {format}")
+
+    if not verify_conversation_owner(conversation_id, current_user.id):
+        logger.error("❌ Access denied")
+        raise HTTPException(403, "Access denied")
+
+    exchange = get_conversation_exchange(current_user.id, conversation_id, message_id)
+    if exchange is None:
+        raise HTTPException(404, "Message not found")
+
+    validation = validate_sql(exchange["sql"], get_tables_with_columns())
+    if "error" in validation:
+        logger.error(f"❌ SQL rejected: {validation['error']}")
+        raise HTTPException(400, validation["error"])
+
+    # Start the query before responding so SQL errors surface as a 400
+    chunks = iter_sql(validation["sql"], parameterized=validation["parameterized"])
+    try:
+        columns = next(chunks)
+    except Exception as e:
+        logger.error(f"❌ Export query failed: {e}")
+        raise HTTPException(400, str(e))
+
+    filename = f"result_{message_id}.{format}"
+    logger.info("=" * 60)
+    return StreamingResponse(
+        encode_stream(columns, chunks, format),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+# ----------- INGESTION API -----------
+async def _next_chunk(chunks):
+    return await anext(chunks, None)
+
+
+def _request_lines(request: Request):
+    """
+    Lines of a request body for a worker thread, pulled from the event loop
+    chunk by chunk so an upload is never held in memory whole
+    """
+    chunks = request.stream()
+    pending = b""
+    while (chunk := from_thread.run(_next_chunk, chunks)) is not None:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8")
+    if pending:
+        yield pending.decode("utf-8")
+
+
+@app.post("/ingest/readings")
+async def ingest_readings(
+    request: Request,
+    replace: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    """Load a batch of NDJSON meter readings into forecasted_table (admins only)"""
+    logger.info("=" * 60)
+    logger.info(f"📥 /ingest/readings HIT by user {current_user.id}")
+
+    if current_user.role != "admin":
+        logger.error("❌ Access denied")
+        raise HTTPException(403, "Access denied")
+
+    try:
+        report = await run_in_threadpool(
+            ingest, read_ndjson_lines(_request_lines(request)), "replace" if replace else "ignore"
+        )
+    except (ValueError, KeyError) as e:
+        logger.error(f"❌ Invalid readings: {e}")
+        raise HTTPException(400, f"Invalid readings: {e}")
+
+    logger.info(f"✅ Ingested {report['rows_written']} rows ({report['rows_per_second']} rows/s)")
+    logger.info("=" * 60)
+    return report
+
+# ----------- STATISTICS API -----------
+@app.get("/stats/meters/{meter_id}")
+def meter_summary(meter_id: str, current_user: User = Depends(get_current_user)):
+    """Precomputed load statistics and approximate quantiles for one meter"""
+    logger.info(f"📊 /stats/meters/{meter_id} HIT by user {current_user.id}")
+
+    summary = get_meter_summary(meter_id)
+    if summary is None:
+        raise HTTPException(404, "No statistics for this meter")
+    return summary
+
+@app.get("/metrics/cascade")
+def cascade_metrics(current_user: User = Depends(get_current_user)):
+    """Per-model latency and escalation rate of the SQL generation cascade (admins only)"""
+    if current_user.role != "admin":
+        raise HTTPException(403, "Access denied")
+    return get_cascade_stats()
 
 @app.get("/debug/routes")
 def list_routes():
@@ -0,0 +1,280 @@
+"""
+Retention and compaction for conversation data.
+
+    python maintenance.py              # run one maintenance pass
+    python maintenance.py --dry-run    # show what retention would delete
+    python maintenance.py --enable-incremental-vacuum   # one-off, rewrites the file
+
+The API server also runs run_maintenance() in a background thread every
+MAINTENANCE_INTERVAL_HOURS (see start_scheduler).
+"""
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+from conversation_events import publish, RESYNC
+from conversation_manager import bump_versions, RETENTION_SCOPE
+from meter_stats import refresh_meter_stats
+
+DB_PATH = "./../mydata.db"
+
+# Days of conversation history kept per role; None keeps everything
+RETENTION_DAYS_BY_ROLE = {
+    "admin": None,
+    "user": 180,
+}
+DEFAULT_RETENTION_DAYS = 180
+# Per-user overrides: {user_id: days or None}
+USER_RETENTION_DAYS = {}
+
+# Rows deleted per transaction, and pause between batches so writers get in
+DELETE_BATCH_SIZE = 500
+BATCH_PAUSE_SECONDS = 0.05
+# Free pages returned to the OS per incremental vacuum step
+VACUUM_PAGES_PER_STEP = 1000
+
+MAINTENANCE_INTERVAL_HOURS = 24
+
+NO_INCREMENTAL_VACUUM = (
+    "auto_vacuum is not INCREMENTAL, so free pages stay in the file; "
+    "run `python maintenance.py --enable-incremental-vacuum` once during a quiet period"
+)
+
+_stop_event = threading.Event()
+_scheduler = None
+
+
+def get_db_size(conn) -> dict:
+    """Database and WAL file sizes plus free pages inside the database file"""
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    wal_path = DB_PATH + "-wal"
+    return {
+        "db_bytes": os.path.getsize(DB_PATH),
+        "wal_bytes": os.path.getsize(wal_path) if os.path.exists(wal_path) else 0,
+        "free_bytes": free_pages * page_size,
+    }
+
+
+def table_exists(conn, name: str) -> bool:
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,)
+    ).fetchone() is not None
+
+
+def retention_cutoffs(conn) -> dict:
+    """{user_id: cutoff timestamp} for every user whose history expires"""
+    now = datetime.now()
+    cutoffs = {}
+    for user_id, role in conn.execute("SELECT id, role FROM users"):
+        if user_id in USER_RETENTION_DAYS:
+            days = USER_RETENTION_DAYS[user_id]
+        else:
+            days = RETENTION_DAYS_BY_ROLE.get(role, DEFAULT_RETENTION_DAYS)
+        if days is not None:
+            cutoffs[user_id] = (now - timedelta(days=days)).isoformat()
+    return cutoffs
+
+
+def delete_in_batches(conn, sql: str, params: tuple) -> int:
+    """
+    Repeat a DELETE ... LIMIT-style statement in small transactions until it
+    stops matching rows, so no single write lock is held for long.
+    """
+    deleted = 0
+    while True:
+        with conn:
+            count = conn.execute(sql, params + (DELETE_BATCH_SIZE,)).rowcount
+        deleted += count
+        if count < DELETE_BATCH_SIZE:
+            return deleted
+        time.sleep(BATCH_PAUSE_SECONDS)
+
+
+def apply_retention(conn, dry_run: bool = False) -> dict:
+    """Delete conversation history older than each user's retention window"""
+    history = 0
+    conversations = 0
+
+    for user_id, cutoff in retention_cutoffs(conn).items():
+        if dry_run:
+            history += conn.execute(
+                "SELECT COUNT(*) FROM conversation_history WHERE user_id = ? AND created_at < ?",
+                (user_id, cutoff)
+            ).fetchone()[0]
+            # Conversations whose remaining history would all be deleted
+            conversations += conn.execute("""
+                SELECT COUNT(*) FROM user_conversations uc
+                WHERE uc.user_id = ? AND uc.created_at < ?
+                  AND NOT EXISTS (
+                      SELECT 1 FROM conversation_history ch
+                      WHERE ch.conversation_id = uc.conversation_id
+                        AND (ch.user_id IS NOT ? OR ch.created_at >= ?)
+                  )
+            """, (user_id, cutoff, user_id, cutoff)).fetchone()[0]
+            continue
+
+        deleted = delete_in_batches(conn, """
+            DELETE FROM conversation_history WHERE id IN (
+                SELECT id FROM conversation_history
+                WHERE user_id = ? AND created_at < ?
+                LIMIT ?
+            )
+        """, (user_id, cutoff))
+
+        # Conversations left without any history
+        deleted_conversations = delete_in_batches(conn, """
+            DELETE FROM user_conversations WHERE conversation_id IN (
+                SELECT uc.conversation_id FROM user_conversations uc
+                WHERE uc.user_id = ? AND uc.created_at < ?
+                  AND NOT EXISTS (
+                      SELECT 1 FROM conversation_history ch
+                      WHERE ch.conversation_id = uc.conversation_id
+                  )
+                LIMIT ?
+            )
+        """, (user_id, cutoff))
+
+        history += deleted
+        conversations += deleted_conversations
+        if deleted or deleted_conversations:
+            # Open tabs reload their conversation list
+            publish(user_id, RESYNC)
+
+    if not dry_run and table_exists(conn, "conversation_summary"):
+        # Summaries of conversations that no longer exist
+        delete_in_batches(conn, """
+            DELETE FROM conversation_summary WHERE conversation_id IN (
+                SELECT cs.conversation_id FROM conversation_summary cs
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM user_conversations uc
+                    WHERE uc.conversation_id = cs.conversation_id
+                )
+                LIMIT ?
+            )
+        """, ())
+
+    if history or conversations:
+        # Cached conversation lists and messages must be revalidated
+        with conn:
+            bump_versions(conn, RETENTION_SCOPE)
+
+    return {"history_deleted": history, "conversations_deleted": conversations}
+
+
+def compact(conn) -> dict:
+    """Return free pages to the OS, refresh planner statistics and checkpoint the WAL"""
+    auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    freed = 0
+    if auto_vacuum == 2:  # INCREMENTAL
+        # Small steps so each write lock stays short
+        while True:
+            before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if before == 0:
+                break
+            conn.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES_PER_STEP})").fetchall()
+            after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if after >= before:
+                break
+            freed += before - after
+            time.sleep(BATCH_PAUSE_SECONDS)
+
+    conn.execute("PRAGMA optimize")
+    busy = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()[0]
+    return {
+        "incremental_vacuum": auto_vacuum == 2,
+        "pages_freed": freed,
+        "checkpoint_busy": bool(busy),
+    }
+
+
+def enable_incremental_vacuum(conn):
+    """
+    One-off switch to auto_vacuum=INCREMENTAL. This needs a full VACUUM, so
+    it rewrites the file once; run it during a quiet period.
+    """
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+
+
+def run_maintenance(dry_run: bool = False) -> dict:
+    """One retention + compaction pass with before/after sizes"""
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    try:
+        before = get_db_size(conn)
+        retention = apply_retention(conn, dry_run)
+        result = {"before": before, "retention": retention, "dry_run": dry_run, "warnings": []}
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            print(f"⚠️  {NO_INCREMENTAL_VACUUM}")
+            result["warnings"].append(NO_INCREMENTAL_VACUUM)
+        if not dry_run:
+            result["compaction"] = compact(conn)
+            # Catch up on readings written outside bulk ingestion
+            result["meter_stats"] = refresh_meter_stats()
+        result["after"] = get_db_size(conn)
+        return result
+    finally:
+        conn.close()
+
+
+def _scheduler_loop():
+    while not _stop_event.wait(MAINTENANCE_INTERVAL_HOURS * 3600):
+        try:
+            report = run_maintenance()
+            print(f"🧹 Maintenance done: {report}")
+        except Exception as e:
+            print(f"Error running maintenance: {e}")
+
+
+def start_scheduler():
+    """Run maintenance in a daemon thread every MAINTENANCE_INTERVAL_HOURS"""
+    global _scheduler
+    if _scheduler is not None and _scheduler.is_alive():
+        return
+    _stop_event.clear()
+    _scheduler = threading.Thread(target=_scheduler_loop, name="maintenance", daemon=True)
+    _scheduler.start()
+
+
+def stop_scheduler():
+    _stop_event.set()
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--enable-incremental-vacuum":
+        conn = sqlite3.connect(DB_PATH)
+        try:
+            enable_incremental_vacuum(conn)
+            print("✅ auto_vacuum set to INCREMENTAL")
+        finally:
+            conn.close()
+        return
+
+    dry_run = len(sys.argv) > 1 and sys.argv[1] == "--dry-run"
+    report = run_maintenance(dry_run)
+
+    print("=" * 60)
+    print("🧹 CONVERSATION MAINTENANCE" + (" (dry run)" if dry_run else ""))
+    print("=" * 60)
+    print(f"\n📊 Before: db {report['before']['db_bytes']} bytes, "
+          f"wal {report['before']['wal_bytes']} bytes, free {report['before']['free_bytes']} bytes")
+    retention = report["retention"]
+    if dry_run:
+        print(f"   - History entries past retention: {retention['history_deleted']}")
+        print(f"   - Conversations that would be left empty: {retention['conversations_deleted']}")
+    else:
+        print(f"   ✓ Deleted {retention['history_deleted']} history entries")
+        print(f"   ✓ Deleted {retention['conversations_deleted']} empty conversations")
+        print(f"   ✓ Freed {report['compaction']['pages_freed']} pages")
+        if report["meter_stats"]["rebuilt"]:
+            print(f"   ✓ Rebuilt statistics for {report['meter_stats']['meters']} meters")
+    print(f"📊 After:  db {report['after']['db_bytes']} bytes, "
+          f"wal {report['after']['wal_bytes']} bytes, free {report['after']['free_bytes']} bytes")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,537 @@
+"""
+Precomputed per-meter statistics for forecasted_table.
+
+    python meter_stats.py rebuild       # recompute every meter from the table
+    python meter_stats.py show MTR_1001 # print one meter's summary
+
+meter_stats keeps, per meter, the row count, the count/sum/min/max/sum of
+squares of forecasted_load_kwh and a log-bucket quantile sketch. Bulk
+ingestion updates it inside each batch transaction (see ingest.py), and
+answer_from_stats() serves simple aggregate SQL from it instead of
+scanning the readings: count/sum/avg/min/max from the running aggregates
+(exact), median/percentile from the sketches (within SKETCH_ALPHA).
+
+The stats remember the forecasted_table version they describe. Writes that
+bypass ingestion make them stale; stale stats are never used to answer a
+query, and the maintenance job rebuilds them.
+"""
+import json
+import math
+import re
+import sqlite3
+import sys
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import datetime
+from itertools import accumulate
+
+import numpy as np
+
+from partitions import TABLE, PARTITION_PREFIX
+from query_engine import get_analytics_db_path, VERSIONS_TABLE
+from result_encoding import infer_column_types
+from sql_functions import interpolate
+
+STATS_TABLE = "meter_stats"
+STATE_TABLE = "meter_stats_state"
+
+# Quantiles from the sketch are within this relative error of the true value
+SKETCH_ALPHA = 0.01
+_LOG_GAMMA = math.log((1 + SKETCH_ALPHA) / (1 - SKETCH_ALPHA))
+
+SUMMARY_QUANTILES = (0.5, 0.9, 0.99)
+
+# Aggregates answerable from the stats: per meter and across meters.
+# {q} is the quantile (0-1) of MEDIAN/PERCENTILE items
+PER_METER_EXPR = {
+    "COUNT(*)": "row_count",
+    "COUNT": "load_count",
+    "SUM": "CASE WHEN load_count > 0 THEN load_sum END",
+    "AVG": "load_sum / NULLIF(load_count, 0)",
+    "MIN": "load_min",
+    "MAX": "load_max",
+    "MEDIAN": "sketch_quantile(sketch, {q})",
+    "PERCENTILE": "sketch_quantile(sketch, {q})",
+}
+ALL_METERS_EXPR = {
+    "COUNT(*)": "COALESCE(SUM(row_count), 0)",
+    "COUNT": "COALESCE(SUM(load_count), 0)",
+    "SUM": "CASE WHEN SUM(load_count) > 0 THEN SUM(load_sum) END",
+    "AVG": "SUM(load_sum) / NULLIF(SUM(load_count), 0)",
+    "MIN": "MIN(load_min)",
+    "MAX": "MAX(load_max)",
+    "MEDIAN": "merged_quantile(sketch, {q})",
+    "PERCENTILE": "merged_quantile(sketch, {q})",
+}
+# Items read from the sketches rather than the running aggregates
+QUANTILE_KEYS = {"MEDIAN", "PERCENTILE"}
+
+# SELECT <items> FROM forecasted_table [WHERE meter_id = '...'] [GROUP BY meter_id]
+# [ORDER BY <term> [ASC|DESC]] [LIMIT n], as produced by normalize_sql
+APPROX_RE = re.compile(
+    rf"^SELECT (?P<items>.+?) FROM (?:\w+\.)?{TABLE}"
+    r"(?: WHERE meter_id = '(?P<meter>[^']*)')?"
+    r"(?P<group> GROUP BY meter_id)?"
+    r"(?: ORDER BY (?P<order>\S+?)(?: (?P<direction>ASC|DESC))?)?"
+    r"(?: LIMIT (?P<limit>\d+))?$"
+)
+ITEM_RE = re.compile(
+    r"^(?:(?P<agg>count|sum|avg|min|max|median)\((?P<arg>\*|forecasted_load_kwh)\)"
+    r"|percentile\(forecasted_load_kwh, (?P<percent>\d+(?:\.\d+)?)\)"
+    r"|(?P<column>meter_id))"
+    r"(?: AS (?P<alias>\w+))?$",
+    re.IGNORECASE
+)
+
+
+def ensure_stats_tables(conn):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {STATS_TABLE} (
+            meter_id TEXT PRIMARY KEY,
+            row_count INTEGER NOT NULL,
+            load_count INTEGER NOT NULL,
+            load_sum REAL NOT NULL,
+            load_min REAL,
+            load_max REAL,
+            load_sum_sq REAL NOT NULL,
+            sketch TEXT NOT NULL
+        )
+    """)
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            source_version INTEGER,
+            refreshed_at TEXT
+        )
+    """)
+
+
+def get_source_version(conn) -> int:
+    """Summed change counters of forecasted_table and its partitions"""
+    try:
+        return conn.execute(
+            f"SELECT COALESCE(SUM(version), 0) FROM {VERSIONS_TABLE} "
+            f"WHERE table_name = ? OR table_name GLOB ?",
+            (TABLE, PARTITION_PREFIX + "*")
+        ).fetchone()[0]
+    except sqlite3.OperationalError:
+        return 0
+
+
+def get_state(conn):
+    """(source_version, refreshed_at) the stats were built for, or (None, None)"""
+    try:
+        row = conn.execute(
+            f"SELECT source_version, refreshed_at FROM {STATE_TABLE} WHERE id = 1"
+        ).fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    return row or (None, None)
+
+
+def set_state(conn, version: int):
+    conn.execute(
+        f"INSERT INTO {STATE_TABLE} (id, source_version, refreshed_at) VALUES (1, ?, ?) "
+        f"ON CONFLICT(id) DO UPDATE SET source_version = excluded.source_version, "
+        f"refreshed_at = excluded.refreshed_at",
+        (version, datetime.now().isoformat(timespec="seconds"))
+    )
+
+
+# ----------- QUANTILE SKETCH -----------
+# Values are counted in logarithmic buckets (gamma = (1+a)/(1-a)), so any
+# quantile read back is within SKETCH_ALPHA relative error. Sketches merge
+# by adding bucket counts, which keeps incremental updates exact.
+
+def sketch_values(values: np.ndarray) -> dict:
+    """Build a sketch {"pos": {key: n}, "neg": {key: n}, "zero": n} from an array"""
+    sketch = {"pos": {}, "neg": {}, "zero": int(np.count_nonzero(values == 0))}
+    for name, part in (("pos", values[values > 0]), ("neg", -values[values < 0])):
+        if len(part):
+            keys, counts = np.unique(np.ceil(np.log(part) / _LOG_GAMMA), return_counts=True)
+            sketch[name] = {str(int(k)): int(n) for k, n in zip(keys, counts)}
+    return sketch
+
+
+def merge_sketches(a: dict, b: dict) -> dict:
+    merged = {"pos": dict(a["pos"]), "neg": dict(a["neg"]), "zero": a["zero"] + b["zero"]}
+    for name in ("pos", "neg"):
+        for key, n in b[name].items():
+            merged[name][key] = merged[name].get(key, 0) + n
+    return merged
+
+
+def _bucket_value(key: int) -> float:
+    gamma = math.exp(_LOG_GAMMA)
+    return 2 * gamma ** key / (gamma + 1)
+
+
+def sketch_quantile(sketch: dict, q: float):
+    """
+    Estimated q-quantile (0 <= q <= 1) of the sketched values, interpolated
+    between neighbouring ranks like the exact percentile() function. Each
+    rank's value is within SKETCH_ALPHA, so for values of one sign (loads)
+    the interpolated estimate is too.
+    """
+    buckets = sorted(
+        [(-_bucket_value(int(k)), n) for k, n in sketch["neg"].items()]
+        + ([(0.0, sketch["zero"])] if sketch["zero"] else [])
+        + [(_bucket_value(int(k)), n) for k, n in sketch["pos"].items()]
+    )
+    ends = list(accumulate(n for _, n in buckets))
+    if not ends:
+        return None
+    return interpolate(lambda rank: buckets[bisect_right(ends, rank)][0], ends[-1], q * 100)
+
+
+class MergedQuantile:
+    """SQL aggregate: quantile of the union of several meters' sketches"""
+
+    def __init__(self):
+        self.sketch = {"pos": {}, "neg": {}, "zero": 0}
+        self.q = None
+
+    def step(self, sketch: str, q: float):
+        self.sketch = merge_sketches(self.sketch, json.loads(sketch))
+        self.q = q
+
+    def finalize(self):
+        return sketch_quantile(self.sketch, self.q) if self.q is not None else None
+
+
+# ----------- MAINTENANCE -----------
+
+def summarize(row_count: int, loads: list) -> tuple:
+    """Stats row values (minus meter_id) for one meter's readings"""
+    values = np.asarray([v for v in loads if v is not None], dtype=np.float64)
+    if not len(values):
+        return (row_count, 0, 0.0, None, None, 0.0, json.dumps(sketch_values(values)))
+    return (
+        row_count, len(values), float(values.sum()), float(values.min()), float(values.max()),
+        float(np.square(values).sum()), json.dumps(sketch_values(values)),
+    )
+
+
+def merge_summary(old: tuple, new: tuple) -> tuple:
+    """Combine two stats rows (minus meter_id) for disjoint sets of readings"""
+    mins = [v for v in (old[3], new[3]) if v is not None]
+    maxs = [v for v in (old[4], new[4]) if v is not None]
+    return (
+        old[0] + new[0], old[1] + new[1], old[2] + new[2],
+        min(mins) if mins else None, max(maxs) if maxs else None,
+        old[5] + new[5],
+        json.dumps(merge_sketches(json.loads(old[6]), json.loads(new[6]))),
+    )
+
+
+def write_stats(conn, rows: list):
+    conn.executemany(f"""
+        INSERT INTO {STATS_TABLE}
+            (meter_id, row_count, load_count, load_sum, load_min, load_max, load_sum_sq, sketch)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(meter_id) DO UPDATE SET
+            row_count = excluded.row_count, load_count = excluded.load_count,
+            load_sum = excluded.load_sum, load_min = excluded.load_min,
+            load_max = excluded.load_max, load_sum_sq = excluded.load_sum_sq,
+            sketch = excluded.sketch
+    """, rows)
+
+
+def recompute_meters(conn, meters) -> list:
+    """Stats rows for the given meters, read from forecasted_table"""
+    rows = []
+    for meter in meters:
+        loads = [r[0] for r in conn.execute(
+            f"SELECT forecasted_load_kwh FROM {TABLE} WHERE meter_id = ?", (meter,)
+        )]
+        if loads:
+            rows.append((meter,) + summarize(len(loads), loads))
+    return rows
+
+
+def update_meter_stats(conn, batch: list, all_new: bool, tables: list):
+    """
+    Ingestion hook, run inside the batch transaction after its rows are
+    written. When every reading was new the batch is merged into the running
+    aggregates; otherwise (duplicates or replaced values) the meters it
+    touched are recomputed from the table. Stats that were already stale
+    are left for the next rebuild.
+    """
+    ensure_stats_tables(conn)
+    version = get_source_version(conn)
+    # The loader bumps each written table's version once per batch
+    if get_state(conn)[0] != version - len(tables):
+        return
+
+    by_meter = defaultdict(list)
+    for meter_id, _, load in batch:
+        by_meter[meter_id].append(load)
+
+    if all_new:
+        rows = []
+        for meter, loads in by_meter.items():
+            new = summarize(len(loads), loads)
+            old = conn.execute(
+                f"SELECT row_count, load_count, load_sum, load_min, load_max, load_sum_sq, sketch "
+                f"FROM {STATS_TABLE} WHERE meter_id = ?", (meter,)
+            ).fetchone()
+            rows.append((meter,) + (merge_summary(old, new) if old else new))
+    else:
+        rows = recompute_meters(conn, by_meter)
+
+    write_stats(conn, rows)
+    set_state(conn, version)
+
+
+def rebuild(conn) -> int:
+    """Recompute the stats of every meter; returns the number of meters"""
+    ensure_stats_tables(conn)
+    conn.execute(f"DELETE FROM {STATS_TABLE}")
+    rows = []
+    meter, loads = None, []
+    cur = conn.execute(f"SELECT meter_id, forecasted_load_kwh FROM {TABLE} ORDER BY meter_id")
+    for meter_id, load in cur:
+        if meter_id != meter:
+            if loads:
+                rows.append((meter,) + summarize(len(loads), loads))
+            meter, loads = meter_id, []
+        loads.append(load)
+    if loads:
+        rows.append((meter,) + summarize(len(loads), loads))
+    write_stats(conn, rows)
+    set_state(conn, get_source_version(conn))
+    return len(rows)
+
+
+def refresh_meter_stats() -> dict:
+    """Rebuild the stats if writes outside ingestion made them stale"""
+    conn = sqlite3.connect(get_analytics_db_path(), isolation_level=None, timeout=30)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if get_state(conn)[0] == get_source_version(conn):
+                conn.execute("COMMIT")
+                return {"rebuilt": False}
+            meters = rebuild(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return {"rebuilt": True, "meters": meters}
+    finally:
+        conn.close()
+
+
+# ----------- QUERYING -----------
+
+def _read_connection():
+    conn = sqlite3.connect(get_analytics_db_path(), timeout=30)
+    conn.create_function("sketch_quantile", 2, lambda sketch, q: sketch_quantile(json.loads(sketch), q),
+                         deterministic=True)
+    conn.create_aggregate("merged_quantile", 2, MergedQuantile)
+    return conn
+
+
+def _is_fresh(conn):
+    """refreshed_at when the stats describe the current table, else None"""
+    version, refreshed_at = get_state(conn)
+    if version is None or version != get_source_version(conn):
+        return None
+    return refreshed_at
+
+
+def _split_items(text: str) -> list:
+    """Split a normalized select list on top-level commas"""
+    items, depth, start = [], 0, 0
+    for i, char in enumerate(text):
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 0:
+            items.append(text[start:i].strip())
+            start = i + 1
+    items.append(text[start:].strip())
+    return items
+
+
+def parse_aggregate_query(sql: str):
+    """
+    Match a normalized SELECT of plain aggregates over forecasted_table.
+    Returns the parsed shape, or None when the stats cannot answer it.
+    """
+    match = APPROX_RE.match(sql)
+    if not match:
+        return None
+
+    items = []
+    for text in _split_items(match.group("items")):
+        item = ITEM_RE.match(text)
+        if not item:
+            return None
+        q = None
+        if item.group("column"):
+            key = "meter_id"
+        elif item.group("percent"):
+            key = "PERCENTILE"
+            q = float(item.group("percent")) / 100
+            if q > 1:
+                return None
+        elif item.group("arg") == "*":
+            if item.group("agg").upper() != "COUNT":
+                return None
+            key = "COUNT(*)"
+        else:
+            key = item.group("agg").upper()
+            q = 0.5 if key == "MEDIAN" else None
+        expr = text.split(" AS ")[0]
+        items.append({"key": key, "name": item.group("alias") or expr, "text": expr, "q": q})
+
+    grouped = match.group("group") is not None
+    if not grouped and any(i["key"] == "meter_id" for i in items):
+        return None
+
+    order = None
+    if match.group("order"):
+        term = match.group("order")
+        positions = [
+            n for n, i in enumerate(items, 1)
+            if term == i["name"] or term.lower() == i["text"].lower()
+        ]
+        if term.isdigit() and 1 <= int(term) <= len(items):
+            positions = [int(term)]
+        if not positions:
+            return None
+        order = (positions[0], match.group("direction") or "ASC")
+
+    return {
+        "items": items,
+        "meter": match.group("meter"),
+        "grouped": grouped,
+        "order": order,
+        "limit": int(match.group("limit")) if match.group("limit") else None,
+    }
+
+
+def answer_from_stats(sql: str, layout: str = "rows"):
+    """
+    Answer a simple aggregate query from meter_stats instead of scanning
+    forecasted_table. Returns a run_sql-style result with an "approximate"
+    entry describing the source and error bounds, or None when the query
+    shape is not supported or the stats are stale.
+
+    Count, sum, min, max and avg are kept as running aggregates, so they
+    match the full scan up to floating-point rounding (relative bound 0).
+    median() and percentile() are read from the quantile sketches and are
+    within SKETCH_ALPHA of the exact value.
+    """
+    shape = parse_aggregate_query(sql)
+    if shape is None:
+        return None
+
+    exprs = PER_METER_EXPR if shape["grouped"] else ALL_METERS_EXPR
+    select = ", ".join(
+        ("meter_id" if i["key"] == "meter_id" else exprs[i["key"]].format(q=i["q"])) + f' AS "{i["name"]}"'
+        for i in shape["items"]
+    )
+    stats_sql = f"SELECT {select} FROM {STATS_TABLE}"
+    params = ()
+    if shape["meter"] is not None:
+        stats_sql += " WHERE meter_id = ?"
+        params = (shape["meter"],)
+    if shape["grouped"]:
+        # GROUP BY without ORDER BY returns meters in id order
+        position, direction = shape["order"] or (None, None)
+        stats_sql += f" ORDER BY {position} {direction}" if position else " ORDER BY meter_id"
+    if shape["limit"] is not None:
+        stats_sql += f" LIMIT {shape['limit']}"
+
+    conn = _read_connection()
+    try:
+        conn.execute("BEGIN")
+        refreshed_at = _is_fresh(conn)
+        if refreshed_at is None:
+            return None
+        rows = conn.execute(stats_sql, params).fetchall()
+    except sqlite3.Error:
+        return None
+    finally:
+        conn.close()
+
+    result = {"columns": [i["name"] for i in shape["items"]], "rows": rows}
+    result["types"] = infer_column_types(result)
+    if layout == "columns":
+        result["data"] = [list(col) for col in zip(*rows)] or [[] for _ in result["columns"]]
+        del result["rows"]
+    result["approximate"] = {
+        "source": STATS_TABLE,
+        "as_of": refreshed_at,
+        "error_bounds": {
+            i["name"]: {"relative": SKETCH_ALPHA if i["key"] in QUANTILE_KEYS else 0.0}
+            for i in shape["items"] if i["key"] != "meter_id"
+        },
+    }
+    return result
+
+
+def get_meter_summary(meter_id: str):
+    """Count, mean, stddev, min, max and sketch quantiles of one meter's load"""
+    conn = _read_connection()
+    try:
+        conn.execute("BEGIN")
+        refreshed_at = _is_fresh(conn)
+        row = conn.execute(
+            f"SELECT row_count, load_count, load_sum, load_min, load_max, load_sum_sq, sketch "
+            f"FROM {STATS_TABLE} WHERE meter_id = ?", (meter_id,)
+        ).fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    finally:
+        conn.close()
+    if row is None:
+        return None
+
+    row_count, count, total, minimum, maximum, sum_sq, sketch = row
+    mean = total / count if count else None
+    stddev = math.sqrt(max(sum_sq / count - mean * mean, 0.0)) if count else None
+    sketch = json.loads(sketch)
+    return {
+        "meter_id": meter_id,
+        "rows": row_count,
+        "count": count,
+        "mean": mean,
+        "stddev": stddev,
+        "min": minimum,
+        "max": maximum,
+        "quantiles": {str(q): sketch_quantile(sketch, q) for q in SUMMARY_QUANTILES},
+        "quantile_relative_error": SKETCH_ALPHA,
+        "as_of": refreshed_at,
+        "stale": refreshed_at is None,
+    }
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ("rebuild", "show"):
+        print("Usage: python meter_stats.py rebuild | show METER_ID")
+        sys.exit(1)
+
+    if sys.argv[1] == "rebuild":
+        conn = sqlite3.connect(get_analytics_db_path(), isolation_level=None, timeout=30)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            meters = rebuild(conn)
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        print(f"✅ Rebuilt statistics for {meters} meters")
+    else:
+        summary = get_meter_summary(sys.argv[2])
+        if summary is None:
+            print(f"❌ No statistics for {sys.argv[2]}")
+            sys.exit(1)
+        for key, value in summary.items():
+            print(f"   {key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,41 @@
 import requests
 import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from token_quota import record_usage
 
 OLLAMA_URL = "http://localhost:11434/api/generate"
+MODEL = "gemma3:12b"
+
+# Sampling temperatures of speculative candidates; the first one is greedy.
+# Ollama only runs them in parallel when OLLAMA_NUM_PARALLEL allows it.
+SPECULATIVE_TEMPERATURES = [0.0, 0.4, 0.7, 1.0]
+MAX_CANDIDATES = len(SPECULATIVE_TEMPERATURES)
+
+# Models tried in order by nl_to_sql, cheapest first. A cheaper tier's SQL
+# is only used when the model finished on its own and the SQL passes the
+# caller's check (validation + EXPLAIN); otherwise the next tier is asked.
+# Off by default: enable with e.g. SQL_MODEL_CASCADE="gemma3:1b,gemma3:12b"
+# once the smaller models are installed.
+MODEL_CASCADE = [
+    model.strip() for model in os.environ.get("SQL_MODEL_CASCADE", MODEL).split(",") if model.strip()
+] or [MODEL]
+# Follow-ups that lean on earlier turns are sent straight to the last tier
+FOLLOW_UP_RE = re.compile(r"\b(that|those|these|them|same|previous)\b", re.IGNORECASE)
+# Latency samples kept per tier for the percentiles in get_cascade_stats
+LATENCY_SAMPLES = 500
 
-def nl_to_sql(query: str, db_content: str, conversation_history: list = None):
+_stats_lock = threading.Lock()
+_cascade_stats = {}  # {model: {"calls", "accepted", "escalated", "latencies"}}
+
+def nl_to_sql(query: str, db_content: str, conversation_history: list = None,
+              context_summary: dict = None, user_id: int = None, accept=None,
+              cancel=None):
     """
     Convert natural language to SQL with conversation context
     
@@ -11,18 +43,88 @@ def nl_to_sql(query: str, db_content: str, conversation_history: list = None):
         query: Current user query
         db_content: Database schema information
         conversation_history: List of previous {query, sql} pairs (last 7)
+        context_summary: Rolling conversation summary, used instead of the
+            raw pairs once they outgrow the context budget
+        user_id: User charged for the tokens the model uses
+        accept: Check a candidate must pass to stop the model cascade;
+            without it only the last (largest) model is used
+        cancel: Event-like flag that abandons the model call when set
     """
     
+    prompt = build_sql_prompt(query, db_content, conversation_history, context_summary)
+    has_context = bool(conversation_history or context_summary)
+    tiers = MODEL_CASCADE if accept is not None else MODEL_CASCADE[-1:]
+    if has_context and FOLLOW_UP_RE.search(query):
+        tiers = tiers[-1:]
+
+    for model in tiers[:-1]:
+        details = {}
+        started = time.perf_counter()
+        sql = generate_sql(prompt, model, user_id, cancel=cancel, details=details)
+        # A truncated answer is never trusted, even if it happens to parse
+        confident = details.get("done_reason") != "length"
+        accepted = bool(sql) and confident and accept(sql)
+        _record_tier(model, time.perf_counter() - started, accepted)
+        if accepted:
+            print(f"Generated SQL with context ({model}):", sql)
+            return sql
+        print(f"Escalating from {model}:", sql)
+
+    started = time.perf_counter()
+    sql = generate_sql(prompt, tiers[-1], user_id, cancel=cancel)
+    _record_tier(tiers[-1], time.perf_counter() - started, None)
+    print("Generated SQL with context:", sql)
+    return sql
+
+
+def _record_tier(model: str, seconds: float, accepted):
+    """Count one cascade call; accepted is None for the last tier"""
+    with _stats_lock:
+        stats = _cascade_stats.setdefault(model, {
+            "calls": 0, "accepted": 0, "escalated": 0,
+            "latencies": deque(maxlen=LATENCY_SAMPLES),
+        })
+        stats["calls"] += 1
+        stats["latencies"].append(seconds)
+        if accepted:
+            stats["accepted"] += 1
+        elif accepted is False:
+            stats["escalated"] += 1
+
+
+def get_cascade_stats() -> dict:
+    """Per-model call counts, escalation rate and latency percentiles (seconds)"""
+    with _stats_lock:
+        report = {}
+        for model, stats in _cascade_stats.items():
+            latencies = sorted(stats["latencies"])
+            judged = stats["accepted"] + stats["escalated"]
+            report[model] = {
+                "calls": stats["calls"],
+                "accepted": stats["accepted"],
+                "escalated": stats["escalated"],
+                "escalation_rate": stats["escalated"] / judged if judged else None,
+                "p50_seconds": latencies[len(latencies) // 2] if latencies else None,
+                "p95_seconds": latencies[int(len(latencies) * 0.95)] if latencies else None,
+            }
+        return report
+
+
+def build_sql_prompt(query: str, db_content: str, conversation_history: list = None,
+                     context_summary: dict = None) -> str:
+    """Prompt asking the model for the SQL answering `query`"""
     # Build context from conversation history
     context_section = ""
-    if conversation_history and len(conversation_history) > 0:
+    if context_summary:
+        context_section = format_context_summary(context_summary)
+    elif conversation_history and len(conversation_history) > 0:
         context_section = "\n\nPrevious conversation context:\n"
         for idx, item in enumerate(conversation_history[-7:], 1):  # Last 7 only
             context_section += f"{idx}. User asked: \"{item['query']}\"\n"
             context_section += f"   Generated SQL: {item['sql']}\n"
         context_section += "\nUse this context to understand references like 'that', 'those', 'same', etc.\n"
     
-    prompt = f"""
+    return f"""
     Database Schema:
     {db_content}
 
@@ -32,26 +134,128 @@ def nl_to_sql(query: str, db_content: str, conversation_history: list = None):
     - Use ONLY the tables and columns from the schema above
     - If the user refers to previous queries (like "show more", "same but...", "those results"), use the context
     - For follow-up questions, maintain continuity with previous queries
+    - For medians and percentiles use median(column) or percentile(column, P) with P from 0 to 100
     
     Current question: {query}
     
     SQL Query:"""
 
+
+def nl_to_sql_speculative(query: str, db_content: str, conversation_history: list = None,
+                          context_summary: dict = None, user_id: int = None,
+                          candidates: int = 3, accept=None, cancel=None):
+    """
+    Generate up to `candidates` SQL statements concurrently at different
+    temperatures and return the first one accept(sql) approves, cancelling
+    the rest. When none is accepted the greedy candidate is returned so the
+    caller can still try a repair. `cancel` (a jobs.CancelToken) stops all
+    candidates.
+    """
+    prompt = build_sql_prompt(query, db_content, conversation_history, context_summary)
+    temperatures = SPECULATIVE_TEMPERATURES[:max(1, min(candidates, MAX_CANDIDATES))]
+    stop = threading.Event()
+    if cancel is not None:
+        cancel.add_hook(stop.set)
+
+    pool = ThreadPoolExecutor(max_workers=len(temperatures))
+    futures = {
+        pool.submit(generate_sql, prompt, MODEL, user_id, temperature, stop): temperature
+        for temperature in temperatures
+    }
+    results = {}
+    try:
+        for future in as_completed(futures):
+            sql = future.result()
+            if not sql:
+                continue
+            if accept is None or accept(sql):
+                print(f"Speculative SQL accepted at temperature {futures[future]}:", sql)
+                return sql
+            results[futures[future]] = sql
+    finally:
+        # Candidates still streaming stop at their next chunk
+        stop.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+        if cancel is not None:
+            cancel.remove_hook(stop.set)
+
+    print("No speculative candidate passed validation")
+    return results.get(temperatures[0]) or next(iter(results.values()), "")
+
+
+def format_context_summary(summary: dict) -> str:
+    """Render a conversation_manager summary as a compact prompt section"""
+    lines = ["\n\nPrevious conversation context (summarized):"]
+    if summary.get("tables"):
+        lines.append(f"Tables in use: {', '.join(summary['tables'])}")
+    if summary.get("filters"):
+        lines.append(f"Recent filters: {'; '.join(summary['filters'])}")
+    if summary.get("questions"):
+        lines.append("Recent questions (latest first): " + " | ".join(
+            f'"{q}"' for q in summary["questions"]
+        ))
+    if summary.get("last_sql"):
+        lines.append(f"Last SQL: {summary['last_sql']}")
+    last_result = summary.get("last_result")
+    if last_result:
+        lines.append(
+            f"Last result: {last_result['rows']} rows with columns {', '.join(last_result['columns'])}"
+        )
+    lines.append("\nUse this context to understand references like 'that', 'those', 'same', etc.\n")
+    return "\n".join(lines)
+
+
+def generate_sql(prompt: str, model: str = MODEL, user_id: int = None,
+                 temperature: float = None, cancel=None,
+                 details: dict = None):
+    """
+    Send a prompt to Ollama and return the cleaned-up SQL text. The prompt
+    and output token counts Ollama reports are charged to user_id, and
+    Ollama's done_reason is stored in `details` when given.
+
+    With a `cancel` flag (anything with is_set()) the response is streamed
+    and abandoned (closing the connection, which stops Ollama) as soon as
+    the flag is set; an empty string is returned then.
+    """
+    if cancel is not None and cancel.is_set():
+        return ""
     try:
-        res = requests.post(OLLAMA_URL, json={
-            "model": "gemma3:12b",
+        request = {
+            "model": model,
             "prompt": prompt,
-            "stream": False  # Disable streaming for cleaner response
-        })
+            # Stream only when the call can be cancelled; otherwise one response is cleaner
+            "stream": cancel is not None
+        }
+        if temperature is not None:
+            request["options"] = {"temperature": temperature}
+        res = requests.post(OLLAMA_URL, json=request, stream=cancel is not None)
+
+        if cancel is not None:
+            lines = []
+            with res:
+                for line in res.iter_lines(decode_unicode=True):
+                    if cancel.is_set():
+                        # Each streamed chunk is about one output token
+                        if user_id is not None:
+                            record_usage(user_id, len(lines))
+                        return ""
+                    lines.append(line)
+        else:
+            lines = res.text.strip().splitlines()
         
         # Parse response
         sql_parts = []
-        for line in res.text.strip().splitlines():
+        tokens = 0
+        for line in lines:
             line = line.strip()
             if not line:
                 continue
             try:
                 chunk = json.loads(line)
+                # Counts arrive on the final ("done") chunk
+                tokens += chunk.get("prompt_eval_count", 0) + chunk.get("eval_count", 0)
+                if chunk.get("done") and details is not None:
+                    details["done_reason"] = chunk.get("done_reason")
                 resp = chunk.get("response", "")
                 # Skip markdown code block markers
                 if resp.strip() in ("```", "```sql", "sql"):
@@ -61,11 +265,11 @@ def nl_to_sql(query: str, db_content: str, conversation_history: list = None):
                 continue
 
         sql = "".join(sql_parts).strip()
+        if user_id is not None:
+            record_usage(user_id, tokens)
         
         # Clean up the SQL
         sql = sql.replace("```sql", "").replace("```", "").strip()
-        
-        print("Generated SQL with context:", sql)
         return sql
 
     except Exception as e:
@@ -73,6 +277,35 @@ def nl_to_sql(query: str, db_content: str, conversation_history: list = None):
         return ""
 
 
+def repair_sql(query: str, sql: str, error: str, db_content: str, user_id: int = None,
+               cancel=None):
+    """
+    Ask the model to fix a generated statement that failed validation.
+    Only one repair attempt is made per question.
+    """
+    prompt = f"""
+    Database Schema:
+    {db_content}
+
+    The SQL below was generated for the question "{query}" but it is invalid.
+
+    SQL:
+    {sql}
+
+    Error:
+    {error}
+
+    You are an SQL generator. Output ONLY the corrected SQL query, nothing else.
+    - Use ONLY the tables and columns from the schema above
+    - Output a single read-only SELECT statement
+
+    Corrected SQL Query:"""
+
+    fixed = generate_sql(prompt, user_id=user_id, cancel=cancel)
+    print("Repaired SQL:", fixed)
+    return fixed
+
+
 def build_context_prompt(conversation_history: list, max_context: int = 7):
     """
     Helper function to build a context-aware prompt from conversation history
@@ -0,0 +1,427 @@
+"""
+Monthly partitioning of forecasted_table.
+
+    python partitions.py migrate               # split the table into monthly partitions
+    python partitions.py list                  # show partitions and row counts
+    python partitions.py drop-before 2025-01   # drop partitions older than a month
+
+After migration forecasted_table is a view over forecasted_table_pYYYY_MM
+tables, so generated SQL keeps working unchanged. prune_partitions()
+rewrites queries with datetime predicates to read only the months asked
+about, and dropping a month is a DROP TABLE instead of a DELETE over the
+whole history.
+"""
+import sqlite3
+import sys
+import threading
+
+from query_engine import (
+    get_analytics_db_path, get_analytics_schema, get_read_connection,
+    ensure_versions_table, ensure_version_tracking, VERSIONS_TABLE
+)
+from sql_validator import tokenize_spans, SQL_KEYWORDS
+
+TABLE = "forecasted_table"
+PARTITION_PREFIX = f"{TABLE}_p"
+TIME_COLUMN = "datetime"
+ID_SEQUENCE_TABLE = f"{TABLE}_ids"
+
+# Ids are unique across partitions: they are given explicitly on insert,
+# allocated from ID_SEQUENCE_TABLE (see allocate_ids)
+PARTITION_COLUMNS = """
+    id INTEGER PRIMARY KEY,
+    meter_id TEXT NOT NULL,
+    datetime TEXT NOT NULL,
+    forecasted_load_kwh REAL
+"""
+
+# Keywords that end the WHERE clause of a SELECT scope
+CLAUSE_END = {"GROUP", "ORDER", "LIMIT", "HAVING", "WINDOW", "UNION", "EXCEPT", "INTERSECT"}
+RANGE_OPS = {">", ">=", "<", "<=", "=", "=="}
+FLIPPED_OPS = {">": "<", ">=": "<=", "<": ">", "<=": ">=", "=": "=", "==": "=="}
+
+_partition_lock = threading.Lock()
+_partition_cache = {"schema_version": None, "months": []}
+
+
+def partition_name(month: str) -> str:
+    """Table holding one month ("YYYY-MM") of readings"""
+    return f"{PARTITION_PREFIX}{month.replace('-', '_')}"
+
+
+def is_partition_table(name: str) -> bool:
+    return name.startswith(PARTITION_PREFIX)
+
+
+def list_partition_months(conn, schema: str = "main") -> list:
+    """Months that have a partition table, oldest first"""
+    rows = conn.execute(
+        f"SELECT name FROM {schema}.sqlite_master WHERE type='table' AND name LIKE ? ORDER BY name",
+        (PARTITION_PREFIX + "%",)
+    ).fetchall()
+    return [row[0][len(PARTITION_PREFIX):].replace("_", "-") for row in rows]
+
+
+def is_partitioned(conn, schema: str = "main") -> bool:
+    """True once forecasted_table has been migrated to a view over partitions"""
+    row = conn.execute(f"SELECT type FROM {schema}.sqlite_master WHERE name=?", (TABLE,)).fetchone()
+    return row is not None and row[0] == "view"
+
+
+def get_partition_months() -> list:
+    """Partition months as seen by the query connection, cached per schema version"""
+    conn = get_read_connection()
+    schema = get_analytics_schema()
+    version = conn.execute(f"PRAGMA {schema}.schema_version").fetchone()[0]
+    with _partition_lock:
+        if _partition_cache["schema_version"] != version:
+            months = list_partition_months(conn, schema) if is_partitioned(conn, schema) else []
+            _partition_cache["months"] = months
+            _partition_cache["schema_version"] = version
+        return _partition_cache["months"]
+
+
+def union_sql(months: list) -> str:
+    """SELECT over the given partitions (an empty result when there are none)"""
+    if not months:
+        return (
+            "SELECT CAST(NULL AS INTEGER) AS id, CAST(NULL AS TEXT) AS meter_id, "
+            "CAST(NULL AS TEXT) AS datetime, CAST(NULL AS REAL) AS forecasted_load_kwh "
+            "WHERE 0"
+        )
+    return " UNION ALL ".join(f"SELECT * FROM {partition_name(m)}" for m in months)
+
+
+def rebuild_view(conn):
+    conn.execute(f"DROP VIEW IF EXISTS {TABLE}")
+    conn.execute(f"CREATE VIEW {TABLE} AS {union_sql(list_partition_months(conn))}")
+
+
+def create_partition(conn, month: str) -> bool:
+    """Create a month's partition with its indexes; returns False if it already existed"""
+    name = partition_name(month)
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,)
+    ).fetchone()
+    if exists:
+        return False
+
+    conn.execute(f"CREATE TABLE {name} ({PARTITION_COLUMNS})")
+    conn.execute(f"CREATE UNIQUE INDEX idx_{name}_meter_datetime ON {name}(meter_id, datetime)")
+    conn.execute(f"CREATE INDEX idx_{name}_datetime ON {name}(datetime)")
+    return True
+
+
+def ensure_partitions(conn, months) -> list:
+    """Create any missing partitions (inside the caller's transaction)"""
+    created = [m for m in sorted(set(months)) if create_partition(conn, m)]
+    if created:
+        rebuild_view(conn)
+        ensure_versions_table(conn)
+        for month in created:
+            conn.execute(
+                f"INSERT OR IGNORE INTO {VERSIONS_TABLE} (table_name, version) VALUES (?, 0)",
+                (partition_name(month),)
+            )
+    return created
+
+
+def ensure_id_sequence(conn, start: int = None):
+    """Create the shared id sequence, starting after the highest existing id"""
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {ID_SEQUENCE_TABLE} (next_id INTEGER NOT NULL)")
+    if conn.execute(f"SELECT 1 FROM {ID_SEQUENCE_TABLE}").fetchone() is not None:
+        return
+    if start is None:
+        start = 1 + max(
+            [conn.execute(f"SELECT MAX(id) FROM {partition_name(m)}").fetchone()[0] or 0
+             for m in list_partition_months(conn)] or [0]
+        )
+    conn.execute(f"INSERT INTO {ID_SEQUENCE_TABLE} (next_id) VALUES (?)", (start,))
+
+
+def allocate_ids(conn, count: int) -> int:
+    """Reserve count consecutive ids for new rows (inside the caller's transaction); returns the first"""
+    ensure_id_sequence(conn)
+    first = conn.execute(f"SELECT next_id FROM {ID_SEQUENCE_TABLE}").fetchone()[0]
+    conn.execute(f"UPDATE {ID_SEQUENCE_TABLE} SET next_id = ?", (first + count,))
+    return first
+
+
+def migrate(conn):
+    """Move the rows of a plain forecasted_table into monthly partitions"""
+    if is_partitioned(conn):
+        print("✅ forecasted_table is already partitioned")
+        return
+
+    ensure_versions_table(conn)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        months = [
+            row[0] for row in conn.execute(
+                f"SELECT DISTINCT substr({TIME_COLUMN}, 1, 7) FROM {TABLE} ORDER BY 1"
+            )
+        ]
+        # Continue after the highest id ever handed out, deleted rows included
+        last_id = conn.execute(f"SELECT MAX(id) FROM {TABLE}").fetchone()[0] or 0
+        has_sequence = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='sqlite_sequence'"
+        ).fetchone()
+        if has_sequence:
+            seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (TABLE,)).fetchone()
+            last_id = max(last_id, seq[0] if seq else 0)
+        for month in months:
+            create_partition(conn, month)
+            conn.execute(
+                f"INSERT INTO {partition_name(month)} (id, meter_id, datetime, forecasted_load_kwh) "
+                f"SELECT id, meter_id, datetime, forecasted_load_kwh FROM {TABLE} "
+                f"WHERE substr({TIME_COLUMN}, 1, 7) = ? ORDER BY meter_id, datetime",
+                (month,)
+            )
+            print(f"   ✓ {partition_name(month)}")
+        ensure_id_sequence(conn, last_id + 1)
+        conn.execute(f"DROP TABLE {TABLE}")
+        conn.execute(f"DELETE FROM {VERSIONS_TABLE} WHERE table_name = ?", (TABLE,))
+        rebuild_view(conn)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+    ensure_version_tracking(conn)
+    print(f"✅ Migrated forecasted_table into {len(months)} partitions")
+
+
+def drop_partitions_before(conn, month: str) -> list:
+    """Drop whole partitions older than month ("YYYY-MM"); no row-by-row deletes"""
+    old = [m for m in list_partition_months(conn) if m < month]
+    if not old:
+        return []
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for m in old:
+            conn.execute(f"DROP TABLE {partition_name(m)}")
+            conn.execute(f"DELETE FROM {VERSIONS_TABLE} WHERE table_name = ?", (partition_name(m),))
+        rebuild_view(conn)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return old
+
+
+# ----------- PARTITION PRUNING -----------
+
+def _depths(tokens: list) -> list:
+    """Parenthesis depth of every token"""
+    depths = []
+    depth = 0
+    for _, text, _, _ in tokens:
+        if text == ")":
+            depth -= 1
+        depths.append(depth)
+        if text == "(":
+            depth += 1
+    return depths
+
+
+def _scope_end(depths: list, i: int) -> int:
+    """Index just past the parenthesized group that contains token i"""
+    d = depths[i]
+    j = i
+    while j < len(depths) and depths[j] >= d:
+        j += 1
+    return j
+
+
+def _string_value(token) -> str:
+    return token[1][1:-1].replace("''", "'") if token[0] == "string" else None
+
+
+def _is_time_column(tokens, i, qualifier) -> int:
+    """
+    Length of a reference to this table's datetime starting at i, or 0:
+    a bare datetime, or one qualified by the table's name or alias. Columns
+    of other tables (b.datetime in a self-join) are not references.
+    """
+    kind, text = tokens[i][0], tokens[i][1]
+    if kind not in ("word", "ident") or (i > 0 and tokens[i - 1][1] == "."):
+        return 0
+    if text.strip('"`[]').lower() == TIME_COLUMN:
+        return 1
+    if (
+        i + 2 < len(tokens)
+        and text.strip('"`[]').lower() == qualifier
+        and tokens[i + 1][1] == "."
+        and tokens[i + 2][1].strip('"`[]').lower() == TIME_COLUMN
+    ):
+        return 3
+    return 0
+
+
+def _time_bounds(tokens, depths, start, end, qualifier):
+    """
+    Lower/upper datetime bounds implied by AND-ed predicates of one WHERE
+    clause. Returns None when the clause cannot be used for pruning.
+    """
+    d = depths[start]
+    lower, upper = None, None
+
+    def tighten(op, value):
+        nonlocal lower, upper
+        if op in (">", ">=", "=", "=="):
+            lower = value if lower is None else max(lower, value)
+        if op in ("<", "<=", "=", "=="):
+            upper = value if upper is None else min(upper, value)
+
+    i = start
+    while i < end:
+        if depths[i] != d:
+            i += 1
+            continue
+        word = tokens[i][1].upper()
+        if word == "OR":
+            return None
+        if word == "CASE" and tokens[i][0] == "word":
+            # Comparisons inside CASE ... END are values, not filters
+            nesting = 0
+            while i < end:
+                if depths[i] == d and tokens[i][0] == "word":
+                    kw = tokens[i][1].upper()
+                    nesting += kw == "CASE"
+                    nesting -= kw == "END"
+                    if nesting == 0:
+                        break
+                i += 1
+            i += 1
+            continue
+
+        n = _is_time_column(tokens, i, qualifier)
+        negated = i > start and tokens[i - 1][1].upper() == "NOT"
+        if n and i + n < end and not negated:
+            op_token = tokens[i + n]
+            op = op_token[1].upper()
+            if op in RANGE_OPS and i + n + 1 < end and _string_value(tokens[i + n + 1]) is not None:
+                tighten(op, _string_value(tokens[i + n + 1]))
+            elif (
+                op == "BETWEEN" and i + n + 3 < end
+                and _string_value(tokens[i + n + 1]) is not None
+                and tokens[i + n + 2][1].upper() == "AND"
+                and _string_value(tokens[i + n + 3]) is not None
+            ):
+                tighten(">=", _string_value(tokens[i + n + 1]))
+                tighten("<=", _string_value(tokens[i + n + 3]))
+                i += n + 4
+                continue
+            elif op == "LIKE" and i + n + 1 < end and _string_value(tokens[i + n + 1]):
+                prefix = _string_value(tokens[i + n + 1]).split("%")[0].split("_")[0]
+                if len(prefix) >= 7:
+                    tighten(">=", prefix)
+                    tighten("<=", prefix)
+            i += n
+            continue
+
+        # Reversed comparison: 'value' < datetime
+        if (
+            tokens[i][0] == "string" and i + 2 < end and tokens[i + 1][1] in RANGE_OPS
+            and _is_time_column(tokens, i + 2, qualifier)
+        ):
+            tighten(FLIPPED_OPS[tokens[i + 1][1]], _string_value(tokens[i]))
+            i += 3
+            continue
+        i += 1
+
+    return lower, upper
+
+
+def prune_partitions(sql: str) -> str:
+    """
+    Replace each forecasted_table reference that is constrained by datetime
+    predicates with a UNION ALL over only the partitions in range. SQL that
+    cannot be proven safe to prune (OR-ed predicates, no bounds) is left
+    reading the full view.
+    """
+    months = get_partition_months()
+    if not months or TABLE not in sql.lower():
+        return sql
+
+    tokens = tokenize_spans(sql)
+    depths = _depths(tokens)
+    replacements = []
+
+    for i, token in enumerate(tokens):
+        if token[1].strip('"`[]').lower() != TABLE or i == 0:
+            continue
+        if tokens[i - 1][1].upper() not in ("FROM", "JOIN", ","):
+            continue
+
+        # Optional alias after the table name
+        j = i + 1
+        if j < len(tokens) and tokens[j][1].upper() == "AS":
+            j += 1
+        alias = None
+        if j < len(tokens) and tokens[j][0] in ("word", "ident") and tokens[j][1].upper() not in SQL_KEYWORDS:
+            alias = tokens[j][1].strip('"`[]').lower()
+        # An aliased table can only be referred to by its alias
+        qualifier = alias or TABLE
+
+        # WHERE clause of the same SELECT scope
+        d = depths[i]
+        scope_end = _scope_end(depths, i)
+        where = next(
+            (k for k in range(i, scope_end)
+             if depths[k] == d and tokens[k][1].upper() == "WHERE"),
+            None
+        )
+        stop = next(
+            (k for k in range(i, scope_end)
+             if depths[k] == d and tokens[k][1].upper() in CLAUSE_END),
+            scope_end
+        )
+        if where is None or where > stop:
+            continue
+
+        bounds = _time_bounds(tokens, depths, where + 1, stop, qualifier)
+        if bounds is None or bounds == (None, None):
+            continue
+        lower, upper = bounds
+        selected = [
+            m for m in months
+            if (lower is None or m >= lower[:7]) and (upper is None or m <= upper[:7])
+        ]
+        if len(selected) == len(months):
+            continue
+
+        subquery = f"({union_sql(selected)})"
+        if alias is None:
+            subquery += f" AS {TABLE}"
+        replacements.append((token[2], token[3], subquery))
+
+    for start, end, text in reversed(replacements):
+        sql = sql[:start] + text + sql[end:]
+    return sql
+
+
+def main():
+    conn = sqlite3.connect(get_analytics_db_path(), isolation_level=None, timeout=30)
+    try:
+        if len(sys.argv) > 1 and sys.argv[1] == "migrate":
+            migrate(conn)
+        elif len(sys.argv) > 1 and sys.argv[1] == "list":
+            for month in list_partition_months(conn):
+                count = conn.execute(f"SELECT COUNT(*) FROM {partition_name(month)}").fetchone()[0]
+                print(f"   - {partition_name(month)}: {count} rows")
+        elif len(sys.argv) > 2 and sys.argv[1] == "drop-before":
+            dropped = drop_partitions_before(conn, sys.argv[2])
+            print(f"🗑️  Dropped {len(dropped)} partitions: {', '.join(dropped) or '-'}")
+        else:
+            print("Usage:")
+            print("  python partitions.py migrate               # Split forecasted_table by month")
+            print("  python partitions.py list                  # Show partitions")
+            print("  python partitions.py drop-before YYYY-MM   # Drop partitions older than a month")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
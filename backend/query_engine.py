@@ -0,0 +1,373 @@
+import os
+import sqlite3
+import threading
+from urllib.request import pathname2url
+
+from sql_functions import register_functions
+
+DB_PATH = "./../mydata.db"
+
+# Optional separate database file holding the analytics tables. When set it
+# is attached read-only to every query connection under ANALYTICS_SCHEMA.
+ANALYTICS_DB_PATH = None
+ANALYTICS_SCHEMA = "analytics"
+
+# Serve generated SQL from an in-memory copy of the analytics tables. The
+# copy is made with the backup API into a shared-cache memory database and
+# rebuilt, next to the live one, whenever the analytics tables change; query
+# connections switch to the new copy before their next statement. Needs
+# enough RAM for the tables, and shared cache serializes b-tree access
+# between reader threads, so it trades some concurrency for disk-free reads.
+MEMORY_SNAPSHOT = False
+SNAPSHOT_CHECK_SECONDS = 5
+
+# Tables owned by the application that generated SQL must never read
+APP_STATE_TABLES = {
+    "users",
+    "tokens",
+    "token_count",
+    "user_conversations",
+    "conversation_history",
+    "conversation_context",
+    "conversation_summary",
+    "conversation_versions",
+    "conversation_search",
+    "conversation_search_data",
+    "conversation_search_idx",
+    "conversation_search_docsize",
+    "conversation_search_config",
+    "table_versions",
+    "forecasted_table_ids",
+    "meter_stats",
+    "meter_stats_state",
+    "saved_queries",
+    "saved_query_results",
+}
+
+# Per-table change counters, bumped by triggers on every analytics write
+VERSIONS_TABLE = "table_versions"
+
+# Prepared statements kept per query connection; generated SQL is
+# parameterized, so statements of the same shape are compiled once
+STATEMENT_CACHE_SIZE = 256
+
+# Pragmas used for schema introspection; everything else is denied
+ALLOWED_PRAGMAS = {"table_info", "table_xinfo", "index_list", "schema_version", "data_version"}
+
+_local = threading.local()
+
+_version_lock = threading.Lock()
+_version_state = {"conn": None, "data_version": None, "versions": {}}
+
+_snapshot_lock = threading.Lock()
+# The live in-memory copy; "keeper" holds it open, "versions" are the
+# table_versions counters it was copied at
+_snapshot = {"uri": None, "generation": 0, "keeper": None, "versions": None, "schema_version": None}
+# Open query connections per snapshot generation. Each holds its copy in
+# memory, so build_snapshot closes those more than one generation old
+_snapshot_readers = {}  # {generation: [conn, ...]}
+_snapshot_stop = threading.Event()
+_snapshot_thread = None
+
+
+def _read_only_uri(path: str) -> str:
+    return "file:" + pathname2url(os.path.abspath(path)) + "?mode=ro"
+
+
+def _authorizer(action, arg1, arg2, db_name, source):
+    """Allow plain reads of analytics tables only"""
+    if action in (sqlite3.SQLITE_SELECT, sqlite3.SQLITE_FUNCTION,
+                  getattr(sqlite3, "SQLITE_RECURSIVE", 33)):
+        return sqlite3.SQLITE_OK
+    if action == sqlite3.SQLITE_READ:
+        if arg1 and arg1.lower() in APP_STATE_TABLES:
+            return sqlite3.SQLITE_DENY
+        return sqlite3.SQLITE_OK
+    if action == sqlite3.SQLITE_PRAGMA:
+        if arg1 and arg1.lower() in ALLOWED_PRAGMAS and (arg2 or "").lower() not in APP_STATE_TABLES:
+            return sqlite3.SQLITE_OK
+        return sqlite3.SQLITE_DENY
+    return sqlite3.SQLITE_DENY
+
+
+def open_read_connection():
+    """
+    Open a new read-only, sandboxed connection for generated SQL. Close it
+    with close_read_connection so it leaves the snapshot reader registry.
+    """
+    with _snapshot_lock:
+        snapshot_uri, generation = _snapshot["uri"], _snapshot["generation"]
+    # Without a separate analytics file the snapshot replaces the main database
+    main_uri = snapshot_uri if snapshot_uri and not ANALYTICS_DB_PATH else _read_only_uri(DB_PATH)
+    conn = sqlite3.connect(main_uri, uri=True, check_same_thread=False,
+                           cached_statements=STATEMENT_CACHE_SIZE)
+    if ANALYTICS_DB_PATH:
+        conn.execute(
+            f"ATTACH DATABASE ? AS {ANALYTICS_SCHEMA}",
+            (snapshot_uri or _read_only_uri(ANALYTICS_DB_PATH),)
+        )
+    conn.execute("PRAGMA query_only = ON")
+    register_functions(conn)
+    conn.set_authorizer(_authorizer)
+    if snapshot_uri:
+        with _snapshot_lock:
+            _snapshot_readers.setdefault(generation, []).append(conn)
+    return conn
+
+
+def close_read_connection(conn):
+    """Close a query connection and forget it in the snapshot reader registry"""
+    with _snapshot_lock:
+        for generation, readers in list(_snapshot_readers.items()):
+            if conn in readers:
+                readers.remove(conn)
+                if not readers:
+                    del _snapshot_readers[generation]
+                break
+    conn.close()
+
+
+def get_read_connection():
+    """
+    Return this thread's read-only query connection, opening it on first
+    use and reopening it when a newer in-memory snapshot has been swapped in
+    """
+    conn = getattr(_local, "conn", None)
+    generation = _snapshot["generation"]
+    if conn is not None and getattr(_local, "generation", generation) != generation:
+        close_read_connection(conn)
+        conn = None
+    if conn is None:
+        conn = open_read_connection()
+        _local.conn = conn
+        _local.generation = generation
+    return conn
+
+
+def get_schemas() -> list:
+    """Database schemas visible to generated SQL"""
+    return ["main", ANALYTICS_SCHEMA] if ANALYTICS_DB_PATH else ["main"]
+
+
+def get_analytics_db_path() -> str:
+    """Path of the database file that holds the analytics tables"""
+    return ANALYTICS_DB_PATH or DB_PATH
+
+
+def get_analytics_schema() -> str:
+    """Schema name of the analytics tables on query connections"""
+    return ANALYTICS_SCHEMA if ANALYTICS_DB_PATH else "main"
+
+
+def ensure_versions_table(conn):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {VERSIONS_TABLE} (
+            table_name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+
+
+def ensure_version_tracking(conn):
+    """
+    Create the table_versions counters and the triggers that bump them for
+    every analytics table in the connection's main database.
+    """
+    ensure_versions_table(conn)
+    tables = [
+        row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'"
+        )
+        if row[0] not in APP_STATE_TABLES
+    ]
+    for table in tables:
+        conn.execute(
+            f"INSERT OR IGNORE INTO {VERSIONS_TABLE} (table_name, version) VALUES (?, 0)",
+            (table,)
+        )
+        create_version_triggers(conn, table)
+    conn.commit()
+
+
+def create_version_triggers(conn, table: str):
+    """Install the triggers that bump a table's change counter"""
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{event.lower()}
+            AFTER {event} ON "{table}"
+            BEGIN
+                UPDATE {VERSIONS_TABLE} SET version = version + 1
+                WHERE table_name = '{table}';
+            END
+        """)
+
+
+def drop_version_triggers(conn, table: str):
+    """
+    Remove a table's version triggers. Bulk writers do this once per load,
+    bump the counter with bump_table_version in every transaction that
+    writes the table, and recreate the triggers when the load ends.
+    """
+    for event in ("insert", "update", "delete"):
+        conn.execute(f"DROP TRIGGER IF EXISTS trg_{table}_version_{event}")
+
+
+def bump_table_version(conn, table: str):
+    """Record a change to a table written without its triggers (bulk loads)"""
+    conn.execute(
+        f"INSERT INTO {VERSIONS_TABLE} (table_name, version) VALUES (?, 1) "
+        f"ON CONFLICT(table_name) DO UPDATE SET version = version + 1",
+        (table,)
+    )
+
+
+def get_table_versions() -> dict:
+    """
+    Change counter of every analytics table as seen by query connections:
+    the counters the in-memory snapshot was copied at when one is in use,
+    else the database's current ones.
+    """
+    versions = _snapshot["versions"]
+    if versions is not None:
+        return versions
+    return get_source_versions()
+
+
+def get_source_versions() -> dict:
+    """
+    Current change counter of every analytics table in the database file.
+    The counters are only re-read when PRAGMA data_version reports a commit
+    from another connection.
+    """
+    with _version_lock:
+        conn = _version_state["conn"]
+        if conn is None:
+            conn = sqlite3.connect(_read_only_uri(get_analytics_db_path()), uri=True,
+                                   check_same_thread=False)
+            _version_state["conn"] = conn
+
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != _version_state["data_version"]:
+            try:
+                rows = conn.execute(f"SELECT table_name, version FROM {VERSIONS_TABLE}").fetchall()
+            except sqlite3.OperationalError:
+                rows = []
+            _version_state["versions"] = dict(rows)
+            _version_state["data_version"] = data_version
+        return _version_state["versions"]
+
+
+def init_engine():
+    """
+    Switch the database files to WAL so readers on query connections never
+    block (or get blocked by) writes to the app-state tables, and install
+    the change counters used to invalidate cached results.
+    """
+    for path in filter(None, [DB_PATH, ANALYTICS_DB_PATH]):
+        conn = sqlite3.connect(path)
+        try:
+            mode = conn.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+            print(f"📀 {path} journal mode: {mode}")
+            if path == get_analytics_db_path():
+                ensure_version_tracking(conn)
+        except Exception as e:
+            print(f"Error initializing {path}: {e}")
+        finally:
+            conn.close()
+
+    if MEMORY_SNAPSHOT:
+        build_snapshot()
+        start_snapshot_refresher()
+
+
+def _source_schema_version() -> int:
+    get_source_versions()  # opens the version connection on first use
+    with _version_lock:
+        return _version_state["conn"].execute("PRAGMA schema_version").fetchone()[0]
+
+
+def build_snapshot():
+    """
+    Copy the analytics database into a new shared-cache memory database
+    with the backup API and swap it in. The previous copy keeps serving
+    queries until its readers move on; connections still on older copies,
+    idle or not, are interrupted and closed so at most two copies are held.
+    """
+    generation = _snapshot["generation"] + 1
+    uri = f"file:analytics_snapshot_{os.getpid()}_{generation}?mode=memory&cache=shared"
+    keeper = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    schema_version = _source_schema_version()
+    source = sqlite3.connect(_read_only_uri(get_analytics_db_path()), uri=True)
+    try:
+        source.backup(keeper)
+    finally:
+        source.close()
+
+    # Counters read from the copy itself match its contents exactly
+    try:
+        versions = dict(keeper.execute(f"SELECT table_name, version FROM {VERSIONS_TABLE}").fetchall())
+    except sqlite3.OperationalError:
+        versions = {}
+    if not ANALYTICS_DB_PATH:
+        # The main file also holds app-state tables, which queries may not read
+        for (name,) in keeper.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY rootpage = 0 DESC"
+        ).fetchall():
+            if name.lower() in APP_STATE_TABLES:
+                try:
+                    keeper.execute(f'DROP TABLE IF EXISTS "{name}"')
+                except sqlite3.OperationalError:
+                    pass  # shadow tables go with their virtual table
+        keeper.commit()
+        keeper.execute("VACUUM")
+
+    with _snapshot_lock:
+        previous = _snapshot["keeper"]
+        _snapshot.update(uri=uri, keeper=keeper, versions=versions,
+                         schema_version=schema_version, generation=generation)
+        stale = [
+            conn for old in [g for g in _snapshot_readers if g < generation - 1]
+            for conn in _snapshot_readers.pop(old)
+        ]
+    if previous is not None:
+        previous.close()
+    for conn in stale:
+        # An idle thread's connection would otherwise keep its copy alive;
+        # the thread reopens on the current copy at its next statement
+        conn.interrupt()
+        conn.close()
+    if stale:
+        print(f"🧹 Closed {len(stale)} connection(s) to older in-memory snapshots")
+    print(f"🧠 In-memory snapshot {generation} ready")
+
+
+def refresh_snapshot() -> bool:
+    """Rebuild the snapshot if the analytics tables changed since it was copied"""
+    if _snapshot["keeper"] is None:
+        return False
+    if get_source_versions() == _snapshot["versions"] and _source_schema_version() == _snapshot["schema_version"]:
+        return False
+    build_snapshot()
+    return True
+
+
+def _snapshot_loop():
+    while not _snapshot_stop.wait(SNAPSHOT_CHECK_SECONDS):
+        try:
+            refresh_snapshot()
+        except Exception as e:
+            print(f"Error refreshing in-memory snapshot: {e}")
+
+
+def start_snapshot_refresher():
+    """Check for analytics changes in a daemon thread every SNAPSHOT_CHECK_SECONDS"""
+    global _snapshot_thread
+    if _snapshot_thread is not None and _snapshot_thread.is_alive():
+        return
+    _snapshot_stop.clear()
+    _snapshot_thread = threading.Thread(target=_snapshot_loop, name="memory-snapshot", daemon=True)
+    _snapshot_thread.start()
+
+
+def stop_snapshot_refresher():
+    _snapshot_stop.set()
@@ -0,0 +1,316 @@
+"""
+Answer follow-up questions from the previous turn's cached result.
+
+Follow-ups such as "only MTR_1002" usually produce SQL that repeats the
+previous statement with an extra condition. When the new statement is
+provably computable from the previous result, it is evaluated over that
+result in an in-memory database instead of scanning the base table:
+
+  1. Previous SQL reads plain columns (or *) of one table with no
+     grouping, DISTINCT or LIMIT. Its result holds every base row that
+     matches its WHERE, so any new single-table statement whose WHERE
+     keeps all of those conditions can run on it: restrictions,
+     projections and re-aggregations alike. The previous conditions are
+     dropped when running on the result. A new * needs a previous *.
+
+  2. Previous SQL groups rows. A new statement identical except for extra
+     WHERE conditions on grouping columns (that the result also returns)
+     just removes whole groups, so it is the previous result filtered by
+     those conditions, in the same order.
+
+LIMIT/OFFSET without ORDER BY depends on the base table's row order, so
+it always falls back. Anything else returns None and the caller runs the
+SQL normally. Column availability is checked by compiling against the
+in-memory copy, so a statement that needs a column the previous result
+lacks falls back too.
+"""
+import sqlite3
+
+from sql_functions import register_functions
+from sql_validator import tokenize_spans, SQL_KEYWORDS
+from result_encoding import infer_column_types, result_row_count
+
+# Previous results larger than this are not copied into memory
+MAX_REFINE_ROWS = 200_000
+
+CLAUSES = ("SELECT", "FROM", "WHERE", "GROUP BY", "HAVING", "ORDER BY", "LIMIT", "OFFSET")
+# Anywhere in a statement these rule refinement out
+UNSUPPORTED_WORDS = {
+    "WITH", "UNION", "EXCEPT", "INTERSECT", "JOIN", "VALUES", "ROWID", "_ROWID_", "OID",
+}
+AGGREGATE_FUNCTIONS = {"COUNT", "SUM", "AVG", "MIN", "MAX", "TOTAL", "GROUP_CONCAT"}
+
+
+def _quote(name: str) -> str:
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def split_statement(sql: str):
+    """
+    Top-level clauses of a simple single-table SELECT as
+    {clause: [(kind, text), ...]}, or None for anything more complex
+    (subqueries, joins, compound selects, CTEs).
+    """
+    tokens = tokenize_spans(sql or "")
+    if tokens and tokens[-1][1] == ";":
+        tokens.pop()
+    if not tokens or tokens[0][1].upper() != "SELECT":
+        return None
+
+    clauses = {}
+    current = None
+    depth = 0
+    i = 0
+    while i < len(tokens):
+        kind, text = tokens[i][0], tokens[i][1]
+        upper = text.upper() if kind == "word" else text
+        if upper in UNSUPPORTED_WORDS or (upper == "SELECT" and i > 0) or text == ";":
+            return None
+        if text == "(":
+            depth += 1
+        elif text == ")":
+            depth -= 1
+        if depth == 0 and kind == "word":
+            name = upper
+            if upper in ("GROUP", "ORDER") and i + 1 < len(tokens) and tokens[i + 1][1].upper() == "BY":
+                name = f"{upper} BY"
+                i += 1
+            if name in CLAUSES:
+                if name in clauses:
+                    return None
+                current = name
+                clauses[current] = []
+                i += 1
+                continue
+        clauses[current].append(tokens[i])
+        i += 1
+
+    from_tokens = clauses.get("FROM", [])
+    # One table, optionally aliased
+    if not from_tokens or len(from_tokens) > 3 or any(t[1] == "," for t in from_tokens):
+        return None
+    return clauses
+
+
+def _text(tokens: list) -> str:
+    return " ".join(text if kind != "word" or text.upper() not in SQL_KEYWORDS else text.upper()
+                    for kind, text, *_ in tokens)
+
+
+def _source(sql: str, tokens: list) -> str:
+    """Original text of a clause, so unaliased result columns keep their names"""
+    return sql[tokens[0][2]:tokens[-1][3]] if tokens else ""
+
+
+def conjuncts(tokens: list) -> list:
+    """Split a WHERE clause on top-level AND (not the AND of BETWEEN)"""
+    parts, current = [], []
+    depth = 0
+    between = 0
+    for kind, text, *_ in tokens:
+        upper = text.upper()
+        if text == "(":
+            depth += 1
+        elif text == ")":
+            depth -= 1
+        if depth == 0 and kind == "word" and upper == "BETWEEN":
+            between += 1
+        elif depth == 0 and kind == "word" and upper == "AND":
+            if between:
+                between -= 1
+            else:
+                parts.append(_text(current))
+                current = []
+                continue
+        current.append((kind, text))
+    if current:
+        parts.append(_text(current))
+    return parts
+
+
+def _extra_conditions(previous: dict, new: dict):
+    """Conditions the new WHERE adds to the previous one, or None if it drops any"""
+    remaining = conjuncts(new.get("WHERE", []))
+    for condition in conjuncts(previous.get("WHERE", [])):
+        if condition not in remaining:
+            return None
+        remaining.remove(condition)
+    return remaining
+
+
+def _plain_columns(select_tokens: list):
+    """Column names of a select list made only of bare columns, ["*"] for *, else None"""
+    if [t[1] for t in select_tokens] == ["*"]:
+        return ["*"]
+    columns = []
+    for item in _split_items(select_tokens):
+        texts = [t[1] for t in item]
+        if len(texts) == 3 and texts[1] == ".":
+            texts = texts[2:]
+        if len(texts) != 1 or item[-1][0] not in ("word", "ident"):
+            return None
+        if item[-1][0] == "word" and texts[0].upper() in SQL_KEYWORDS:
+            return None
+        columns.append(texts[0].strip('"`[]'))
+    return columns
+
+
+def _split_items(tokens: list) -> list:
+    items, current, depth = [], [], 0
+    for token in tokens:
+        text = token[1]
+        if text == "(":
+            depth += 1
+        elif text == ")":
+            depth -= 1
+        if text == "," and depth == 0:
+            items.append(current)
+            current = []
+        else:
+            current.append(token)
+    if current:
+        items.append(current)
+    return items
+
+
+def _table_name(clauses: dict) -> str:
+    return clauses["FROM"][0][1].strip('"`[]').lower()
+
+
+def _load(result: dict, declared: dict, table: str):
+    """In-memory database holding the previous result as `table`"""
+    columns = result["columns"]
+    if len(set(columns)) != len(columns):
+        return None
+    rows = result["rows"] if "rows" in result else list(zip(*result["data"]))
+    conn = sqlite3.connect(":memory:")
+    register_functions(conn)
+    # Declared types keep the base columns' affinity, so comparisons behave the same
+    col_defs = ", ".join(f"{_quote(c)} {declared.get(c, '')}".strip() for c in columns)
+    conn.execute(f"CREATE TABLE {_quote(table)} ({col_defs})")
+    conn.executemany(
+        f"INSERT INTO {_quote(table)} VALUES ({', '.join('?' * len(columns))})", rows
+    )
+    return conn
+
+
+def _run(conn, sql: str, layout: str):
+    cur = conn.execute(sql)
+    columns = [desc[0] for desc in cur.description] if cur.description else []
+    rows = cur.fetchall()
+    if layout == "columns":
+        return {"columns": columns, "data": [list(col) for col in zip(*rows)] or [[] for _ in columns]}
+    return {"columns": columns, "rows": rows}
+
+
+def _has_star(select_tokens: list) -> bool:
+    """True if a select list has a * or table.* item"""
+    return any(
+        [t[1] for t in item][-1:] == ["*"] and len(item) in (1, 3)
+        for item in _split_items(select_tokens)
+    )
+
+
+def _has_aggregate(tokens: list) -> bool:
+    return any(
+        kind == "word" and text.upper() in AGGREGATE_FUNCTIONS
+        and i + 1 < len(tokens) and tokens[i + 1][1] == "("
+        for i, (kind, text, *_) in enumerate(tokens)
+    )
+
+
+def refine(new_sql: str, previous_sql: str, previous_result: dict,
+           layout: str = "rows", declared: dict = None):
+    """
+    Evaluate new_sql over previous_result (the cached result of
+    previous_sql) when that is provably equivalent to running it on the
+    database. Returns a run_sql-style result, or None to fall back.
+    """
+    if not previous_result or "error" in previous_result:
+        return None
+    if result_row_count(previous_result) > MAX_REFINE_ROWS:
+        return None
+
+    new = split_statement(new_sql)
+    previous = split_statement(previous_sql)
+    if new is None or previous is None or _table_name(new) != _table_name(previous):
+        return None
+    if "LIMIT" in previous or "OFFSET" in previous:
+        return None
+    extra = _extra_conditions(previous, new)
+    if extra is None:
+        return None
+
+    table = new["FROM"][0][1].strip('"`[]')
+    select = previous.get("SELECT", [])
+    distinct = select and select[0][1].upper() == "DISTINCT"
+    grouped = "GROUP BY" in previous or "HAVING" in previous or _has_aggregate(select)
+    declared = declared or {}
+
+    if ("LIMIT" in new or "OFFSET" in new) and "ORDER BY" not in new:
+        # Which rows an unordered LIMIT keeps depends on the base table's scan order
+        return None
+
+    if not grouped and not distinct and _plain_columns(select) is not None:
+        # Case 1: the previous result is a restriction/projection of base rows.
+        # A * in the new select list would only expand to the columns kept
+        if _plain_columns(select) != ["*"] and _has_star(new["SELECT"]):
+            return None
+        sql = "SELECT " + _source(new_sql, new["SELECT"]) + " FROM " + _source(new_sql, new["FROM"])
+        if extra:
+            sql += " WHERE " + " AND ".join(extra)
+        for clause in ("GROUP BY", "HAVING", "ORDER BY", "LIMIT", "OFFSET"):
+            if clause in new:
+                sql += f" {clause} " + _source(new_sql, new[clause])
+    elif grouped and "GROUP BY" in previous:
+        # Case 2: the same grouping with extra conditions on group keys
+        for clause in ("SELECT", "GROUP BY", "HAVING", "ORDER BY"):
+            if _text(previous.get(clause, [])) != _text(new.get(clause, [])):
+                return None
+        if not extra:
+            return None
+        keys = _plain_columns(previous["GROUP BY"]) or []
+        returned = set(_plain_columns(_bare_items(select)) or [])
+        usable = [key for key in keys if key in returned and key in previous_result["columns"]]
+        if not usable:
+            return None
+        # The conditions may only reference grouping columns the result returns
+        probe = sqlite3.connect(":memory:")
+        try:
+            probe.execute(f"CREATE TABLE {_quote(table)} ({', '.join(_quote(k) for k in usable)})")
+            probe.execute(f"EXPLAIN SELECT 1 FROM {_text(new['FROM'])} WHERE " + " AND ".join(extra))
+        except sqlite3.Error:
+            return None
+        finally:
+            probe.close()
+        sql = f"SELECT * FROM {_text(new['FROM'])} WHERE " + " AND ".join(extra) + " ORDER BY rowid"
+        for clause in ("LIMIT", "OFFSET"):
+            if clause in new:
+                sql += f" {clause} " + _text(new[clause])
+    else:
+        return None
+
+    conn = _load(previous_result, declared, table)
+    if conn is None:
+        return None
+    try:
+        result = _run(conn, sql, layout)
+    except sqlite3.Error:
+        # A column the previous result lacks, or SQL the copy cannot run
+        return None
+    finally:
+        conn.close()
+
+    result["types"] = infer_column_types(result, declared)
+    return result
+
+
+def _bare_items(select_tokens: list) -> list:
+    """Select items that are bare columns, re-joined as a select list"""
+    items = []
+    for item in _split_items(select_tokens):
+        if _plain_columns(item) is not None:
+            if items:
+                items.append(("op", ","))
+            items.extend(item)
+    return items
@@ -0,0 +1,88 @@
+import sys
+import threading
+from collections import OrderedDict
+
+# Memory budget for cached query results
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+# Results larger than this are never cached
+MAX_ENTRY_BYTES = 8 * 1024 * 1024
+
+
+def estimate_result_size(result: dict) -> int:
+    """Rough in-memory size of a row or column layout result in bytes"""
+    size = sys.getsizeof(result.get("columns", []))
+    for row in result.get("rows", result.get("data", [])):
+        size += sys.getsizeof(row)
+        for value in row:
+            size += sys.getsizeof(value)
+    return size
+
+
+def freeze_result(result: dict) -> dict:
+    """Copy of a result with its lists turned into tuples, safe to share between callers"""
+    frozen = dict(result)
+    for key in ("columns", "types"):
+        if key in frozen:
+            frozen[key] = tuple(frozen[key])
+    for key in ("rows", "data"):
+        if key in frozen:
+            frozen[key] = tuple(tuple(values) for values in frozen[key])
+    return frozen
+
+
+class ResultCache:
+    """LRU cache of query results bounded by their estimated byte size"""
+
+    def __init__(self, max_bytes: int = MAX_CACHE_BYTES, max_entry_bytes: int = MAX_ENTRY_BYTES):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._entries = OrderedDict()  # {key: (result, size)}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, result: dict):
+        size = estimate_result_size(result)
+        if size > self.max_entry_bytes:
+            return
+        # Entries are handed to many callers: none of them may change it
+        result = freeze_result(result)
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (result, size)
+            self._bytes += size
+
+            while self._bytes > self.max_bytes and self._entries:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+result_cache = ResultCache()
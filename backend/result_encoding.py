@@ -0,0 +1,282 @@
+import base64
+import csv
+import io
+import json
+import re
+import sys
+from array import array
+
+try:
+    import pyarrow as pa
+except ImportError:  # Arrow output is optional
+    pa = None
+
+# Response formats for query results
+FORMAT_ROWS = "rows"          # {"columns": [...], "rows": [[...], ...]}
+FORMAT_COLUMNAR = "columnar"  # one JSON array per column
+FORMAT_BINARY = "binary"      # numeric columns packed as base64 little-endian arrays
+FORMAT_ARROW = "arrow"        # Arrow IPC stream: raw bytes when negotiated by Accept, else base64
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+# Streaming export formats
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+ACCEPT_FORMATS = {
+    "application/vnd.chatbot.columnar+json": FORMAT_COLUMNAR,
+    "application/vnd.chatbot.binary+json": FORMAT_BINARY,
+    ARROW_STREAM_MEDIA_TYPE: FORMAT_ARROW,
+}
+
+# Formats this server can produce; Arrow only with pyarrow installed
+RESULT_FORMATS = (FORMAT_ROWS, FORMAT_COLUMNAR, FORMAT_BINARY) + ((FORMAT_ARROW,) if pa is not None else ())
+
+FETCH_SIZE = 5000
+
+# Rows sampled when inferring column types
+TYPE_SAMPLE_ROWS = FETCH_SIZE
+
+DATETIME_RE = re.compile(r"^\d{4}-\d{2}(-\d{2}([ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?)?$")
+
+
+def negotiate_format(requested: str = None, accept: str = None) -> str:
+    """
+    Pick the result format from a ?format= parameter or the Accept header.
+    An explicit format is returned as is (callers reject it with 406 when it
+    is not in RESULT_FORMATS); Accept entries that cannot be produced are
+    skipped.
+    """
+    if requested:
+        return requested.lower()
+    for media_type in (accept or "").split(","):
+        fmt = ACCEPT_FORMATS.get(media_type.split(";")[0].strip().lower())
+        if fmt in RESULT_FORMATS:
+            return fmt
+    return FORMAT_ROWS
+
+
+def fetch_columns(cur) -> list:
+    """Read a cursor straight into per-column lists, chunk by chunk"""
+    width = len(cur.description) if cur.description else 0
+    data = [[] for _ in range(width)]
+    appends = [col.append for col in data]
+    while True:
+        chunk = cur.fetchmany(FETCH_SIZE)
+        if not chunk:
+            break
+        for row in chunk:
+            for append, value in zip(appends, row):
+                append(value)
+    return data
+
+
+def result_row_count(result: dict) -> int:
+    """Number of rows in a run_sql result of either layout"""
+    if "rows" in result:
+        return len(result["rows"])
+    data = result.get("data")
+    return len(data[0]) if data else 0
+
+
+def column_type(values: list) -> str:
+    """SQLite storage class shared by all non-null values of a column"""
+    kinds = {type(v) for v in values if v is not None}
+    if not kinds:
+        return "null"
+    if kinds == {int}:
+        return "integer"
+    if kinds <= {int, float}:
+        return "real"
+    if kinds == {str}:
+        return "text"
+    if kinds == {bytes}:
+        return "blob"
+    return "mixed"
+
+
+def _declared_affinity(decl: str):
+    """Type implied by a declared column type, following SQLite affinity rules"""
+    if not decl:
+        return None
+    if "DATE" in decl or "TIME" in decl:
+        return "datetime"
+    if "INT" in decl:
+        return "integer"
+    if "CHAR" in decl or "CLOB" in decl or "TEXT" in decl:
+        return "text"
+    if "REAL" in decl or "FLOA" in decl or "DOUB" in decl or "NUM" in decl or "DEC" in decl:
+        return "real"
+    return None
+
+
+def infer_column_types(result: dict, declared: dict = None) -> list:
+    """
+    Type of each result column from the first page of values, refined by the
+    declared type of a same-named table column. Text columns holding ISO
+    dates are reported as "datetime".
+    """
+    declared = declared or {}
+    if "data" in result:
+        samples = [values[:TYPE_SAMPLE_ROWS] for values in result["data"]]
+    else:
+        page = result["rows"][:TYPE_SAMPLE_ROWS]
+        samples = [list(col) for col in zip(*page)] or [[] for _ in result["columns"]]
+
+    types = []
+    for name, values in zip(result["columns"], samples):
+        kind = column_type(values)
+        hint = _declared_affinity(declared.get(name))
+        if kind == "null" and hint:
+            kind = hint
+        elif kind == "text" and (
+            hint == "datetime"
+            or all(DATETIME_RE.match(v) for v in values if v is not None)
+        ):
+            kind = "datetime"
+        types.append(kind)
+    return types
+
+
+def _pack(values: list, kind: str):
+    """
+    Pack a numeric column as base64 bytes plus a validity bitmap for nulls.
+    Types are inferred from the first rows only, so a column with a later
+    non-numeric or out-of-range value is returned as a plain JSON list.
+    """
+    typecode = "q" if kind == "integer" else "d"
+    try:
+        packed = array(typecode, (0 if v is None else v for v in values))
+    except (TypeError, OverflowError):
+        return values
+    if sys.byteorder != "little":
+        packed.byteswap()
+
+    column = {
+        "dtype": "int64" if kind == "integer" else "float64",
+        "values": base64.b64encode(packed.tobytes()).decode("ascii"),
+    }
+    if any(v is None for v in values):
+        bitmap = bytearray((len(values) + 7) // 8)
+        for i, v in enumerate(values):
+            if v is not None:
+                bitmap[i >> 3] |= 1 << (i & 7)
+        column["validity"] = base64.b64encode(bytes(bitmap)).decode("ascii")
+    return column
+
+
+def _arrow_array(values: list):
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Mixed storage classes have no Arrow type: send them as text
+        return pa.array([None if v is None else str(_json_value(v)) for v in values], pa.string())
+
+
+def arrow_ipc(columns: list, data: list, metadata: dict = None) -> bytes:
+    """Per-column lists as an Arrow IPC stream; metadata goes on the schema"""
+    table = pa.table({name: _arrow_array(values) for name, values in zip(columns, data)},
+                     metadata=metadata)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _arrow_stream(columns: list, data: list) -> str:
+    return base64.b64encode(arrow_ipc(columns, data)).decode("ascii")
+
+
+def encode_result(result: dict, fmt: str) -> dict:
+    """
+    Encode a run_sql result (row or column layout) in the requested format.
+    Errors are passed through untouched.
+    """
+    if "error" in result:
+        return result
+
+    columns = result["columns"]
+    if fmt == FORMAT_ROWS:
+        rows = result["rows"] if "rows" in result else list(zip(*result["data"]))
+        encoded = {"columns": columns, "rows": rows}
+        if "types" in result:
+            encoded["types"] = result["types"]
+        return encoded
+
+    if "data" in result:
+        data = result["data"]
+    else:
+        data = [list(col) for col in zip(*result["rows"])] or [[] for _ in columns]
+
+    row_count = len(data[0]) if data else 0
+    types = result.get("types") or [column_type(values) for values in data]
+
+    if fmt == FORMAT_COLUMNAR:
+        return {
+            "format": FORMAT_COLUMNAR,
+            "columns": columns,
+            "types": types,
+            "row_count": row_count,
+            "data": data,
+        }
+
+    if fmt == FORMAT_BINARY:
+        encoded, encoded_types = [], []
+        for values, kind in zip(data, types):
+            column = _pack(values, kind) if kind in ("integer", "real") else values
+            if isinstance(column, list) and kind in ("integer", "real"):
+                # Not packable after all: report the column's actual type
+                kind = column_type(values)
+            encoded.append(column)
+            encoded_types.append(kind)
+        return {
+            "format": FORMAT_BINARY,
+            "columns": columns,
+            "types": encoded_types,
+            "row_count": row_count,
+            "data": encoded,
+        }
+
+    if fmt == FORMAT_ARROW:
+        if pa is None:
+            return {"error": "Arrow format requires pyarrow to be installed"}
+        return {
+            "format": FORMAT_ARROW,
+            "columns": columns,
+            "row_count": row_count,
+            "data": _arrow_stream(columns, data),
+        }
+
+    return {"error": f"Unknown result format: {fmt}"}
+
+
+def _json_value(value):
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode("ascii")
+    return value
+
+
+def encode_stream(columns: list, chunks, fmt: str):
+    """
+    Turn the row chunks of db.iter_sql into encoded byte chunks of CSV or
+    newline-delimited JSON.
+    """
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for chunk in chunks:
+            writer.writerows(chunk)
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode("utf-8")
+        return
+
+    for chunk in chunks:
+        yield "".join(
+            json.dumps(dict(zip(columns, map(_json_value, row)))) + "\n"
+            for row in chunk
+        ).encode("utf-8")
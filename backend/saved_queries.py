@@ -0,0 +1,288 @@
+"""
+Saved questions with materialized results.
+
+    python saved_queries.py refresh   # refresh every due saved query now
+
+A saved query keeps the question and its validated SQL; its latest result
+is materialized into saved_query_results so serving it needs neither the
+LLM nor a scan of the readings. A result is due for refresh when the
+analytics tables changed since it was computed (table_versions) or when it
+is older than the query's refresh interval.
+
+A daemon thread checks for due queries every REFRESH_CHECK_SECONDS. Each
+pass refreshes at most MAX_REFRESHES_PER_PASS queries on REFRESH_WORKERS
+threads, and every refresh starts after a random delay of up to
+REFRESH_JITTER_SECONDS, so a burst of ingestion does not turn into a burst
+of analytical scans competing with interactive questions.
+"""
+import json
+import random
+import sqlite3
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from db import run_sql
+from query_engine import get_table_versions
+
+DB_PATH = "./../mydata.db"
+
+DEFAULT_REFRESH_MINUTES = 60
+MIN_REFRESH_MINUTES = 5
+MAX_SAVED_QUERIES_PER_USER = 50
+
+REFRESH_CHECK_SECONDS = 60
+REFRESH_WORKERS = 2
+MAX_REFRESHES_PER_PASS = 10
+REFRESH_JITTER_SECONDS = 15
+
+_stop_event = threading.Event()
+_scheduler = None
+_executor = ThreadPoolExecutor(max_workers=REFRESH_WORKERS, thread_name_prefix="saved-refresh")
+
+
+def ensure_tables(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS saved_queries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            question TEXT NOT NULL,
+            sql TEXT NOT NULL,
+            refresh_minutes INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_saved_queries_user ON saved_queries(user_id)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS saved_query_results (
+            query_id INTEGER PRIMARY KEY,
+            result TEXT NOT NULL,
+            source_versions TEXT NOT NULL,
+            refreshed_at TIMESTAMP NOT NULL,
+            FOREIGN KEY (query_id) REFERENCES saved_queries(id)
+        )
+    """)
+
+
+def _connect():
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    ensure_tables(conn)
+    return conn
+
+
+def _versions_json(versions: dict) -> str:
+    return json.dumps(versions, sort_keys=True)
+
+
+def _store_result(conn, query_id: int, result: dict, versions: dict):
+    conn.execute(
+        """
+        INSERT INTO saved_query_results (query_id, result, source_versions, refreshed_at)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(query_id) DO UPDATE SET
+            result = excluded.result,
+            source_versions = excluded.source_versions,
+            refreshed_at = excluded.refreshed_at
+        """,
+        (query_id, json.dumps(result, default=str), _versions_json(versions),
+         datetime.now().isoformat())
+    )
+
+
+def save_query(user_id: int, question: str, sql: str, result: dict = None,
+               refresh_minutes: int = None) -> Optional[int]:
+    """
+    Save a question with its validated SQL, materializing `result` when the
+    caller already ran it. Returns the new id, or None when the user has
+    MAX_SAVED_QUERIES_PER_USER saved queries already.
+    """
+    refresh_minutes = max(refresh_minutes or DEFAULT_REFRESH_MINUTES, MIN_REFRESH_MINUTES)
+    versions = get_table_versions()
+    conn = _connect()
+    try:
+        with conn:
+            count = conn.execute(
+                "SELECT COUNT(*) FROM saved_queries WHERE user_id = ?", (user_id,)
+            ).fetchone()[0]
+            if count >= MAX_SAVED_QUERIES_PER_USER:
+                return None
+            query_id = conn.execute(
+                "INSERT INTO saved_queries (user_id, question, sql, refresh_minutes) VALUES (?, ?, ?, ?)",
+                (user_id, question, sql, refresh_minutes)
+            ).lastrowid
+            if result is not None and "error" not in result:
+                _store_result(conn, query_id, result, versions)
+        return query_id
+    finally:
+        conn.close()
+
+
+def list_saved_queries(user_id: int) -> List[Dict]:
+    conn = _connect()
+    try:
+        rows = conn.execute("""
+            SELECT q.id, q.question, q.sql, q.refresh_minutes, q.created_at, r.refreshed_at
+            FROM saved_queries q
+            LEFT JOIN saved_query_results r ON r.query_id = q.id
+            WHERE q.user_id = ?
+            ORDER BY q.id
+        """, (user_id,)).fetchall()
+    finally:
+        conn.close()
+    return [
+        {
+            "id": row[0],
+            "question": row[1],
+            "sql": row[2],
+            "refresh_minutes": row[3],
+            "created_at": row[4],
+            "refreshed_at": row[5],
+        }
+        for row in rows
+    ]
+
+
+def get_saved_result(user_id: int, query_id: int) -> Optional[Dict]:
+    """
+    A saved query with its materialized result, or None if the user has no
+    such query. "result" is None until the first refresh succeeds; "stale"
+    tells whether the data changed since it was computed.
+    """
+    conn = _connect()
+    try:
+        row = conn.execute("""
+            SELECT q.id, q.question, q.sql, r.result, r.source_versions, r.refreshed_at
+            FROM saved_queries q
+            LEFT JOIN saved_query_results r ON r.query_id = q.id
+            WHERE q.id = ? AND q.user_id = ?
+        """, (query_id, user_id)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    return {
+        "id": row[0],
+        "question": row[1],
+        "sql": row[2],
+        "result": json.loads(row[3]) if row[3] else None,
+        "refreshed_at": row[5],
+        "stale": row[4] != _versions_json(get_table_versions()),
+    }
+
+
+def delete_saved_query(user_id: int, query_id: int) -> bool:
+    conn = _connect()
+    try:
+        with conn:
+            deleted = conn.execute(
+                "DELETE FROM saved_queries WHERE id = ? AND user_id = ?", (query_id, user_id)
+            ).rowcount
+            if deleted:
+                conn.execute("DELETE FROM saved_query_results WHERE query_id = ?", (query_id,))
+        return bool(deleted)
+    finally:
+        conn.close()
+
+
+def due_queries(limit: int = MAX_REFRESHES_PER_PASS) -> List[tuple]:
+    """(id, sql) of saved queries whose data changed or whose result is too old, oldest first"""
+    versions = _versions_json(get_table_versions())
+    conn = _connect()
+    try:
+        rows = conn.execute("""
+            SELECT q.id, q.sql, q.refresh_minutes, r.source_versions, r.refreshed_at
+            FROM saved_queries q
+            LEFT JOIN saved_query_results r ON r.query_id = q.id
+            ORDER BY r.refreshed_at IS NOT NULL, r.refreshed_at
+        """).fetchall()
+    finally:
+        conn.close()
+
+    now = datetime.now()
+    due = []
+    for query_id, sql, refresh_minutes, source_versions, refreshed_at in rows:
+        if (
+            refreshed_at is None
+            or source_versions != versions
+            or datetime.fromisoformat(refreshed_at) + timedelta(minutes=refresh_minutes) <= now
+        ):
+            due.append((query_id, sql))
+            if len(due) >= limit:
+                break
+    return due
+
+
+def refresh_query(query_id: int, sql: str, jitter: float = 0) -> bool:
+    """Re-run one saved query and materialize its result; False if it failed"""
+    if jitter and _stop_event.wait(random.uniform(0, jitter)):
+        return False
+    # Versions are read first: a write during the run leaves the result stale, not wrong
+    versions = get_table_versions()
+    result = run_sql(sql, use_cache=False)
+    if "error" in result:
+        print(f"Error refreshing saved query {query_id}: {result['error']}")
+        return False
+    conn = _connect()
+    try:
+        with conn:
+            # The query may have been deleted while it ran
+            exists = conn.execute("SELECT 1 FROM saved_queries WHERE id = ?", (query_id,)).fetchone()
+            if exists:
+                _store_result(conn, query_id, result, versions)
+        return bool(exists)
+    finally:
+        conn.close()
+
+
+def refresh_due(jitter: float = REFRESH_JITTER_SECONDS) -> int:
+    """One refresh pass over due saved queries; returns how many were refreshed"""
+    futures = [
+        _executor.submit(refresh_query, query_id, sql, jitter)
+        for query_id, sql in due_queries()
+    ]
+    refreshed = 0
+    for future in futures:
+        try:
+            refreshed += future.result()
+        except Exception as e:
+            print(f"Error refreshing saved query: {e}")
+    return refreshed
+
+
+def _scheduler_loop():
+    while not _stop_event.wait(REFRESH_CHECK_SECONDS):
+        try:
+            refreshed = refresh_due()
+            if refreshed:
+                print(f"🔄 Refreshed {refreshed} saved queries")
+        except Exception as e:
+            print(f"Error refreshing saved queries: {e}")
+
+
+def start_refresher():
+    """Refresh due saved queries in a daemon thread every REFRESH_CHECK_SECONDS"""
+    global _scheduler
+    if _scheduler is not None and _scheduler.is_alive():
+        return
+    _stop_event.clear()
+    _scheduler = threading.Thread(target=_scheduler_loop, name="saved-queries", daemon=True)
+    _scheduler.start()
+
+
+def stop_refresher():
+    _stop_event.set()
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] != "refresh":
+        print("Usage: python saved_queries.py refresh")
+        return
+    refreshed = refresh_due(jitter=0)
+    print(f"✅ Refreshed {refreshed} saved queries")
+
+
+if __name__ == "__main__":
+    main()
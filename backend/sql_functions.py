@@ -0,0 +1,52 @@
+"""
+SQL functions added to every connection that compiles or runs generated SQL.
+
+    median(Y)          50th percentile of the non-null numeric Y
+    percentile(Y, P)   P-th percentile (0-100), interpolated between the two
+                       nearest values like SQLite's percentile extension
+
+Stock SQLite builds lack these, but "median load per meter" is a common
+question; approximate mode answers the same calls from the meter_stats
+quantile sketches (see meter_stats.py).
+"""
+
+
+def interpolate(value_at, count: int, p: float):
+    """
+    P-th percentile of `count` sorted values, where value_at(rank) returns
+    the value at a 0-based rank
+    """
+    if count == 0:
+        return None
+    if p is None or not 0 <= p <= 100:
+        raise ValueError("percentile must be between 0 and 100")
+    rank = p / 100 * (count - 1)
+    low = int(rank)
+    high = min(low + 1, count - 1)
+    fraction = rank - low
+    low_value = value_at(low)
+    if fraction == 0:
+        return low_value
+    return low_value + (value_at(high) - low_value) * fraction
+
+
+class Percentile:
+    """Exact percentile aggregate over the non-null numeric values"""
+
+    def __init__(self):
+        self.values = []
+        self.p = 50.0
+
+    def step(self, value, p=50.0):
+        if isinstance(value, (int, float)):
+            self.values.append(value)
+        self.p = p
+
+    def finalize(self):
+        self.values.sort()
+        return interpolate(self.values.__getitem__, len(self.values), self.p)
+
+
+def register_functions(conn):
+    conn.create_aggregate("median", 1, Percentile)
+    conn.create_aggregate("percentile", 2, Percentile)
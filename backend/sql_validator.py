@@ -0,0 +1,261 @@
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from sql_functions import register_functions
+
+# Tokens: comments, quoted strings/identifiers, numbers, words, operators
+TOKEN_RE = re.compile(r"""
+    (?P<comment>--[^\n]*|/\*.*?(?:\*/|$))
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<ident>"(?:[^"]|"")*"|`(?:[^`]|``)*`|\[[^\]]*\])
+  | (?P<number>0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<param>[?:@$]\w*)
+  | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<op>\|\||<<|>>|<=|>=|==|!=|<>|[-+*/%<>=~&|(),.;])
+  | (?P<space>\s+)
+""", re.VERBOSE | re.DOTALL)
+
+SQL_KEYWORDS = {
+    "ALL", "AND", "AS", "ASC", "BETWEEN", "BY", "CASE", "CAST", "COLLATE",
+    "CROSS", "CURRENT_DATE", "CURRENT_TIME", "CURRENT_TIMESTAMP", "DESC",
+    "DISTINCT", "ELSE", "END", "ESCAPE", "EXCEPT", "EXISTS", "FALSE", "FILTER",
+    "FROM", "FULL", "GLOB", "GROUP", "HAVING", "IN", "INNER", "INTERSECT",
+    "IS", "ISNULL", "JOIN", "LEFT", "LIKE", "LIMIT", "MATCH", "NATURAL", "NOT",
+    "NOTNULL", "NULL", "NULLS", "FIRST", "LAST", "OFFSET", "ON", "OR", "ORDER",
+    "OUTER", "OVER", "PARTITION", "RANGE", "RECURSIVE", "REGEXP", "RIGHT",
+    "ROWS", "SELECT", "THEN", "TRUE", "UNION", "USING", "VALUES", "WHEN",
+    "WHERE", "WINDOW", "WITH", "PRECEDING", "FOLLOWING", "UNBOUNDED",
+    "CURRENT", "ROW",
+}
+
+READ_ONLY_STARTS = ("SELECT", "WITH", "VALUES")
+
+# Authorizer actions allowed while compiling a read-only statement
+_READ_ACTIONS = {
+    sqlite3.SQLITE_SELECT,
+    sqlite3.SQLITE_READ,
+    sqlite3.SQLITE_FUNCTION,
+    getattr(sqlite3, "SQLITE_RECURSIVE", 33),
+}
+
+# Clauses whose literals are lifted into bound parameters. Select-list
+# literals name result columns and ORDER/GROUP BY numbers are column
+# positions, so those stay inline.
+PARAMETER_CLAUSES = {"WHERE", "HAVING", "ON", "LIMIT", "OFFSET"}
+CLAUSE_WORDS = PARAMETER_CLAUSES | {
+    "SELECT", "FROM", "JOIN", "GROUP", "ORDER", "WINDOW", "VALUES",
+    "UNION", "EXCEPT", "INTERSECT",
+}
+_INT64 = 2 ** 63
+
+# Statement shapes that already compiled against the current schema
+MAX_COMPILED_SHAPES = 512
+
+_schema_lock = threading.Lock()
+_schema_conn = None
+_schema_fingerprint = None
+_compiled_shapes = OrderedDict()  # {(shape, fingerprint): tables}
+
+
+def tokenize_spans(sql: str) -> list:
+    """Split SQL into (kind, text, start, end) tokens, dropping whitespace and comments"""
+    tokens = []
+    pos = 0
+    while pos < len(sql):
+        match = TOKEN_RE.match(sql, pos)
+        if not match:
+            # Unknown character - keep it so the parser reports it
+            tokens.append(("op", sql[pos], pos, pos + 1))
+            pos += 1
+            continue
+        pos = match.end()
+        kind = match.lastgroup
+        if kind in ("space", "comment"):
+            continue
+        tokens.append((kind, match.group(), match.start(), match.end()))
+    return tokens
+
+
+def tokenize(sql: str) -> list:
+    """Split SQL into (kind, text) tokens, dropping whitespace and comments"""
+    return [(kind, text) for kind, text, _, _ in tokenize_spans(sql)]
+
+
+def _join_tokens(tokens: list) -> str:
+    """Render tokens back into a single-spaced SQL string"""
+    out = ""
+    prev_kind, prev = None, None
+    for kind, text in tokens:
+        # Function calls keep their parenthesis attached: avg(x), not avg (x)
+        is_call = text == "(" and prev_kind == "word" and prev.upper() not in SQL_KEYWORDS
+        if out and not (
+            text in (",", ")", ".") or prev in ("(", ".") or is_call
+        ):
+            out += " "
+        out += text
+        prev_kind, prev = kind, text
+    return out
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Canonical form of a statement: comments and trailing semicolons removed,
+    whitespace collapsed and keywords upper-cased. Identifiers and literals
+    are left untouched so the result is safe to execute and to use as a
+    cache key.
+    """
+    tokens = tokenize(sql or "")
+    while tokens and tokens[-1] == ("op", ";"):
+        tokens.pop()
+    canonical = []
+    for kind, text in tokens:
+        if kind == "word" and text.upper() in SQL_KEYWORDS:
+            text = text.upper()
+        canonical.append((kind, text))
+    return _join_tokens(canonical)
+
+
+def _literal_value(kind: str, text: str):
+    """Python value of a string or number literal, or None to keep it inline"""
+    if kind == "string":
+        return text[1:-1].replace("''", "'")
+    if text.lower().startswith("0x"):
+        value = int(text, 16)
+    elif re.fullmatch(r"\d+", text):
+        value = int(text)
+    else:
+        return float(text)
+    # Integers SQLite would read as REAL cannot be bound as int64
+    return value if value < _INT64 else None
+
+
+def parameterize(sql: str):
+    """
+    Lift string and number literals of WHERE, HAVING, ON, LIMIT and OFFSET
+    clauses into ? parameters. Returns (shape, params): statements that only
+    differ in those literals share a shape, so they share prepared statements
+    and cache entries. SQL that already has parameters is returned as is.
+    """
+    tokens = tokenize_spans(sql or "")
+    if any(kind == "param" for kind, _, _, _ in tokens):
+        return sql, ()
+
+    clause = [None]  # current clause per parenthesis depth
+    pieces, params = [], []
+    pos = 0
+    for kind, text, start, end in tokens:
+        if text == "(":
+            # Function arguments belong to the enclosing clause
+            clause.append(clause[-1])
+        elif text == ")" and len(clause) > 1:
+            clause.pop()
+        elif kind == "word" and text.upper() in CLAUSE_WORDS:
+            clause[-1] = text.upper()
+        elif kind in ("string", "number") and clause[-1] in PARAMETER_CLAUSES:
+            value = _literal_value(kind, text)
+            if value is not None:
+                pieces.append(sql[pos:start] + "?")
+                params.append(value)
+                pos = end
+    pieces.append(sql[pos:])
+    return "".join(pieces), tuple(params)
+
+
+def _get_schema_connection(schema: dict):
+    """Return an in-memory database holding empty copies of the schema tables"""
+    global _schema_conn, _schema_fingerprint
+
+    fingerprint = tuple(
+        (table, tuple(cols)) for table, cols in sorted(schema.items())
+        if isinstance(cols, list)
+    )
+    if _schema_conn is not None and fingerprint == _schema_fingerprint:
+        return _schema_conn
+
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    register_functions(conn)
+    for table, cols in fingerprint:
+        col_defs = ", ".join('"{}"'.format(c.replace('"', '""')) for c in cols)
+        conn.execute('CREATE TABLE "{}" ({})'.format(table.replace('"', '""'), col_defs))
+
+    if _schema_conn is not None:
+        _schema_conn.close()
+    _schema_conn = conn
+    _schema_fingerprint = fingerprint
+    return conn
+
+
+def validate_sql(sql: str, schema: dict) -> dict:
+    """
+    Check that generated SQL is a single read-only statement whose tables and
+    columns exist in the schema (as returned by get_tables_with_columns).
+
+    Returns {"sql": normalized_sql, "tables": [...], "parameterized": bool}
+    on success or {"error": message, "sql": sql} on failure. "parameterized"
+    says whether the statement's parameterize() shape compiles; when False
+    it must run with its literals inline.
+    """
+    if not sql or not sql.strip():
+        return {"error": "Empty SQL query", "sql": sql}
+
+    tokens = tokenize(sql)
+    while tokens and tokens[-1] == ("op", ";"):
+        tokens.pop()
+
+    if ("op", ";") in tokens:
+        return {"error": "Only a single SQL statement is allowed", "sql": sql}
+
+    if not tokens or tokens[0][0] != "word" or tokens[0][1].upper() not in READ_ONLY_STARTS:
+        return {"error": "Only read-only SELECT queries are allowed", "sql": sql}
+
+    if isinstance(schema, dict) and "error" in schema:
+        return {"error": f"Schema unavailable: {schema['error']}", "sql": sql}
+
+    normalized = normalize_sql(sql)
+    shape, params = parameterize(normalized)
+    tables = set()
+    denied = []
+
+    def authorizer(action, arg1, arg2, db_name, source):
+        if action not in _READ_ACTIONS:
+            denied.append(action)
+            return sqlite3.SQLITE_DENY
+        if action == sqlite3.SQLITE_READ and arg1:
+            tables.add(arg1)
+        return sqlite3.SQLITE_OK
+
+    with _schema_lock:
+        conn = _get_schema_connection(schema)
+        key = (shape, _schema_fingerprint)
+        if key in _compiled_shapes:
+            _compiled_shapes.move_to_end(key)
+            return {"sql": normalized, "tables": _compiled_shapes[key], "parameterized": True}
+
+        conn.set_authorizer(authorizer)
+        try:
+            # EXPLAIN compiles the statement without reading any data; the
+            # shape is tried first so near-identical questions compile once
+            try:
+                conn.execute("EXPLAIN " + shape, (None,) * len(params))
+                compiled = shape
+            except sqlite3.Error:
+                if denied:
+                    raise
+                tables.clear()
+                conn.execute("EXPLAIN " + normalized)
+                compiled = normalized
+        except sqlite3.Error as e:
+            if denied:
+                return {"error": "Only read-only SELECT queries are allowed", "sql": sql}
+            return {"error": str(e), "sql": sql}
+        finally:
+            conn.set_authorizer(None)
+
+        if compiled == shape:
+            _compiled_shapes[key] = sorted(tables)
+            if len(_compiled_shapes) > MAX_COMPILED_SHAPES:
+                _compiled_shapes.popitem(last=False)
+
+    return {"sql": normalized, "tables": sorted(tables), "parameterized": compiled == shape}
@@ -0,0 +1,43 @@
+import os
+import sqlite3
+import sys
+import threading
+
+import pytest
+
+# Backend modules import each other as top-level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import query_engine  # noqa: E402
+from ingest import ensure_table  # noqa: E402
+
+
+def make_readings(meters=("A", "B", "C"), months=("2025-10", "2025-11", "2025-12"), days=3):
+    """(meter_id, datetime, load) readings with distinct loads"""
+    readings = []
+    for m, meter in enumerate(meters):
+        for month in months:
+            for day in range(1, days + 1):
+                for hour in (0, 12):
+                    load = round(m * 100 + day + hour / 100 + int(month[-2:]) / 1000, 3)
+                    readings.append((meter, f"{month}-{day:02d} {hour:02d}:00:00", load))
+    return readings
+
+
+@pytest.fixture
+def analytics_db(tmp_path, monkeypatch):
+    """A scratch database with a plain forecasted_table, used as the analytics database"""
+    path = str(tmp_path / "analytics.db")
+    conn = sqlite3.connect(path, isolation_level=None)
+    ensure_table(conn)
+    conn.executemany(
+        "INSERT INTO forecasted_table (meter_id, datetime, forecasted_load_kwh) VALUES (?, ?, ?)",
+        make_readings()
+    )
+    conn.close()
+    monkeypatch.setattr(query_engine, "DB_PATH", path)
+    monkeypatch.setattr(query_engine, "ANALYTICS_DB_PATH", None)
+    # Connections cached by earlier tests point at their own databases
+    monkeypatch.setattr(query_engine, "_version_state", {"conn": None, "data_version": None, "versions": {}})
+    monkeypatch.setattr(query_engine, "_local", threading.local())
+    return path
@@ -0,0 +1,22 @@
+from chart_planner import plan_chart_query
+from db import run_sql
+
+SERIES = "SELECT datetime, forecasted_load_kwh FROM forecasted_table WHERE meter_id = 'A' ORDER BY datetime"
+
+
+def test_large_series_is_bucketed_before_it_runs(analytics_db):
+    plan = plan_chart_query(SERIES, "plot load for meter A", width=10)
+    assert plan["bucket"] == "week" and plan["aggregate"] == "AVG"
+
+    bucketed = run_sql(plan["sql"])
+    assert bucketed["columns"] == ["datetime", "forecasted_load_kwh"]
+    assert 1 < len(bucketed["rows"]) <= 10
+
+
+def test_series_that_fits_the_chart_runs_as_is(analytics_db):
+    assert plan_chart_query(SERIES, "plot load for meter A", width=100) is None
+
+
+def test_non_series_runs_as_is(analytics_db):
+    sql = "SELECT meter_id, AVG(forecasted_load_kwh) FROM forecasted_table GROUP BY meter_id"
+    assert plan_chart_query(sql, "plot average load per meter", width=2) is None
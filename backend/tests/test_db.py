@@ -0,0 +1,28 @@
+import db
+from db import run_sql
+from sql_validator import validate_sql
+
+SCHEMA = {"forecasted_table": ["meter_id", "datetime", "forecasted_load_kwh"]}
+
+
+def test_validation_reports_whether_the_shape_binds():
+    validation = validate_sql("SELECT meter_id FROM forecasted_table WHERE meter_id = 'A'", SCHEMA)
+    assert validation["parameterized"] is True
+
+
+def test_runtime_errors_are_not_retried(analytics_db, monkeypatch):
+    calls = []
+
+    def interrupted(sql, layout="rows", params=()):
+        calls.append((sql, params))
+        return {"error": "interrupted"}
+
+    monkeypatch.setattr(db, "_execute", interrupted)
+    result = run_sql("SELECT * FROM forecasted_table WHERE meter_id = 'A'", use_cache=False, parameterized=True)
+    assert result == {"error": "interrupted"}
+    assert calls == [("SELECT * FROM forecasted_table WHERE meter_id = ?", ("A",))]
+
+
+def test_literal_sql_runs_unbound(analytics_db):
+    result = run_sql("SELECT COUNT(*) FROM forecasted_table WHERE meter_id = 'A'", use_cache=False)
+    assert result["rows"] == [(18,)]
@@ -0,0 +1,87 @@
+import sqlite3
+
+from conftest import make_readings
+from ingest import ingest, read_ndjson_lines
+from query_engine import VERSIONS_TABLE, ensure_version_tracking
+
+
+def query(path, sql, params=()):
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+def load(path, meter, when):
+    return query(
+        path, "SELECT forecasted_load_kwh FROM forecasted_table WHERE meter_id = ? AND datetime = ?",
+        (meter, when)
+    )
+
+
+def test_ignore_keeps_existing_readings(analytics_db):
+    before = load(analytics_db, "A", "2025-10-01 00:00:00")
+    readings = read_ndjson_lines([
+        '{"meter_id": "A", "datetime": "2025-10-01T00:00:00Z", "forecasted_load_kwh": 999}',
+        '{"meter_id": "Z", "datetime": "2025-10-01 00:00:00", "forecasted_load_kwh": "1.5"}',
+    ])
+    report = ingest(readings)
+    assert report["rows_read"] == 2
+    assert report["rows_written"] == 1
+    assert report["duplicates"] == 1
+    assert load(analytics_db, "A", "2025-10-01 00:00:00") == before
+    assert load(analytics_db, "Z", "2025-10-01 00:00:00") == [(1.5,)]
+
+
+def test_replace_overwrites_in_place(analytics_db):
+    (row_id,), = query(
+        analytics_db, "SELECT id FROM forecasted_table WHERE meter_id = 'A' AND datetime = '2025-10-01 00:00:00'"
+    )
+    ingest([("A", "2025-10-01 00:00:00", 999.0)], mode="replace")
+    assert query(
+        analytics_db, "SELECT id, forecasted_load_kwh FROM forecasted_table "
+        "WHERE meter_id = 'A' AND datetime = '2025-10-01 00:00:00'"
+    ) == [(row_id, 999.0)]
+    assert query(analytics_db, "SELECT COUNT(*) FROM forecasted_table") == [(len(make_readings()),)]
+
+
+def test_batches_bump_versions_without_schema_changes(analytics_db):
+    conn = sqlite3.connect(analytics_db)
+    ensure_version_tracking(conn)
+    conn.close()
+
+    def state():
+        return (
+            query(analytics_db, "PRAGMA schema_version")[0][0],
+            query(analytics_db, f"SELECT version FROM {VERSIONS_TABLE} WHERE table_name = 'forecasted_table'")[0][0],
+        )
+
+    ingest(make_readings(meters=("W",)))
+    schema_before, version_before = state()
+    ingest(make_readings(meters=("W",)))
+    one_batch = state()[0] - schema_before
+
+    readings = make_readings(meters=("X",))
+    schema_before, version_before = state()
+    ingest(readings, batch_size=4)
+    schema_after, version_after = state()
+    assert version_after - version_before == -(-len(readings) // 4)
+    # Triggers are dropped and recreated once per load, not per batch
+    assert schema_after - schema_before == one_batch
+
+    # Writes outside the loader are tracked again
+    query(analytics_db, "DELETE FROM forecasted_table WHERE meter_id = 'X'")
+    assert state()[1] > version_after
+
+
+def test_failed_load_restores_triggers(analytics_db):
+    conn = sqlite3.connect(analytics_db)
+    ensure_version_tracking(conn)
+    conn.close()
+    try:
+        ingest([("Y", "2025-10-01 00:00:00", 1.0), ("Y", None, "not a number")], batch_size=1)
+    except Exception:
+        pass
+    triggers = query(analytics_db, "SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'forecasted_table'")
+    assert triggers == [(3,)]
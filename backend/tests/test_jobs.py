@@ -0,0 +1,57 @@
+import asyncio
+import threading
+import time
+
+import jobs
+from db import run_sql
+from query_engine import get_read_connection
+
+# Counts far enough that it only finishes early when interrupted
+LONG_QUERY = (
+    "WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n LIMIT 500000000) "
+    "SELECT COUNT(*) FROM n WHERE x > 0"
+)
+
+
+def run_long_query(token):
+    """Job work that registers the same interrupt hook answer_question does"""
+    interrupt = get_read_connection().interrupt
+    token.add_hook(interrupt)
+    try:
+        return run_sql(LONG_QUERY, use_cache=False, parameterized=True)
+    finally:
+        token.remove_hook(interrupt)
+
+
+def test_cancel_interrupts_a_running_query(analytics_db):
+    job = jobs.submit_job(1, run_long_query)
+    while job.status == jobs.QUEUED:
+        time.sleep(0.01)
+    time.sleep(0.2)
+
+    started = time.time()
+    jobs.cancel_job(job)
+    assert job.done.wait(5)
+    assert time.time() - started < 5
+    assert job.status == jobs.CANCELLED
+
+
+def test_wait_for_job_wakes_when_the_job_finishes():
+    job = jobs.submit_job(1, lambda token: time.sleep(0.2) or "answer")
+
+    async def poll():
+        started = time.time()
+        await jobs.wait_for_job(job, 10)
+        return time.time() - started
+
+    assert asyncio.run(poll()) < 5
+    assert job.status == jobs.DONE and job.result == "answer"
+
+
+def test_wait_for_job_times_out():
+    release = threading.Event()
+    job = jobs.submit_job(1, lambda token: release.wait(5))
+    asyncio.run(jobs.wait_for_job(job, 0.1))
+    assert job.status not in jobs.FINISHED
+    release.set()
+    assert job.done.wait(5)
@@ -0,0 +1,62 @@
+import random
+import sqlite3
+
+import pytest
+
+from ingest import ingest
+from meter_stats import answer_from_stats, rebuild, SKETCH_ALPHA
+from query_engine import open_read_connection
+from sql_validator import normalize_sql
+
+
+@pytest.fixture
+def stats_db(analytics_db):
+    rng = random.Random(7)
+    readings = [
+        (meter, f"2026-01-{day:02d} {hour:02d}:00:00", round(rng.lognormvariate(1, 0.8), 4))
+        for meter in ("A", "B", "C") for day in range(1, 29) for hour in range(24)
+    ]
+    conn = sqlite3.connect(analytics_db, isolation_level=None)
+    conn.execute("DELETE FROM forecasted_table")
+    conn.close()
+    ingest(readings)
+    conn = sqlite3.connect(analytics_db, isolation_level=None)
+    rebuild(conn)
+    conn.close()
+    return analytics_db
+
+
+def exact(sql):
+    conn = open_read_connection()
+    try:
+        return conn.execute(sql).fetchall()
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT meter_id, median(forecasted_load_kwh), percentile(forecasted_load_kwh, 90) AS p90 "
+    "FROM forecasted_table GROUP BY meter_id ORDER BY p90 DESC",
+    "SELECT percentile(forecasted_load_kwh, 99.5) FROM forecasted_table",
+    "SELECT MEDIAN(forecasted_load_kwh) FROM forecasted_table WHERE meter_id = 'B'",
+])
+def test_quantiles_within_sketch_bound(stats_db, sql):
+    result = answer_from_stats(normalize_sql(sql))
+    assert result is not None
+    expected = exact(sql)
+    assert len(result["rows"]) == len(expected)
+    for row, expected_row in zip(result["rows"], expected):
+        for value, exact_value in zip(row, expected_row):
+            if isinstance(exact_value, str):
+                assert value == exact_value
+            else:
+                assert abs(value - exact_value) <= SKETCH_ALPHA * abs(exact_value)
+    bounds = result["approximate"]["error_bounds"]
+    assert set(b["relative"] for b in bounds.values()) == {SKETCH_ALPHA}
+
+
+def test_running_aggregates_are_exact(stats_db):
+    sql = "SELECT meter_id, COUNT(*), AVG(forecasted_load_kwh) FROM forecasted_table GROUP BY meter_id"
+    result = answer_from_stats(normalize_sql(sql))
+    assert [(m, n) for m, n, _ in result["rows"]] == [(m, n) for m, n, _ in exact(sql)]
+    assert all(b["relative"] == 0.0 for b in result["approximate"]["error_bounds"].values())
@@ -0,0 +1,102 @@
+import sqlite3
+
+import pytest
+
+import partitions
+from conftest import make_readings
+from ingest import ingest
+from partitions import migrate, prune_partitions, partition_name
+
+MONTHS = ["2025-10", "2025-11", "2025-12"]
+
+
+@pytest.fixture
+def partitioned_db(analytics_db, monkeypatch):
+    conn = sqlite3.connect(analytics_db, isolation_level=None)
+    migrate(conn)
+    conn.close()
+    monkeypatch.setattr(partitions, "get_partition_months", lambda: MONTHS)
+    return analytics_db
+
+
+def rows(path, sql):
+    conn = sqlite3.connect(path)
+    try:
+        return sorted(conn.execute(sql).fetchall(), key=repr)
+    finally:
+        conn.close()
+
+
+def test_prunes_to_months_in_range(monkeypatch):
+    monkeypatch.setattr(partitions, "get_partition_months", lambda: MONTHS)
+    sql = prune_partitions("SELECT * FROM forecasted_table WHERE datetime >= '2025-12-01'")
+    assert partition_name("2025-12") in sql
+    assert partition_name("2025-11") not in sql
+
+
+def test_or_predicates_are_not_pruned(monkeypatch):
+    monkeypatch.setattr(partitions, "get_partition_months", lambda: MONTHS)
+    sql = "SELECT * FROM forecasted_table WHERE datetime >= '2025-12-01' OR meter_id = 'A'"
+    assert prune_partitions(sql) == sql
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM forecasted_table "
+    "WHERE CASE WHEN datetime >= '2025-12-01' THEN 1 ELSE 0 END = 1 OR meter_id = 'A'",
+    "SELECT * FROM forecasted_table WHERE CASE WHEN datetime >= '2025-12-01' THEN 0 ELSE 1 END = 1",
+    "SELECT * FROM forecasted_table "
+    "WHERE CASE WHEN meter_id = 'A' THEN CASE WHEN datetime < '2025-11-01' THEN 1 END END = 1",
+])
+def test_case_comparisons_are_not_bounds(monkeypatch, sql):
+    monkeypatch.setattr(partitions, "get_partition_months", lambda: MONTHS)
+    assert prune_partitions(sql) == sql
+
+
+def test_other_alias_bound_is_not_applied(monkeypatch):
+    monkeypatch.setattr(partitions, "get_partition_months", lambda: MONTHS)
+    sql = (
+        "SELECT a.meter_id FROM forecasted_table a JOIN forecasted_table b ON a.meter_id = b.meter_id "
+        "WHERE b.datetime LIKE '2025-11%'"
+    )
+    pruned = prune_partitions(sql)
+    # Only b is restricted; a still reads the full view
+    assert "FROM forecasted_table a JOIN" in pruned
+    assert f"(SELECT * FROM {partition_name('2025-11')}) b" in pruned
+
+
+@pytest.mark.parametrize("sql", [
+    # Month-over-month self-join
+    "SELECT a.meter_id, a.datetime, a.forecasted_load_kwh - b.forecasted_load_kwh "
+    "FROM forecasted_table a JOIN forecasted_table b "
+    "ON a.meter_id = b.meter_id AND substr(a.datetime, 9) = substr(b.datetime, 9) "
+    "WHERE a.datetime LIKE '2025-12%' AND b.datetime LIKE '2025-11%' AND a.meter_id = 'A'",
+    "SELECT COUNT(*) FROM forecasted_table AS a, forecasted_table AS b "
+    "WHERE a.meter_id = b.meter_id AND a.datetime = b.datetime AND '2025-12-01' <= b.datetime",
+    "SELECT COUNT(*) FROM forecasted_table WHERE datetime BETWEEN '2025-11-01' AND '2025-11-30'",
+    "SELECT meter_id, SUM(forecasted_load_kwh) FROM forecasted_table "
+    "WHERE forecasted_table.datetime < '2025-11-01' GROUP BY meter_id",
+])
+def test_pruned_query_returns_same_rows(partitioned_db, sql):
+    expected = rows(partitioned_db, sql)
+    assert expected
+    assert rows(partitioned_db, prune_partitions(sql)) == expected
+
+
+def test_migration_keeps_ids(analytics_db):
+    before = rows(analytics_db, "SELECT id, meter_id, datetime FROM forecasted_table")
+    conn = sqlite3.connect(analytics_db, isolation_level=None)
+    migrate(conn)
+    conn.close()
+    assert rows(analytics_db, "SELECT id, meter_id, datetime FROM forecasted_table") == before
+
+
+def test_ingested_ids_are_unique_across_partitions(partitioned_db):
+    readings = make_readings(meters=("D", "E"), months=("2025-11", "2025-12", "2026-01"))
+    ingest(readings)
+    count, distinct, max_before = rows(
+        partitioned_db,
+        "SELECT COUNT(*), COUNT(DISTINCT id), (SELECT MAX(id) FROM forecasted_table WHERE meter_id < 'D') "
+        "FROM forecasted_table"
+    )[0]
+    assert count == distinct == len(make_readings()) + len(readings)
+    assert rows(partitioned_db, "SELECT MIN(id) FROM forecasted_table WHERE meter_id >= 'D'")[0][0] > max_before
@@ -0,0 +1,45 @@
+import sqlite3
+
+import pytest
+
+import query_engine
+from query_engine import build_snapshot, get_read_connection, open_read_connection
+
+
+@pytest.fixture
+def snapshot(analytics_db, monkeypatch):
+    monkeypatch.setattr(query_engine, "_snapshot", {
+        "uri": None, "generation": 0, "keeper": None, "versions": None, "schema_version": None
+    })
+    monkeypatch.setattr(query_engine, "_snapshot_readers", {})
+    yield
+    query_engine._snapshot["keeper"].close()
+
+
+def table_count(uri):
+    conn = sqlite3.connect(uri, uri=True)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table'").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_old_snapshots_are_freed_even_with_idle_readers(snapshot):
+    build_snapshot()
+    first_uri = query_engine._snapshot["uri"]
+    idle = get_read_connection()
+    other = open_read_connection()
+    assert idle.execute("SELECT COUNT(*) FROM forecasted_table").fetchone()[0] == 54
+
+    build_snapshot()
+    # The previous copy stays readable until its readers move on
+    assert table_count(first_uri) > 0
+    build_snapshot()
+
+    assert table_count(first_uri) == 0
+    with pytest.raises(sqlite3.ProgrammingError):
+        other.execute("SELECT 1")
+    assert query_engine._snapshot_readers == {}
+    # The idle thread reopens on the current copy
+    assert get_read_connection().execute("SELECT COUNT(*) FROM forecasted_table").fetchone()[0] == 54
+    assert list(query_engine._snapshot_readers) == [3]
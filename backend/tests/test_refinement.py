@@ -0,0 +1,94 @@
+import sqlite3
+
+import pytest
+
+from refinement import refine
+
+DECLARED = {"id": "INTEGER", "meter_id": "TEXT", "datetime": "TEXT", "forecasted_load_kwh": "REAL"}
+
+
+@pytest.fixture
+def conn(analytics_db):
+    conn = sqlite3.connect(analytics_db)
+    yield conn
+    conn.close()
+
+
+def run(conn, sql):
+    cur = conn.execute(sql)
+    return {"columns": [d[0] for d in cur.description], "rows": cur.fetchall()}
+
+
+def refined(conn, previous_sql, new_sql):
+    return refine(new_sql, previous_sql, run(conn, previous_sql), declared=DECLARED)
+
+
+@pytest.mark.parametrize("previous_sql, new_sql", [
+    (
+        "SELECT meter_id, datetime, forecasted_load_kwh FROM forecasted_table WHERE datetime LIKE '2025-12%'",
+        "SELECT meter_id, datetime, forecasted_load_kwh FROM forecasted_table "
+        "WHERE datetime LIKE '2025-12%' AND meter_id = 'A' ORDER BY datetime DESC",
+    ),
+    (
+        "SELECT * FROM forecasted_table WHERE meter_id = 'B'",
+        "SELECT * FROM forecasted_table WHERE meter_id = 'B' AND forecasted_load_kwh > 102 ORDER BY id",
+    ),
+    (
+        "SELECT meter_id, forecasted_load_kwh FROM forecasted_table WHERE datetime >= '2025-11-01'",
+        "SELECT meter_id, AVG(forecasted_load_kwh), COUNT(*) FROM forecasted_table "
+        "WHERE datetime >= '2025-11-01' GROUP BY meter_id ORDER BY meter_id",
+    ),
+    (
+        "SELECT meter_id, datetime FROM forecasted_table WHERE meter_id IN ('A', 'C')",
+        "SELECT meter_id, datetime FROM forecasted_table WHERE meter_id IN ('A', 'C') "
+        "AND datetime BETWEEN '2025-10-01' AND '2025-10-02 23:59:59' ORDER BY datetime, meter_id LIMIT 3",
+    ),
+    (
+        "SELECT meter_id, SUM(forecasted_load_kwh) AS total FROM forecasted_table GROUP BY meter_id ORDER BY total DESC",
+        "SELECT meter_id, SUM(forecasted_load_kwh) AS total FROM forecasted_table "
+        "WHERE meter_id <> 'B' GROUP BY meter_id ORDER BY total DESC",
+    ),
+])
+def test_refinement_matches_direct_execution(conn, previous_sql, new_sql):
+    result = refined(conn, previous_sql, new_sql)
+    assert result is not None
+    expected = run(conn, new_sql)
+    assert result["columns"] == expected["columns"]
+    assert [tuple(r) for r in result["rows"]] == expected["rows"]
+    for actual_row, expected_row in zip(result["rows"], expected["rows"]):
+        assert [type(v) for v in actual_row] == [type(v) for v in expected_row]
+
+
+@pytest.mark.parametrize("previous_sql, new_sql", [
+    # * would only expand to the previous projection's columns
+    (
+        "SELECT meter_id, datetime FROM forecasted_table WHERE datetime LIKE '2025-12%'",
+        "SELECT * FROM forecasted_table WHERE datetime LIKE '2025-12%' AND meter_id = 'A'",
+    ),
+    (
+        "SELECT meter_id, datetime FROM forecasted_table AS f WHERE datetime LIKE '2025-12%'",
+        "SELECT f.* FROM forecasted_table AS f WHERE datetime LIKE '2025-12%' AND meter_id = 'A'",
+    ),
+    # Unordered LIMIT keeps rows in base scan order, not the copy's order
+    (
+        "SELECT meter_id, datetime FROM forecasted_table WHERE meter_id <> 'B' ORDER BY datetime DESC",
+        "SELECT meter_id, datetime FROM forecasted_table WHERE meter_id <> 'B' AND meter_id = 'A' LIMIT 2",
+    ),
+    # A condition of the previous statement is dropped
+    (
+        "SELECT meter_id, datetime FROM forecasted_table WHERE meter_id = 'A'",
+        "SELECT meter_id, datetime FROM forecasted_table WHERE meter_id = 'B'",
+    ),
+    # A column the previous result does not have
+    (
+        "SELECT meter_id, datetime FROM forecasted_table WHERE meter_id = 'A'",
+        "SELECT meter_id, datetime FROM forecasted_table WHERE meter_id = 'A' AND forecasted_load_kwh > 5",
+    ),
+    # Previous result was itself limited
+    (
+        "SELECT * FROM forecasted_table ORDER BY id LIMIT 5",
+        "SELECT * FROM forecasted_table WHERE meter_id = 'A' ORDER BY id LIMIT 5",
+    ),
+])
+def test_unprovable_refinements_fall_back(conn, previous_sql, new_sql):
+    assert refined(conn, previous_sql, new_sql) is None
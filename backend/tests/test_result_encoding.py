@@ -0,0 +1,13 @@
+import pytest
+
+from result_encoding import arrow_ipc
+
+pa = pytest.importorskip("pyarrow")
+
+
+def test_arrow_ipc_is_a_raw_stream_with_metadata():
+    payload = arrow_ipc(["meter_id", "load"], [["A", "B"], [1.5, None]], {"sql": '"SELECT 1"'})
+    table = pa.ipc.open_stream(payload).read_all()
+    assert table.column_names == ["meter_id", "load"]
+    assert table.column("load").to_pylist() == [1.5, None]
+    assert table.schema.metadata[b"sql"] == b'"SELECT 1"'
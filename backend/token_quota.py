@@ -0,0 +1,166 @@
+"""
+Per-user LLM token quotas backed by the token_count table.
+
+Tokens reported by Ollama (prompt_eval_count + eval_count) are charged to
+in-memory counters, which a background thread flushes to token_count every
+FLUSH_INTERVAL_SECONDS in one transaction. Each user gets a fresh allowance
+when their renewtime passes. /ask calls check_quota() before generating SQL.
+
+Counters live in this process, so with several API workers a user can
+overspend by at most what the other workers have not flushed yet.
+"""
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+DB_PATH = "./../mydata.db"
+
+# Tokens per renewal window by role; None means unlimited
+TOKENS_PER_WINDOW_BY_ROLE = {
+    "admin": None,
+    "user": 200_000,
+}
+DEFAULT_TOKENS_PER_WINDOW = 200_000
+RENEW_INTERVAL_HOURS = 24
+
+FLUSH_INTERVAL_SECONDS = 30
+
+_lock = threading.Lock()
+_accounts = {}  # {user_id: {"tokens_left", "renewtime", "dirty"}}
+_stop_event = threading.Event()
+_flusher = None
+
+
+def ensure_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS token_count (
+            user_id INTEGER NOT NULL,
+            tokens_left INTEGER NOT NULL,
+            renewtime datetime NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    """)
+
+
+def get_allowance(role: str):
+    return TOKENS_PER_WINDOW_BY_ROLE.get(role, DEFAULT_TOKENS_PER_WINDOW)
+
+
+def _next_renewtime() -> str:
+    return (datetime.now() + timedelta(hours=RENEW_INTERVAL_HOURS)).isoformat()
+
+
+def _load_account(user_id: int, allowance: int) -> dict:
+    """Read a user's counter from token_count, starting a new window if there is none"""
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        ensure_table(conn)
+        row = conn.execute(
+            "SELECT tokens_left, renewtime FROM token_count WHERE user_id = ?", (user_id,)
+        ).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return {"tokens_left": allowance, "renewtime": _next_renewtime(), "dirty": True}
+    return {"tokens_left": row[0], "renewtime": row[1], "dirty": False}
+
+
+def _get_account(user_id: int, allowance: int) -> dict:
+    """Cached counter for a user, renewed when its window has ended (caller holds _lock)"""
+    account = _accounts.get(user_id)
+    if account is None:
+        account = _load_account(user_id, allowance)
+        _accounts[user_id] = account
+    # Stored times may use either "T" or a space between date and time
+    if str(account["renewtime"]).replace(" ", "T") <= datetime.now().isoformat():
+        account.update(tokens_left=allowance, renewtime=_next_renewtime(), dirty=True)
+    return account
+
+
+def check_quota(user_id: int, role: str) -> dict:
+    """
+    Whether a user may call the model now:
+    {"allowed", "tokens_left", "renewtime"}; tokens_left is None when unlimited.
+    """
+    allowance = get_allowance(role)
+    if allowance is None:
+        return {"allowed": True, "tokens_left": None, "renewtime": None}
+    with _lock:
+        account = _get_account(user_id, allowance)
+        return {
+            "allowed": account["tokens_left"] > 0,
+            "tokens_left": max(account["tokens_left"], 0),
+            "renewtime": account["renewtime"],
+        }
+
+
+def record_usage(user_id: int, tokens: int):
+    """
+    Charge tokens used by one model call to a user's counter. Only users
+    loaded by check_quota() are charged, so unlimited roles are skipped.
+    """
+    with _lock:
+        account = _accounts.get(user_id)
+        if account is None or tokens <= 0:
+            return
+        account["tokens_left"] -= tokens
+        account["dirty"] = True
+
+
+def flush() -> int:
+    """Write changed counters to token_count in one transaction; returns how many"""
+    with _lock:
+        pending = [
+            (user_id, account["tokens_left"], account["renewtime"])
+            for user_id, account in _accounts.items() if account["dirty"]
+        ]
+        for user_id, _, _ in pending:
+            _accounts[user_id]["dirty"] = False
+    if not pending:
+        return 0
+
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    try:
+        ensure_table(conn)
+        with conn:
+            for user_id, tokens_left, renewtime in pending:
+                # token_count has no unique key on user_id, so update before inserting
+                updated = conn.execute(
+                    "UPDATE token_count SET tokens_left = ?, renewtime = ? WHERE user_id = ?",
+                    (tokens_left, renewtime, user_id)
+                ).rowcount
+                if not updated:
+                    conn.execute(
+                        "INSERT INTO token_count (user_id, tokens_left, renewtime) VALUES (?, ?, ?)",
+                        (user_id, tokens_left, renewtime)
+                    )
+    except Exception as e:
+        print(f"Error flushing token counts: {e}")
+        with _lock:
+            for user_id, _, _ in pending:
+                if user_id in _accounts:
+                    _accounts[user_id]["dirty"] = True
+        return 0
+    finally:
+        conn.close()
+    return len(pending)
+
+
+def _flusher_loop():
+    while not _stop_event.wait(FLUSH_INTERVAL_SECONDS):
+        flush()
+
+
+def start_flusher():
+    """Flush token counters in a daemon thread every FLUSH_INTERVAL_SECONDS"""
+    global _flusher
+    if _flusher is not None and _flusher.is_alive():
+        return
+    _stop_event.clear()
+    _flusher = threading.Thread(target=_flusher_loop, name="token-flusher", daemon=True)
+    _flusher.start()
+
+
+def stop_flusher():
+    _stop_event.set()
+    flush()
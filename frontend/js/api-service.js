@@ -75,6 +75,7 @@ class ApiService {
         query,
         conversation_id: conversationId,
         conversation_history: conversationHistory,
+        chart_width: window.innerWidth,
       }),
     });
 
@@ -113,6 +114,19 @@ class ApiService {
     return await res.json();
   }
 
+  async exportMessageResult(conversationId, messageId, format = "csv") {
+    const res = await fetch(
+      `${API_URL}/conversations/${conversationId}/messages/${messageId}/export?format=${format}`,
+      { headers: this.getHeaders() }
+    );
+
+    if (!res.ok) {
+      throw new Error("Failed to export result");
+    }
+
+    return await res.blob();
+  }
+
   async getContext(conversationId) {
     const res = await fetch(`${API_URL}/context/${conversationId}`, {
       headers: this.getHeaders(),
@@ -138,6 +152,67 @@ class ApiService {
   return await res.json();
 }
 
+  // Streams /conversations/events (Server-Sent Events) through fetch so the
+  // Authorization header is sent; reconnects with Last-Event-ID after drops.
+  // Returns a function that closes the channel.
+  subscribeConversationEvents(onEvent) {
+    const controller = new AbortController();
+    let lastEventId = null;
+
+    const connect = async () => {
+      const headers = this.getHeaders();
+      if (lastEventId) {
+        headers["Last-Event-ID"] = lastEventId;
+      }
+      const res = await fetch(`${API_URL}/conversations/events`, {
+        headers,
+        signal: controller.signal,
+      });
+      if (!res.ok) {
+        throw new Error("Failed to open conversation events");
+      }
+
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let end;
+        while ((end = buffer.indexOf("\n\n")) !== -1) {
+          const block = buffer.slice(0, end);
+          buffer = buffer.slice(end + 2);
+          const event = { type: "message", data: "" };
+          for (const line of block.split("\n")) {
+            if (line.startsWith("id: ")) lastEventId = line.slice(4);
+            else if (line.startsWith("event: ")) event.type = line.slice(7);
+            else if (line.startsWith("data: ")) event.data += line.slice(6);
+          }
+          if (event.data) {
+            onEvent(event.type, JSON.parse(event.data));
+          }
+        }
+      }
+    };
+
+    const run = async () => {
+      while (!controller.signal.aborted) {
+        try {
+          await connect();
+        } catch (error) {
+          if (controller.signal.aborted) return;
+          console.warn("Conversation events disconnected:", error);
+        }
+        await new Promise((resolve) => setTimeout(resolve, 3000));
+      }
+    };
+    run();
+
+    return () => controller.abort();
+  }
+
   async clearContext(conversationId) {
     const res = await fetch(`${API_URL}/context/${conversationId}`, {
       method: "DELETE",
@@ -29,6 +29,11 @@ class App {
     
     // Load conversations from server (this will also load the most recent one)
     await conversationUI.loadConversationsFromServer();
+
+    // Keep the sidebar in sync with changes pushed by the server
+    apiService.subscribeConversationEvents((type, data) =>
+      conversationUI.applyServerEvent(type, data)
+    );
     
     this.setupEventListeners();
     this.preventFormSubmission();
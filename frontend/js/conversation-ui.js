@@ -143,6 +143,51 @@ class ConversationUI {
     return id;
   }
 
+  // Applies a pushed change from /conversations/events to local state
+  async applyServerEvent(type, data) {
+    if (type === "resync") {
+      await this.loadConversationsFromServer();
+      return;
+    }
+
+    const id = data.conversation_id;
+    const conv = this.conversations[id];
+
+    if (type === "conversation_created" && !conv) {
+      this.conversations[id] = {
+        title: data.title || "New Chat",
+        created_at: data.created_at,
+        last_updated: data.created_at,
+        messages: [],
+        loaded: false
+      };
+    } else if (type === "message_created") {
+      if (!conv) {
+        this.conversations[id] = {
+          title: "New Chat",
+          created_at: data.created_at,
+          messages: [],
+          loaded: false
+        };
+      }
+      this.conversations[id].last_updated = data.created_at;
+      // Messages added from another tab are fetched when the chat is opened
+      if (id !== this.currentConversationId) {
+        this.conversations[id].loaded = false;
+      }
+    } else if (type === "title_updated" && conv) {
+      conv.title = data.title;
+    } else if (type === "conversation_deleted" && conv) {
+      delete this.conversations[id];
+      if (id === this.currentConversationId) {
+        this.createNewConversation();
+        return;
+      }
+    }
+
+    this.renderConversationList();
+  }
+
   getCurrentConversationId() {
     return this.currentConversationId;
   }